@@ -11,6 +11,36 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Compilation result cache (set COMPILE_CACHE_DIR to keep results across restarts)
+app.config['COMPILE_CACHE_ENTRIES'] = int(os.environ.get("COMPILE_CACHE_ENTRIES", "256"))
+app.config['COMPILE_CACHE_MAX_BYTES'] = int(os.environ.get("COMPILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+app.config['COMPILE_CACHE_DIR'] = os.environ.get("COMPILE_CACHE_DIR") or None
+
+# Batch compilation process pool (defaults to one worker per core)
+app.config['BATCH_WORKERS'] = int(os.environ.get("BATCH_WORKERS", "0")) or None
+app.config['BATCH_MAX_UNITS'] = int(os.environ.get("BATCH_MAX_UNITS", "10000"))
+
+# Sources with at least this many functions are compiled one function at a
+# time across the batch pool, each through a cache of this many entries
+app.config['FUNCTION_SPLIT_MIN'] = int(os.environ.get("FUNCTION_SPLIT_MIN", "8"))
+app.config['FUNCTION_CACHE_ENTRIES'] = int(os.environ.get("FUNCTION_CACHE_ENTRIES", "4096"))
+
+# Compile-time limits: sources above the size limit are refused (use
+# /compile/stream for those); past part of the time budget the optimizer
+# drops expensive passes and reports which ones it skipped
+app.config['COMPILE_MAX_INPUT_BYTES'] = int(os.environ.get("COMPILE_MAX_INPUT_BYTES", str(8 * 1024 * 1024)))
+app.config['COMPILE_TIME_BUDGET'] = float(os.environ.get("COMPILE_TIME_BUDGET", "5.0")) or None
+
+# Asynchronous compile jobs (/jobs): worker threads, queued jobs allowed
+# before submissions are refused, and how long finished results are kept
+app.config['JOB_WORKERS'] = int(os.environ.get("JOB_WORKERS", "2"))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get("JOB_MAX_PENDING", "100"))
+app.config['JOB_RESULT_TTL'] = float(os.environ.get("JOB_RESULT_TTL", "600"))
+
+# Editor sessions (/sessions): how many are kept and how long an idle one lives
+app.config['SESSION_MAX'] = int(os.environ.get("SESSION_MAX", "1000"))
+app.config['SESSION_IDLE_TTL'] = float(os.environ.get("SESSION_IDLE_TTL", "1800"))
+
 # Import routes after app creation to avoid circular imports
 from routes import *
 
@@ -0,0 +1,135 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from .x86_compiler import X86Compiler
+
+logger = logging.getLogger(__name__)
+
+# Per-process compiler, created once by the pool initializer
+_worker_compiler = None
+
+
+def _init_worker():
+    """Warm up a pool worker with its own long-lived compiler"""
+    global _worker_compiler
+    _worker_compiler = X86Compiler()
+
+
+def _compile_chunk(units, time_budget=None):
+    """Compile a chunk of (id, assembly_code, optimization_level) tuples in a worker"""
+    compiler = _worker_compiler or X86Compiler()
+    results = []
+    for unit_id, assembly_code, optimization_level in units:
+        try:
+            result = compiler.compile(assembly_code, optimization_level, time_budget=time_budget)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        result['id'] = unit_id
+        results.append(result)
+    return results
+
+
+class BatchCompiler:
+    """Compiles many translation units across a reusable process pool"""
+
+    def __init__(self, max_workers=None, chunk_size=None, time_budget=None, max_input_bytes=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # Per-unit limits, as for single compilations
+        self.time_budget = time_budget
+        self.max_input_bytes = max_input_bytes
+        self._executor = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.units = 0
+        self.failures = 0
+
+    def compile_batch(self, units):
+        """Compile units (dicts with id, assembly_code, optimization_level) in input order"""
+        results = [None] * len(units)
+        pending = []
+
+        for position, unit in enumerate(units):
+            error = self._validate(unit)
+            if error:
+                results[position] = {'id': self._unit_id(unit, position), 'success': False, 'error': error}
+                continue
+            pending.append((position, (
+                self._unit_id(unit, position),
+                unit['assembly_code'],
+                unit.get('optimization_level', 'none')
+            )))
+
+        chunks = self._chunk(pending)
+        executor = self._get_executor()
+        futures = [executor.submit(_compile_chunk, [item for _, item in chunk], self.time_budget) for chunk in chunks]
+
+        for chunk, future in zip(chunks, futures):
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                # A crashed worker only fails the units it was holding
+                logger.error(f"Batch worker failed: {str(e)}")
+                chunk_results = [{'id': item[0], 'success': False, 'error': f'Worker failed: {str(e)}'}
+                                 for _, item in chunk]
+                self._reset_executor()
+            for (position, _), result in zip(chunk, chunk_results):
+                results[position] = result
+
+        with self._lock:
+            self.batches += 1
+            self.units += len(units)
+            self.failures += sum(1 for result in results if not result.get('success'))
+        return results
+
+    def stats(self):
+        """Pool size and batch counters"""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'batches': self.batches,
+                'units': self.units,
+                'failures': self.failures
+            }
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _chunk(self, pending):
+        # Several units per task amortizes pickling and IPC for small units
+        size = self.chunk_size or max(1, -(-len(pending) // (self.max_workers * 4)))
+        return [pending[start:start + size] for start in range(0, len(pending), size)]
+
+    def _unit_id(self, unit, position):
+        if isinstance(unit, dict) and unit.get('id') is not None:
+            return unit['id']
+        return position
+
+    def _validate(self, unit):
+        if not isinstance(unit, dict):
+            return 'Each unit must be an object with id, assembly_code and optimization_level'
+        code = unit.get('assembly_code')
+        if not isinstance(code, str) or not code.strip():
+            return 'Please provide assembly code to compile'
+        if self.max_input_bytes is not None and len(code) > self.max_input_bytes:
+            return f"Input too large: {len(code)} bytes (limit {self.max_input_bytes})"
+        if not isinstance(unit.get('optimization_level', 'none'), str):
+            return 'optimization_level must be a string'
+        return None
@@ -1,6 +1,10 @@
 import time
 import logging
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cfg import ControlFlowGraph
+from .costmodel import REFERENCE_MODEL
+from .emulator import DEFAULT_INPUTS, EmulationError, compare
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +15,28 @@ class BenchmarkRunner:
         self.benchmark_stages = [
             'code_size_analysis',
             'compile_time_measurement', 
+            'static_cost_model',
+            'runtime_measurement',
             'optimization_effectiveness',
             'x64_feature_utilization'
         ]
+        
+        # Instructions each version may execute in the emulator before the
+        # measurement stops (programs can loop forever on the default inputs)
+        self.emulation_steps = 200000
+        
+        # Static throughput model used to estimate cycles without running the code
+        self.cost_model = REFERENCE_MODEL
     
-    def run_benchmarks(self, original_code: str, compiled_code: str, optimization_level: str) -> Dict:
-        """Run all benchmark stages and return results"""
+    def run_benchmarks(self, summary: Dict, optimization_level: str, stats: Optional[Dict] = None,
+                       programs: Optional[Tuple[Sequence, Sequence]] = None) -> Dict:
+        """Run all benchmark stages on a compile result's IR summary and stage statistics
+        
+        programs is the (translated unoptimized, optimized) IR pair; when given,
+        both are costed by the static model and executed in the emulator, and
+        the ratings follow the modelled and measured speedups rather than the
+        instruction counts.
+        """
         results = {
             'optimization_level': optimization_level,
             'timestamp': time.time(),
@@ -24,19 +44,29 @@ class BenchmarkRunner:
         }
         
         try:
-            # Stage 1: Code Size Analysis
-            results['stages']['code_size'] = self._analyze_code_size(original_code, compiled_code)
+            # Stage 1: Static cost (cycles estimated per block and loop)
+            static_cost = self._estimate_static_cost(programs) if programs is not None else None
+            if static_cost is not None:
+                results['stages']['static_cost'] = static_cost
             
-            # Stage 2: Compilation Time (simulated)
-            results['stages']['compile_time'] = self._measure_compile_time(optimization_level)
+            # Stage 2: Code Size Analysis
+            results['stages']['code_size'] = self._analyze_code_size(summary, static_cost)
             
-            # Stage 3: Optimization Effectiveness
+            # Stage 3: Compilation Time (measured by the compiler)
+            results['stages']['compile_time'] = self._measure_compile_time(stats)
+            
+            # Stage 4: Runtime (both versions executed on the same inputs)
+            runtime = self._measure_runtime(programs) if programs is not None else None
+            if runtime is not None:
+                results['stages']['runtime'] = runtime
+            
+            # Stage 5: Optimization Effectiveness
             results['stages']['optimization'] = self._analyze_optimization_effectiveness(
-                original_code, compiled_code, optimization_level
+                summary, optimization_level, static_cost, runtime
             )
             
-            # Stage 4: x64 Feature Utilization
-            results['stages']['x64_features'] = self._analyze_x64_features(compiled_code)
+            # Stage 6: x64 Feature Utilization
+            results['stages']['x64_features'] = self._analyze_x64_features(summary)
             
             # Calculate overall performance score
             results['overall_score'] = self._calculate_overall_score(results['stages'])
@@ -47,49 +77,98 @@ class BenchmarkRunner:
         
         return results
     
-    def _analyze_code_size(self, original: str, compiled: str) -> Dict:
-        """Analyze code size reduction and efficiency"""
-        original_lines = [l.strip() for l in original.split('\n') if l.strip() and not l.strip().startswith(';')]
-        compiled_lines = [l.strip() for l in compiled.split('\n') if l.strip() and not l.strip().startswith(';')]
+    def _estimate_static_cost(self, programs: Tuple[Sequence, Sequence]) -> Dict:
+        """Modelled cycles of the unoptimized and optimized programs, weighting loop blocks by nesting"""
+        baseline, optimized = (self.cost_model.analyze(ControlFlowGraph(list(program))) for program in programs)
+        before = baseline['estimated_cycles']
+        after = optimized['estimated_cycles']
+        hot_blocks = sorted(optimized['blocks'], key=lambda block: -block['cycles'] * block['frequency'])[:5]
         
-        original_count = len(original_lines)
-        compiled_count = len(compiled_lines)
+        return {
+            'baseline_cycles': before,
+            'optimized_cycles': after,
+            'speedup': round(before / after, 4) if after else None,
+            'cycle_reduction_percent': round((1 - after / before) * 100, 2) if before else 0.0,
+            'loops': optimized['loops'],
+            'hot_blocks': hot_blocks
+        }
+    
+    def _analyze_code_size(self, summary: Dict, static_cost: Optional[Dict] = None) -> Dict:
+        """Analyze code size reduction (in encoded bytes when known) and efficiency (rated on modelled cycles)"""
+        original_count = summary['original_instructions']
+        compiled_count = summary['compiled_instructions']
+        original_bytes = summary.get('original_bytes')
+        compiled_bytes = summary.get('compiled_bytes')
+        
+        if original_bytes and compiled_bytes is not None:
+            size_reduction = (original_bytes - compiled_bytes) / original_bytes * 100
+        else:
+            size_reduction = ((original_count - compiled_count) / original_count * 100) if original_count > 0 else 0
         
-        size_reduction = ((original_count - compiled_count) / original_count * 100) if original_count > 0 else 0
+        if static_cost is not None and static_cost['speedup'] is not None:
+            speedup = static_cost['speedup']
+        else:
+            speedup = self._size_speedup(summary)
         
         return {
             'original_instructions': original_count,
             'compiled_instructions': compiled_count,
+            'original_bytes': original_bytes,
+            'compiled_bytes': compiled_bytes,
             'size_reduction_percent': round(size_reduction, 2),
-            'efficiency_rating': self._calculate_efficiency_rating(size_reduction)
+            'efficiency_rating': self._rate_speedup(speedup)
         }
     
-    def _measure_compile_time(self, optimization_level: str) -> Dict:
-        """Simulate compilation time measurement"""
-        # Simulate different compilation times based on optimization level
-        base_time = 0.1  # Base compilation time in seconds
+    def _measure_compile_time(self, stats: Optional[Dict]) -> Dict:
+        """Report the per-stage timings recorded during compilation"""
+        stages = (stats or {}).get('stages', [])
+        total_ns = (stats or {}).get('total_time_ns', 0)
+        passes = [stage for stage in stages if stage.get('kind') == 'pass']
+        optimization_ns = sum(stage['time_ns'] for stage in passes)
+        slowest = max(passes, key=lambda stage: stage['time_ns']) if passes else None
         
-        multipliers = {
-            'none': 1.0,
-            'basic': 1.2,
-            'standard': 1.5,
-            'aggressive': 2.0
-        }
-        
-        simulated_time = base_time * multipliers.get(optimization_level, 1.0)
+        breakdown = []
+        for stage in stages:
+            entry = {
+                'name': stage['name'],
+                'kind': stage.get('kind', 'stage'),
+                'time_ms': round(stage['time_ns'] / 1e6, 4),
+                'percent': round(stage['time_ns'] / total_ns * 100, 2) if total_ns else 0.0,
+                'instructions_in': stage['instructions_in'],
+                'instructions_out': stage['instructions_out']
+            }
+            if 'peak_memory_bytes' in stage:
+                entry['peak_memory_bytes'] = stage['peak_memory_bytes']
+            breakdown.append(entry)
         
         return {
-            'compilation_time_ms': round(simulated_time * 1000, 2),
-            'optimization_overhead': round((simulated_time - base_time) * 1000, 2),
-            'performance_rating': self._rate_compile_time(simulated_time)
+            'compilation_time_ms': round(total_ns / 1e6, 4),
+            'optimization_overhead': round(optimization_ns / 1e6, 4),
+            'dominant_pass': slowest['name'] if slowest else None,
+            'stage_breakdown': breakdown,
+            'performance_rating': self._rate_compile_time(total_ns / 1e9)
         }
     
-    def _analyze_optimization_effectiveness(self, original: str, compiled: str, level: str) -> Dict:
-        """Analyze how effective the optimization was"""
+    def _measure_runtime(self, programs: Tuple[Sequence, Sequence]) -> Dict:
+        """Execute the unoptimized and optimized programs and compare instruction counts and cycles"""
+        baseline, optimized = programs
+        try:
+            measured = compare(baseline, optimized, max_steps=self.emulation_steps)
+        except EmulationError as e:
+            return {'measured': False, 'error': str(e)}
+        
+        halts = (measured['baseline']['halt'], measured['optimized']['halt'])
+        # Runs cut off by the step limit or a fault do not measure the whole program
+        complete = all(halt in ('returned', 'halted', 'fell off the end') for halt in halts)
+        return dict(measured, measured=complete, inputs=DEFAULT_INPUTS)
+    
+    def _analyze_optimization_effectiveness(self, summary: Dict, level: str, static_cost: Optional[Dict] = None,
+                                            runtime: Optional[Dict] = None) -> Dict:
+        """Analyze how effective the optimization was (measured when the runtime stage ran, else modelled)"""
         
-        # Count optimization indicators
-        optimizations_applied = compiled.count('; Optimized') + compiled.count('; Removed')
-        total_instructions = len([l for l in original.split('\n') if l.strip()])
+        # Count optimization indicators (Optimized/Removed annotations)
+        optimizations_applied = summary['optimizations_applied']
+        total_instructions = summary['original_instructions']
         
         effectiveness_percent = (optimizations_applied / total_instructions * 100) if total_instructions > 0 else 0
         
@@ -102,33 +181,51 @@ class BenchmarkRunner:
         }
         
         expected = expected_improvements.get(level, 0)
-        actual_improvement = min(effectiveness_percent * 2, 50)  # Estimate actual improvement
+        if runtime is not None and runtime['measured'] and runtime['speedup'] is not None:
+            actual_improvement = runtime['cycle_reduction_percent']
+            speedup = runtime['speedup']
+            source = 'measured'
+        elif static_cost is not None and static_cost['speedup'] is not None:
+            actual_improvement = static_cost['cycle_reduction_percent']
+            speedup = static_cost['speedup']
+            source = 'modelled'
+        else:
+            actual_improvement = min(effectiveness_percent * 2, 50)  # Estimate actual improvement
+            speedup = self._size_speedup(summary)
+            source = 'estimated'
         
-        return {
+        report = {
             'optimizations_applied': optimizations_applied,
             'effectiveness_percent': round(effectiveness_percent, 2),
             'expected_improvement': expected,
             'estimated_actual_improvement': round(actual_improvement, 2),
-            'optimization_score': self._calculate_optimization_score(effectiveness_percent, level)
+            'improvement_source': source,
+            'optimization_score': self._rate_speedup(speedup)
         }
+        if source == 'measured':
+            report['measured_speedup'] = speedup
+        return report
     
-    def _analyze_x64_features(self, compiled_code: str) -> Dict:
+    def _analyze_x64_features(self, summary: Dict) -> Dict:
         """Analyze x86_64 specific features utilized"""
         features_detected = []
-        code_lower = compiled_code.lower()
+        names = summary['operand_names']
+        opcodes = summary['opcodes']
         
         # Check for x86_64 features
         x64_checks = {
-            '64-bit registers': ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rsp', 'rbp'],
-            'Extended registers': ['r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15'],
-            'Advanced instructions': ['movzx', 'movsx', 'lea'],
-            'Optimized operations': ['shl', 'shr', 'sal', 'sar'],
-            'SIMD potential': ['xmm', 'ymm', 'zmm']
+            '64-bit registers': any(name in ('rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rsp', 'rbp')
+                                    for name in names),
+            'Extended registers': any(name.startswith(tuple(f"r{number}" for number in range(8, 16)))
+                                      for name in names),
+            'Advanced instructions': any(opcode in ('movzx', 'movsx', 'movsxd', 'lea') for opcode in opcodes),
+            'Optimized operations': any(opcode in ('shl', 'shr', 'sal', 'sar') for opcode in opcodes),
+            'SIMD potential': any(name.startswith(('xmm', 'ymm', 'zmm')) for name in names)
         }
         
         feature_count = 0
-        for feature_name, indicators in x64_checks.items():
-            if any(indicator in code_lower for indicator in indicators):
+        for feature_name, detected in x64_checks.items():
+            if detected:
                 features_detected.append(feature_name)
                 feature_count += 1
         
@@ -164,18 +261,17 @@ class BenchmarkRunner:
                 'recommendations': ['Unable to calculate performance metrics']
             }
     
-    def _calculate_efficiency_rating(self, size_reduction: float) -> float:
-        """Calculate efficiency rating based on size reduction"""
-        if size_reduction >= 20:
-            return 9.0
-        elif size_reduction >= 10:
-            return 7.5
-        elif size_reduction >= 5:
-            return 6.0
-        elif size_reduction > 0:
-            return 4.0
-        else:
-            return 2.0
+    def _rate_speedup(self, speedup: float) -> float:
+        """Rating out of 10 for a speedup: 2.0 for no change, rising to 10.0 once the cycles are halved"""
+        if speedup <= 0:
+            return 0.0
+        rating = 2.0 + 16.0 * (1 - 1 / speedup)
+        return round(min(max(rating, 0.0), 10.0), 2)
+    
+    def _size_speedup(self, summary: Dict) -> float:
+        """Instruction-count ratio, the fallback when no cycle estimate is available"""
+        compiled = summary['compiled_instructions']
+        return summary['original_instructions'] / compiled if compiled else 1.0
     
     def _rate_compile_time(self, time_seconds: float) -> float:
         """Rate compilation time performance"""
@@ -188,19 +284,6 @@ class BenchmarkRunner:
         else:
             return 4.0
     
-    def _calculate_optimization_score(self, effectiveness: float, level: str) -> float:
-        """Calculate optimization score"""
-        level_multipliers = {
-            'none': 1.0,
-            'basic': 1.2,
-            'standard': 1.5,
-            'aggressive': 2.0
-        }
-        
-        base_score = min(effectiveness / 10, 8.0)
-        multiplier = level_multipliers.get(level, 1.0)
-        return min(base_score * multiplier, 10.0)
-    
     def _calculate_x64_readiness(self, utilization: float) -> float:
         """Calculate x86_64 readiness score"""
         if utilization >= 80:
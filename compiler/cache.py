@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_source(code):
+    """Normalize source text so formatting-only edits share a cache entry"""
+    lines = []
+    for line in code.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        line = line.strip()
+        if line:
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+class CompilationCache:
+    """Content-addressed LRU cache of compilation results with an optional disk tier"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, directory=None, version=''):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.version = version
+
+        self._entries = OrderedDict()  # key -> (result, size in bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def make_key(self, source, optimization_level):
+        """Hash of (normalized source, optimization level, compiler version)"""
+        digest = hashlib.sha256()
+        for part in (self.version, optimization_level, normalize_source(source)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, result, len(json.dumps(result)))
+        return result
+
+    def put(self, key, result):
+        """Store a result in memory and, if configured, on disk"""
+        payload = json.dumps(result)
+        with self._lock:
+            self._store(key, result, len(payload))
+        self._write_disk(key, payload)
+
+    def clear(self):
+        """Drop all in-memory entries (the disk tier is left untouched)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'disk_enabled': bool(self.directory)
+            }
+
+    def _store(self, key, result, size):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (result, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache entry {key}: {str(e)}")
+            return None
+
+    def _write_disk(self, key, payload):
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as handle:
+                handle.write(payload)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
@@ -0,0 +1,266 @@
+import copy
+
+from .isa import BLOCK_TERMINATORS, CONDITIONAL_JUMPS, LOOP_INSTRUCTIONS, RETURNS, UNCONDITIONAL_JUMPS, branch_target
+
+
+class BasicBlock:
+    """Straight-line run of IR entries program[start:end]"""
+
+    __slots__ = ('index', 'start', 'end', 'labels', 'successors', 'predecessors', 'unknown_exit')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.labels = []
+        self.successors = []
+        self.predecessors = []
+        # Control may leave to code outside the program (indirect or external jump)
+        self.unknown_exit = False
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, {self.start}:{self.end})"
+
+
+class Loop:
+    """Natural loop: a header plus every block that reaches a back edge without passing it"""
+
+    __slots__ = ('header', 'blocks', 'latches', 'exits', 'parent', 'depth')
+
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}
+        self.latches = []
+        self.exits = []
+        self.parent = None
+        self.depth = 1
+
+    def __repr__(self):
+        return f"Loop(header={self.header}, blocks={sorted(self.blocks)})"
+
+
+class ControlFlowGraph:
+    """Basic blocks, edges, dominator tree and natural loops of an IR list
+
+    With open_labels the program is a fragment of a larger one (a chunk of
+    a stream), so every labelled block may also be entered from outside it.
+    """
+
+    def __init__(self, program, open_labels=False):
+        self.program = program
+        self.open_labels = open_labels
+        self.blocks = []
+        self.block_of_label = {}
+        self._build_blocks()
+        self._link_blocks()
+        self.entries = [block.index for block in self.blocks
+                        if block.index == 0 or not block.predecessors or (open_labels and block.labels)]
+        self.reverse_postorder = self._reverse_postorder()
+        self.idom = self._compute_dominators()
+        self.dom_children = [[] for _ in self.blocks]
+        for block, parent in enumerate(self.idom):
+            if parent is not None and parent != block:
+                self.dom_children[parent].append(block)
+        self._dom_depth = self._compute_dom_depth()
+        self.loops = self._find_loops()
+
+    def rebind(self, program):
+        """This graph over a program whose entries were replaced one for one, labels and branches kept"""
+        graph = copy.copy(self)
+        graph.program = program
+        return graph
+
+    def block_entries(self, block):
+        """IR entries of a block"""
+        return self.program[block.start:block.end]
+
+    def block_at(self, position):
+        """Block containing a program position"""
+        low, high = 0, len(self.blocks) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.blocks[middle].start <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return self.blocks[low]
+
+    def is_reachable(self, block):
+        """True when the block can be reached from the program entry or an external entry"""
+        return self.idom[block] is not None
+
+    def dominates(self, first, second):
+        """True when block first dominates block second"""
+        if self.idom[second] is None or self.idom[first] is None:
+            return False
+        while self._dom_depth[second] > self._dom_depth[first]:
+            second = self.idom[second]
+        return first == second
+
+    def loop_of(self, block):
+        """Innermost loop containing a block, or None"""
+        innermost = None
+        for loop in self.loops:
+            if block in loop.blocks and (innermost is None or loop.depth > innermost.depth):
+                innermost = loop
+        return innermost
+
+    def _build_blocks(self):
+        program = self.program
+        if not program:
+            return
+        leaders = {0}
+        for position, entry in enumerate(program):
+            if entry.label is not None:
+                leaders.add(position)
+            elif entry.opcode in BLOCK_TERMINATORS and position + 1 < len(program):
+                leaders.add(position + 1)
+
+        # Consecutive labels (and comments between them) belong to one block
+        starts = []
+        for position in sorted(leaders):
+            if starts and all(entry.opcode is None for entry in program[starts[-1]:position]):
+                continue
+            starts.append(position)
+
+        for index, start in enumerate(starts):
+            end = starts[index + 1] if index + 1 < len(starts) else len(program)
+            block = BasicBlock(index, start, end)
+            for entry in program[start:end]:
+                if entry.label is not None:
+                    block.labels.append(entry.label)
+                    self.block_of_label.setdefault(entry.label, index)
+                elif entry.opcode is not None:
+                    break
+            self.blocks.append(block)
+
+    def _link_blocks(self):
+        for block in self.blocks:
+            last = self._last_instruction(block)
+            opcode = last.opcode if last is not None else None
+            fallthrough = block.index + 1 if block.index + 1 < len(self.blocks) else None
+            successors = []
+
+            if opcode in UNCONDITIONAL_JUMPS or opcode in CONDITIONAL_JUMPS or opcode in LOOP_INSTRUCTIONS:
+                target = branch_target(last)
+                if target in self.block_of_label:
+                    successors.append(self.block_of_label[target])
+                else:
+                    block.unknown_exit = True
+                if opcode not in UNCONDITIONAL_JUMPS and fallthrough is not None:
+                    successors.append(fallthrough)
+            elif opcode in RETURNS:
+                pass
+            elif fallthrough is not None:
+                successors.append(fallthrough)
+            else:
+                # Falling off the end of the program
+                block.unknown_exit = True
+
+            for successor in successors:
+                if successor not in block.successors:
+                    block.successors.append(successor)
+                    self.blocks[successor].predecessors.append(block.index)
+
+    def _last_instruction(self, block):
+        for entry in reversed(self.program[block.start:block.end]):
+            if entry.opcode is not None:
+                return entry
+        return None
+
+    def _reverse_postorder(self):
+        visited = [False] * len(self.blocks)
+        postorder = []
+        for entry in self.entries:
+            if visited[entry]:
+                continue
+            visited[entry] = True
+            stack = [(entry, iter(self.blocks[entry].successors))]
+            while stack:
+                node, successors = stack[-1]
+                for successor in successors:
+                    if not visited[successor]:
+                        visited[successor] = True
+                        stack.append((successor, iter(self.blocks[successor].successors)))
+                        break
+                else:
+                    stack.pop()
+                    postorder.append(node)
+        return postorder[::-1]
+
+    def _compute_dominators(self):
+        """Cooper-Harvey-Kennedy iterative dominators over a virtual root joining all entries"""
+        count = len(self.blocks)
+        root = count
+        order = {block: position for position, block in enumerate(self.reverse_postorder)}
+        order[root] = -1
+        idom = [None] * (count + 1)
+        idom[root] = root
+        entries = set(self.entries)
+
+        def intersect(first, second):
+            while first != second:
+                while order[first] > order[second]:
+                    first = idom[first]
+                while order[second] > order[first]:
+                    second = idom[second]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for block in self.reverse_postorder:
+                predecessors = [pred for pred in self.blocks[block].predecessors if idom[pred] is not None]
+                if block in entries:
+                    predecessors.append(root)
+                new_idom = predecessors[0]
+                for pred in predecessors[1:]:
+                    new_idom = intersect(pred, new_idom)
+                if idom[block] != new_idom:
+                    idom[block] = new_idom
+                    changed = True
+
+        # Entries are their own roots in the public tree
+        return [block if idom[block] == root else idom[block] for block in range(count)]
+
+    def _compute_dom_depth(self):
+        depth = [0] * len(self.blocks)
+        for block in self.reverse_postorder:
+            parent = self.idom[block]
+            depth[block] = 0 if parent == block else depth[parent] + 1
+        return depth
+
+    def _find_loops(self):
+        loops = {}
+        for block in self.reverse_postorder:
+            for successor in self.blocks[block].successors:
+                if self.dominates(successor, block):
+                    loop = loops.get(successor)
+                    if loop is None:
+                        loop = loops[successor] = Loop(successor)
+                    loop.latches.append(block)
+                    worklist = [block]
+                    while worklist:
+                        node = worklist.pop()
+                        if node not in loop.blocks:
+                            loop.blocks.add(node)
+                            worklist.extend(pred for pred in self.blocks[node].predecessors
+                                            if self.idom[pred] is not None)
+
+        ordered = sorted(loops.values(), key=lambda loop: len(loop.blocks))
+        for position, loop in enumerate(ordered):
+            for outer in ordered[position + 1:]:
+                if loop.header in outer.blocks and loop.blocks <= outer.blocks:
+                    loop.parent = outer
+                    break
+            loop.exits = sorted({successor for node in loop.blocks
+                                 for successor in self.blocks[node].successors
+                                 if successor not in loop.blocks})
+        for loop in ordered:
+            depth = 1
+            parent = loop.parent
+            while parent is not None:
+                depth += 1
+                parent = parent.parent
+            loop.depth = depth
+        return sorted(ordered, key=lambda loop: self.blocks[loop.header].start)
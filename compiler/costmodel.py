@@ -0,0 +1,247 @@
+from .isa import UNKNOWN_EFFECTS, instruction_effects, memory_operands, register_bit
+
+# Reference microarchitecture: a Skylake-like core issuing 4 uops per cycle,
+# integer ALUs on ports 0, 1, 5 and 6, loads on 2 and 3, store addresses
+# on 2, 3 and 7 and store data on 4
+ISSUE_WIDTH = 4
+ALU_PORTS = (0, 1, 5, 6)
+LOAD_PORTS = (2, 3)
+STORE_ADDRESS_PORTS = (2, 3, 7)
+STORE_DATA_PORTS = (4,)
+
+# Extra cycles for an L1 hit when an instruction reads memory
+LOAD_LATENCY = 4
+
+
+class OpcodeCost:
+    """Latency, reciprocal throughput and execution ports of an opcode's compute uop"""
+
+    __slots__ = ('latency', 'throughput', 'ports')
+
+    def __init__(self, latency, throughput, ports):
+        self.latency = latency
+        self.throughput = throughput
+        self.ports = ports
+
+    def __repr__(self):
+        return f"OpcodeCost({self.latency}, {self.throughput}, {self.ports})"
+
+
+_ALU = OpcodeCost(1, 0.25, ALU_PORTS)
+_SHIFT = OpcodeCost(1, 0.5, (0, 6))
+_BRANCH = OpcodeCost(1, 0.5, (0, 6))
+
+# Register-operand forms; memory operands add load and store uops on top
+COSTS = {
+    'lea': OpcodeCost(1, 0.5, (1, 5)),
+    'imul': OpcodeCost(3, 1.0, (1,)),
+    'mul': OpcodeCost(3, 1.0, (1,)),
+    'div': OpcodeCost(26, 6.0, (0,)),
+    'idiv': OpcodeCost(26, 6.0, (0,)),
+    'shl': _SHIFT, 'sal': _SHIFT, 'shr': _SHIFT, 'sar': _SHIFT, 'rol': _SHIFT, 'ror': _SHIFT,
+    'rcl': OpcodeCost(2, 1.0, (0, 6)), 'rcr': OpcodeCost(2, 1.0, (0, 6)),
+    'adc': _SHIFT, 'sbb': _SHIFT,
+    'cdq': _SHIFT, 'cqo': _SHIFT,
+    'xchg': OpcodeCost(2, 1.0, ALU_PORTS),
+    'push': OpcodeCost(1, 1.0, STORE_DATA_PORTS),
+    'pop': OpcodeCost(4, 0.5, LOAD_PORTS),
+    'call': OpcodeCost(2, 2.0, (6,)),
+    'ret': OpcodeCost(2, 1.0, (6,)),
+    'jmp': OpcodeCost(1, 1.0, (6,)),
+    'loop': OpcodeCost(1, 5.0, (0, 6)),
+}
+# One-operand mul/imul writing rdx:rax
+WIDENING_MULTIPLY = OpcodeCost(4, 1.0, (1, 5))
+STORE_LATENCY = 1
+
+
+class InstructionCost:
+    """Modelled latency of one instruction and the port occupancy of its uops"""
+
+    __slots__ = ('latency', 'uops', 'loads')
+
+    def __init__(self, latency, uops, loads=False):
+        self.latency = latency
+        # (ports, cycles) per uop: the cycles are spread evenly over the ports
+        self.uops = uops
+        # The latency includes a load, which only waits for the address registers
+        self.loads = loads
+
+    @property
+    def throughput(self):
+        """Reciprocal throughput: cycles per instruction when repeated independently"""
+        pressure = {}
+        for ports, cycles in self.uops:
+            for port in ports:
+                pressure[port] = pressure.get(port, 0) + cycles / len(ports)
+        return max(max(pressure.values(), default=0), len(self.uops) / ISSUE_WIDTH)
+
+
+class CostModel:
+    """Static throughput model in the style of llvm-mca
+
+    Blocks are estimated as the larger of their dependency-chain latency
+    and their resource bound (the most loaded port, or the issue width);
+    loops as the larger of the steady-state recurrence over repeated
+    iterations and the same resource bound. Register and flag
+    dependencies are tracked; dependencies through memory are not.
+    """
+
+    def __init__(self, costs=None, issue_width=ISSUE_WIDTH, loop_iterations=8):
+        self.costs = COSTS if costs is None else costs
+        self.issue_width = issue_width
+        # Iterations simulated to find a loop's steady-state recurrence
+        self.loop_iterations = loop_iterations
+        self._cache = {}
+
+    def opcode_cost(self, instruction):
+        """Table entry for an instruction's opcode"""
+        opcode = instruction.opcode
+        if opcode in ('mul', 'imul') and len(instruction.operands) == 1:
+            return WIDENING_MULTIPLY
+        if opcode.startswith('j') or opcode.startswith('set') or opcode.startswith('cmov'):
+            return self.costs.get(opcode, _BRANCH)
+        if opcode.startswith('loop'):
+            return self.costs['loop']
+        return self.costs.get(opcode, _ALU)
+
+    def instruction_cost(self, instruction):
+        """Latency and uops of one instruction (cached by opcode and operand kinds)"""
+        key = (instruction.opcode, tuple(operand.kind for operand in instruction.operands))
+        cost = self._cache.get(key)
+        if cost is None:
+            cost = self._cache[key] = self._instruction_cost(instruction)
+        return cost
+
+    def _instruction_cost(self, instruction):
+        entry = self.opcode_cost(instruction)
+        reads, writes = memory_operands(instruction)
+        uops = [(entry.ports, entry.throughput * len(entry.ports))]
+        latency = entry.latency
+        if reads:
+            uops.append((LOAD_PORTS, 1.0))
+            latency += LOAD_LATENCY
+        if writes or instruction.opcode in ('push', 'call'):
+            uops.append((STORE_ADDRESS_PORTS, 1.0))
+            if instruction.opcode not in ('push', 'call'):
+                uops.append((STORE_DATA_PORTS, 1.0))
+            if not reads:
+                latency = STORE_LATENCY
+        return InstructionCost(latency, tuple(uops), bool(reads))
+
+    def block_cost(self, entries):
+        """Estimated cycles for one execution of a straight-line run of entries"""
+        instructions = [entry for entry in entries if entry.opcode is not None]
+        ready = {}
+        latency_bound = self._chain(instructions, ready)
+        return self._report(instructions, latency_bound, 'latency_bound')
+
+    def loop_cost(self, entries):
+        """Estimated cycles per iteration of a loop body in steady state"""
+        instructions = [entry for entry in entries if entry.opcode is not None]
+        ready = {}
+        half = max(self.loop_iterations // 2, 1)
+        finished = [self._chain(instructions, ready) for _ in range(2 * half)]
+        recurrence = (finished[-1] - finished[half - 1]) / half
+        return self._report(instructions, recurrence, 'recurrence_bound')
+
+    def sequence_cycles(self, instructions):
+        """Cycles for a short replacement sequence, for comparing alternatives"""
+        return self.block_cost(instructions)['cycles']
+
+    def analyze(self, cfg):
+        """Per-block and per-loop estimates of a program, plus a frequency-weighted total
+
+        Blocks inside loops are weighted by 10 per nesting level, the usual
+        static estimate of how often they run.
+        """
+        blocks = []
+        total = 0.0
+        for block in cfg.blocks:
+            cost = self.block_cost(cfg.block_entries(block))
+            loop = cfg.loop_of(block.index)
+            weight = 10 ** loop.depth if loop is not None else 1
+            total += cost['cycles'] * weight
+            blocks.append(dict(cost, block=block.index, labels=list(block.labels), frequency=weight))
+
+        loops = []
+        for loop in cfg.loops:
+            body = []
+            for index in sorted(loop.blocks):
+                body.extend(cfg.block_entries(cfg.blocks[index]))
+            header = cfg.blocks[loop.header]
+            loops.append(dict(self.loop_cost(body), header=header.labels[0] if header.labels else None,
+                              depth=loop.depth))
+        return {
+            'estimated_cycles': round(total, 2),
+            'blocks': blocks,
+            'loops': loops
+        }
+
+    def _chain(self, instructions, ready):
+        """Latency-weighted dependency chain through one pass over the instructions
+
+        ready maps register bits to the cycle their value is available and
+        carries over between calls, so repeated calls model loop iterations.
+        Returns the cycle the last result becomes available.
+        """
+        finish = 0
+        for instruction in instructions:
+            effects = instruction_effects(instruction)
+            cost = self.instruction_cost(instruction)
+            if effects is UNKNOWN_EFFECTS:
+                done = max([0] + list(ready.values())) + cost.latency
+            elif cost.loads:
+                # The load issues once its address is known; the rest of the
+                # instruction waits for the loaded value and its other inputs
+                address = 0
+                for operand in memory_operands(instruction)[0]:
+                    for register in operand.registers():
+                        address |= register_bit(register)
+                loaded = max([0] + [ready.get(bit, 0) for bit in _bits(address)]) + LOAD_LATENCY
+                begin = max([loaded] + [ready.get(bit, 0) for bit in _bits(effects.uses & ~address)])
+                done = begin + cost.latency - LOAD_LATENCY
+            else:
+                done = max([0] + [ready.get(bit, 0) for bit in _bits(effects.uses)]) + cost.latency
+            for bit in _bits(effects.defs | effects.kills):
+                ready[bit] = done
+            finish = max(finish, done)
+        return finish
+
+    def _report(self, instructions, latency_bound, latency_name):
+        pressure = {}
+        uops = 0
+        for instruction in instructions:
+            for ports, cycles in self.instruction_cost(instruction).uops:
+                uops += 1
+                for port in ports:
+                    pressure[port] = pressure.get(port, 0) + cycles / len(ports)
+        port_bound = max(pressure.values(), default=0)
+        issue_bound = uops / self.issue_width
+        throughput_bound = max(port_bound, issue_bound)
+        if latency_bound >= throughput_bound:
+            bottleneck = 'dependencies'
+        elif port_bound >= issue_bound:
+            bottleneck = f"port {max(pressure, key=pressure.get)}"
+        else:
+            bottleneck = 'issue width'
+        return {
+            'instructions': len(instructions),
+            'uops': uops,
+            latency_name: round(latency_bound, 2),
+            'throughput_bound': round(throughput_bound, 2),
+            'cycles': round(max(latency_bound, throughput_bound), 2),
+            'bottleneck': bottleneck,
+            'port_pressure': {f"p{port}": round(cycles, 2) for port, cycles in sorted(pressure.items())}
+        }
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low
+        mask ^= low
+
+
+# Shared instance used by the scheduler, strength reduction and benchmarks
+REFERENCE_MODEL = CostModel()
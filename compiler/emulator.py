@@ -0,0 +1,698 @@
+from .isa import CONDITIONAL_JUMPS, GPR_FAMILIES, LOOP_INSTRUCTIONS
+from .ir import SIZE_KEYWORDS
+from .scheduler import instruction_latency
+
+_MASKS = {8: 0xFF, 16: 0xFFFF, 32: 0xFFFFFFFF, 64: 0xFFFFFFFFFFFFFFFF}
+_HIGH_BYTES = frozenset({'ah', 'bh', 'ch', 'dh'})
+_INDEX = {family: position for position, family in enumerate(GPR_FAMILIES)}
+_RSP = _INDEX['rsp']
+_RBP = _INDEX['rbp']
+_RAX = _INDEX['rax']
+_RCX = _INDEX['rcx']
+_RDX = _INDEX['rdx']
+
+# Return address pushed before the program starts; returning to it ends the run
+EXIT_ADDRESS = 0xE417E417
+# Return addresses of internal calls are RETURN_BASE + instruction index
+RETURN_BASE = 0x40000000
+
+# Deterministic starting registers shared by every run unless overridden
+DEFAULT_INPUTS = {'rax': 1, 'rbx': 2, 'rcx': 8, 'rdx': 0, 'rsi': 3, 'rdi': 5}
+
+# Bytes reserved for each data symbol ([counter], [table+rcx*4], ...)
+SYMBOL_SPACE = 4096
+# Locals addressed from rbp sit above rsp, as if the frame had been allocated
+FRAME_SIZE = 1024
+
+
+class EmulationError(Exception):
+    """Unsupported instruction or a fault (bad address, divide error) while emulating"""
+
+
+class Machine:
+    """Registers, flags and a flat little-endian memory"""
+
+    __slots__ = ('regs', 'cf', 'zf', 'sf', 'of', 'memory', 'halt')
+
+    def __init__(self, memory_size, inputs=None):
+        self.regs = [0] * len(GPR_FAMILIES)
+        self.cf = self.zf = self.sf = self.of = False
+        self.memory = bytearray(memory_size)
+        self.halt = None
+        for family, value in (DEFAULT_INPUTS if inputs is None else inputs).items():
+            self.regs[_INDEX[family]] = value & _MASKS[64]
+        top = memory_size - 64
+        self.regs[_RBP] = top
+        self.regs[_RSP] = top - FRAME_SIZE
+        self.push(EXIT_ADDRESS)
+
+    def load(self, address, size):
+        if address < 0 or address + size > len(self.memory):
+            raise EmulationError(f"Memory read out of range at {address:#x}")
+        return int.from_bytes(self.memory[address:address + size], 'little')
+
+    def store(self, address, size, value):
+        if address < 0 or address + size > len(self.memory):
+            raise EmulationError(f"Memory write out of range at {address:#x}")
+        self.memory[address:address + size] = (value & _MASKS[size * 8]).to_bytes(size, 'little')
+
+    def push(self, value):
+        self.regs[_RSP] = (self.regs[_RSP] - 8) & _MASKS[64]
+        self.store(self.regs[_RSP], 8, value)
+
+    def pop(self):
+        value = self.load(self.regs[_RSP], 8)
+        self.regs[_RSP] = (self.regs[_RSP] + 8) & _MASKS[64]
+        return value
+
+    def registers(self):
+        """Final register values by 64-bit family"""
+        return dict(zip(GPR_FAMILIES, self.regs))
+
+
+def _signed(value, size):
+    value &= (1 << size) - 1
+    return value - (1 << size) if value >> (size - 1) else value
+
+
+# Conditions by suffix (jcc, setcc, cmovcc); parity is not modelled
+_CONDITIONS = {
+    'o': lambda m: m.of, 'no': lambda m: not m.of,
+    'b': lambda m: m.cf, 'c': lambda m: m.cf, 'nae': lambda m: m.cf,
+    'ae': lambda m: not m.cf, 'nb': lambda m: not m.cf, 'nc': lambda m: not m.cf,
+    'e': lambda m: m.zf, 'z': lambda m: m.zf,
+    'ne': lambda m: not m.zf, 'nz': lambda m: not m.zf,
+    'be': lambda m: m.cf or m.zf, 'na': lambda m: m.cf or m.zf,
+    'a': lambda m: not (m.cf or m.zf), 'nbe': lambda m: not (m.cf or m.zf),
+    's': lambda m: m.sf, 'ns': lambda m: not m.sf,
+    'l': lambda m: m.sf != m.of, 'nge': lambda m: m.sf != m.of,
+    'ge': lambda m: m.sf == m.of, 'nl': lambda m: m.sf == m.of,
+    'le': lambda m: m.zf or m.sf != m.of, 'ng': lambda m: m.zf or m.sf != m.of,
+    'g': lambda m: not m.zf and m.sf == m.of, 'nle': lambda m: not m.zf and m.sf == m.of,
+}
+
+
+def _condition(suffix):
+    condition = _CONDITIONS.get(suffix)
+    if condition is None:
+        raise EmulationError(f"Unsupported condition: {suffix}")
+    return condition
+
+
+class _Decoder:
+    """Turns IR instructions into closures over a Machine"""
+
+    def __init__(self, labels, memory_size):
+        self.labels = labels
+        self.symbols = {}
+        self._next_symbol = 0x1000
+        self._memory_size = memory_size
+
+    def symbol_address(self, name):
+        address = self.symbols.get(name)
+        if address is None:
+            address = self.symbols[name] = self._next_symbol
+            self._next_symbol += SYMBOL_SPACE
+            if self._next_symbol > self._memory_size // 2:
+                raise EmulationError("Too many data symbols")
+        return address
+
+    def width(self, instruction):
+        """Operand size in bits of an instruction"""
+        for operand in instruction.operands:
+            if operand.kind == 'reg':
+                return operand.size
+        for operand in instruction.operands:
+            if operand.kind == 'mem' and operand.size is not None:
+                return SIZE_KEYWORDS[operand.size]
+        return 64
+
+    def address(self, operand):
+        if operand.kind != 'mem' or operand.segment is not None:
+            raise EmulationError(f"Unsupported address: {operand}")
+        base = self._register(operand.base) if operand.base is not None else None
+        index = self._register(operand.index) if operand.index is not None else None
+        scale = operand.scale
+        offset = operand.disp + (self.symbol_address(operand.symbol) if operand.symbol is not None else 0)
+        base_mask = _MASKS[operand.base.size] if operand.base is not None else 0
+        index_mask = _MASKS[operand.index.size] if operand.index is not None else 0
+        if index is None and base is None:
+            return lambda m: offset
+        if index is None:
+            return lambda m: ((m.regs[base] & base_mask) + offset) & _MASKS[64]
+        if base is None:
+            return lambda m: ((m.regs[index] & index_mask) * scale + offset) & _MASKS[64]
+        return lambda m: ((m.regs[base] & base_mask) + (m.regs[index] & index_mask) * scale + offset) & _MASKS[64]
+
+    def reader(self, operand, size):
+        """Closure reading an operand (immediates are truncated to size)"""
+        if operand.kind == 'imm':
+            value = operand.value & _MASKS[size]
+            return lambda m: value
+        if operand.kind == 'reg':
+            position = self._register(operand)
+            if operand.name in _HIGH_BYTES:
+                return lambda m: (m.regs[position] >> 8) & 0xFF
+            if operand.size == 64:
+                return lambda m: m.regs[position]
+            mask = _MASKS[operand.size]
+            return lambda m: m.regs[position] & mask
+        if operand.kind == 'mem':
+            address = self.address(operand)
+            width = (SIZE_KEYWORDS[operand.size] if operand.size is not None else size) // 8
+            return lambda m: m.load(address(m), width)
+        address = self.symbol_address(operand.text)
+        return lambda m: address
+
+    def writer(self, operand, size):
+        """Closure writing an operand with x86-64 partial-register semantics"""
+        if operand.kind == 'reg':
+            position = self._register(operand)
+            if operand.name in _HIGH_BYTES:
+                def write(m, value):
+                    m.regs[position] = (m.regs[position] & ~0xFF00) | ((value & 0xFF) << 8)
+            elif operand.size >= 32:
+                mask = _MASKS[operand.size]
+
+                def write(m, value):
+                    m.regs[position] = value & mask
+            else:
+                mask = _MASKS[operand.size]
+
+                def write(m, value):
+                    m.regs[position] = (m.regs[position] & ~mask) | (value & mask)
+            return write
+        if operand.kind == 'mem':
+            address = self.address(operand)
+            width = (SIZE_KEYWORDS[operand.size] if operand.size is not None else size) // 8
+            return lambda m, value: m.store(address(m), width, value)
+        raise EmulationError(f"Cannot write to {operand}")
+
+    def target(self, instruction):
+        """Instruction index of a branch target; None for targets outside the program"""
+        operand = instruction.operands[0] if instruction.operands else None
+        if operand is None or operand.kind != 'sym':
+            raise EmulationError(f"Unsupported indirect branch: {instruction}")
+        return self.labels.get(operand.text)
+
+    def _register(self, operand):
+        position = _INDEX.get(operand.family)
+        if position is None:
+            raise EmulationError(f"Unsupported register: {operand}")
+        return position
+
+
+# Flag computations shared by the ALU handlers: (result, flags) from operands
+
+def _add(m, a, b, size, carry=0):
+    mask = _MASKS[size]
+    total = a + b + carry
+    result = total & mask
+    m.cf = total > mask
+    m.zf = result == 0
+    m.sf = bool(result >> (size - 1))
+    m.of = bool(((~(a ^ b) & (a ^ result)) >> (size - 1)) & 1)
+    return result
+
+
+def _sub(m, a, b, size, borrow=0):
+    result = (a - b - borrow) & _MASKS[size]
+    m.cf = a < b + borrow
+    m.zf = result == 0
+    m.sf = bool(result >> (size - 1))
+    m.of = bool((((a ^ b) & (a ^ result)) >> (size - 1)) & 1)
+    return result
+
+
+def _logic(m, result, size):
+    m.cf = m.of = False
+    m.zf = result == 0
+    m.sf = bool(result >> (size - 1))
+    return result
+
+
+_BINARY = {
+    'add': lambda m, a, b, size: _add(m, a, b, size),
+    'adc': lambda m, a, b, size: _add(m, a, b, size, int(m.cf)),
+    'sub': lambda m, a, b, size: _sub(m, a, b, size),
+    'sbb': lambda m, a, b, size: _sub(m, a, b, size, int(m.cf)),
+    'and': lambda m, a, b, size: _logic(m, a & b, size),
+    'or': lambda m, a, b, size: _logic(m, a | b, size),
+    'xor': lambda m, a, b, size: _logic(m, a ^ b, size),
+}
+
+
+def _shift(opcode):
+    def compute(m, a, count, size):
+        count &= 63 if size == 64 else 31
+        if not count:
+            return a
+        mask = _MASKS[size]
+        if opcode in ('shl', 'sal'):
+            result = (a << count) & mask
+            m.cf = bool((a >> (size - count)) & 1) if count <= size else False
+            m.of = bool(result >> (size - 1)) != m.cf
+        elif opcode == 'shr':
+            result = a >> count
+            m.cf = bool((a >> (count - 1)) & 1)
+            m.of = bool(a >> (size - 1))
+        elif opcode == 'sar':
+            result = (_signed(a, size) >> count) & mask
+            m.cf = bool((_signed(a, size) >> (count - 1)) & 1)
+            m.of = False
+        else:
+            count %= size
+            if opcode == 'rol':
+                result = ((a << count) | (a >> (size - count))) & mask
+                m.cf = bool(result & 1)
+            else:
+                result = ((a >> count) | (a << (size - count))) & mask
+                m.cf = bool(result >> (size - 1))
+            return result
+        m.zf = result == 0
+        m.sf = bool(result >> (size - 1))
+        return result
+    return compute
+
+
+# Handler factories: (instruction, decoder, index) -> step(machine) returning the
+# next instruction index, or None to fall through
+
+def _binary_handler(instruction, decoder, index):
+    if len(instruction.operands) != 2:
+        raise EmulationError(f"Unsupported form: {instruction}")
+    size = decoder.width(instruction)
+    dest, source = instruction.operands
+    read_dest = decoder.reader(dest, size)
+    read_source = decoder.reader(source, size)
+    write = decoder.writer(dest, size)
+    opcode = instruction.opcode
+    compute = _BINARY[opcode] if opcode in _BINARY else _shift(opcode)
+    if opcode in ('shl', 'sal', 'shr', 'sar', 'rol', 'ror'):
+        read_source = decoder.reader(source, 8)
+
+    def step(m):
+        write(m, compute(m, read_dest(m), read_source(m), size))
+    return step
+
+
+def _compare_handler(instruction, decoder, index):
+    size = decoder.width(instruction)
+    read_first = decoder.reader(instruction.operands[0], size)
+    read_second = decoder.reader(instruction.operands[1], size)
+    if instruction.opcode == 'cmp':
+        def step(m):
+            _sub(m, read_first(m), read_second(m), size)
+    else:
+        def step(m):
+            _logic(m, read_first(m) & read_second(m), size)
+    return step
+
+
+def _unary_handler(instruction, decoder, index):
+    size = decoder.width(instruction)
+    operand = instruction.operands[0]
+    read = decoder.reader(operand, size)
+    write = decoder.writer(operand, size)
+    opcode = instruction.opcode
+    mask = _MASKS[size]
+
+    if opcode == 'not':
+        def step(m):
+            write(m, ~read(m) & mask)
+    elif opcode == 'neg':
+        def step(m):
+            value = read(m)
+            write(m, _sub(m, 0, value, size))
+            m.cf = value != 0
+    else:
+        def step(m):
+            carry = m.cf
+            write(m, _add(m, read(m), 1, size) if opcode == 'inc' else _sub(m, read(m), 1, size))
+            m.cf = carry
+    return step
+
+
+def _move_handler(instruction, decoder, index):
+    dest, source = instruction.operands
+    size = decoder.width(instruction)
+    write = decoder.writer(dest, size)
+    opcode = instruction.opcode
+    if opcode == 'lea':
+        address = decoder.address(source)
+        return lambda m: write(m, address(m))
+    if opcode in ('movzx', 'movsx', 'movsxd'):
+        if source.kind not in ('reg', 'mem'):
+            raise EmulationError(f"Unsupported source: {instruction}")
+        source_size = source.size if source.kind == 'reg' else \
+            SIZE_KEYWORDS[source.size] if source.size is not None else 32 if opcode == 'movsxd' else 8
+        read = decoder.reader(source, source_size)
+        if opcode == 'movzx':
+            return lambda m: write(m, read(m))
+        return lambda m: write(m, _signed(read(m), source_size))
+    read = decoder.reader(source, size)
+    if source.kind == 'imm' and dest.kind == 'mem':
+        # Immediate stores are sign-extended to the access width
+        value = source.value & _MASKS[size]
+        return lambda m: write(m, value)
+    return lambda m: write(m, read(m))
+
+
+def _multiply_handler(instruction, decoder, index):
+    operands = instruction.operands
+    size = decoder.width(instruction)
+    mask = _MASKS[size]
+    signed = instruction.opcode == 'imul'
+
+    if len(operands) == 1:
+        read = decoder.reader(operands[0], size)
+
+        def step(m):
+            a = m.regs[_RAX] & mask
+            b = read(m)
+            product = _signed(a, size) * _signed(b, size) if signed else a * b
+            low = product & mask
+            high = (product >> size) & mask
+            if size == 8:
+                m.regs[_RAX] = (m.regs[_RAX] & ~0xFFFF) | (product & 0xFFFF)
+            elif size == 16:
+                m.regs[_RAX] = (m.regs[_RAX] & ~mask) | low
+                m.regs[_RDX] = (m.regs[_RDX] & ~mask) | high
+            else:
+                m.regs[_RAX] = low
+                m.regs[_RDX] = high
+            m.cf = m.of = (product != _signed(low, size)) if signed else high != 0
+        return step
+
+    # 2-operand imul (and this compiler's 2-operand mul) and 3-operand imul
+    dest = operands[0]
+    first = decoder.reader(operands[1] if len(operands) == 3 else dest, size)
+    second = decoder.reader(operands[-1], size)
+    write = decoder.writer(dest, size)
+
+    def step(m):
+        product = _signed(first(m), size) * _signed(second(m), size)
+        low = product & mask
+        write(m, low)
+        m.cf = m.of = product != _signed(low, size)
+    return step
+
+
+def _divide_handler(instruction, decoder, index):
+    if len(instruction.operands) != 1 or instruction.operands[0].kind not in ('reg', 'mem'):
+        raise EmulationError(f"Unsupported divisor: {instruction}")
+    size = decoder.width(instruction)
+    mask = _MASKS[size]
+    read = decoder.reader(instruction.operands[0], size)
+    signed = instruction.opcode == 'idiv'
+
+    def step(m):
+        divisor = read(m)
+        if size == 8:
+            dividend = m.regs[_RAX] & 0xFFFF
+        else:
+            dividend = ((m.regs[_RDX] & mask) << size) | (m.regs[_RAX] & mask)
+        if divisor == 0:
+            raise EmulationError(f"Divide error: {instruction}")
+        if signed:
+            dividend, divisor = _signed(dividend, 2 * size), _signed(divisor, size)
+            quotient = abs(dividend) // abs(divisor)
+            if (dividend < 0) != (divisor < 0):
+                quotient = -quotient
+            remainder = dividend - quotient * divisor
+            if not -(1 << (size - 1)) <= quotient < 1 << (size - 1):
+                raise EmulationError(f"Divide error: {instruction}")
+        else:
+            quotient, remainder = divmod(dividend, divisor)
+            if quotient > mask:
+                raise EmulationError(f"Divide error: {instruction}")
+        quotient &= mask
+        remainder &= mask
+        if size == 8:
+            m.regs[_RAX] = (m.regs[_RAX] & ~0xFFFF) | (remainder << 8) | quotient
+        elif size == 16:
+            m.regs[_RAX] = (m.regs[_RAX] & ~mask) | quotient
+            m.regs[_RDX] = (m.regs[_RDX] & ~mask) | remainder
+        else:
+            m.regs[_RAX] = quotient
+            m.regs[_RDX] = remainder
+    return step
+
+
+def _sign_extend_handler(instruction, decoder, index):
+    opcode = instruction.opcode
+    if opcode == 'cqo':
+        def step(m):
+            m.regs[_RDX] = _MASKS[64] if m.regs[_RAX] >> 63 else 0
+    elif opcode == 'cdq':
+        def step(m):
+            m.regs[_RDX] = _MASKS[32] if (m.regs[_RAX] >> 31) & 1 else 0
+    elif opcode == 'cwd':
+        def step(m):
+            m.regs[_RDX] = (m.regs[_RDX] & ~0xFFFF) | (0xFFFF if (m.regs[_RAX] >> 15) & 1 else 0)
+    elif opcode == 'cdqe':
+        def step(m):
+            m.regs[_RAX] = _signed(m.regs[_RAX], 32) & _MASKS[64]
+    elif opcode == 'cwde':
+        def step(m):
+            m.regs[_RAX] = _signed(m.regs[_RAX], 16) & _MASKS[32]
+    else:
+        def step(m):
+            m.regs[_RAX] = (m.regs[_RAX] & ~0xFFFF) | (_signed(m.regs[_RAX], 8) & 0xFFFF)
+    return step
+
+
+def _stack_handler(instruction, decoder, index):
+    opcode = instruction.opcode
+    if opcode == 'leave':
+        def step(m):
+            m.regs[_RSP] = m.regs[_RBP]
+            m.regs[_RBP] = m.pop()
+        return step
+    operand = instruction.operands[0]
+    if opcode == 'push':
+        read = decoder.reader(operand, 64)
+        if operand.kind == 'imm':
+            value = operand.value & _MASKS[64]
+            return lambda m: m.push(value)
+        return lambda m: m.push(read(m))
+    write = decoder.writer(operand, 64)
+    return lambda m: write(m, m.pop())
+
+
+def _exchange_handler(instruction, decoder, index):
+    size = decoder.width(instruction)
+    first, second = instruction.operands
+    read_first, read_second = decoder.reader(first, size), decoder.reader(second, size)
+    write_first, write_second = decoder.writer(first, size), decoder.writer(second, size)
+
+    def step(m):
+        a, b = read_first(m), read_second(m)
+        write_first(m, b)
+        write_second(m, a)
+    return step
+
+
+def _jump_handler(instruction, decoder, index):
+    target = decoder.target(instruction)
+    opcode = instruction.opcode
+
+    def leave(m):
+        m.halt = 'jumped outside the program'
+        return -1
+
+    if opcode == 'jmp':
+        return (lambda m: target) if target is not None else leave
+    if opcode in ('jcxz', 'jecxz', 'jrcxz'):
+        mask = _MASKS[{'jcxz': 16, 'jecxz': 32, 'jrcxz': 64}[opcode]]
+        condition = lambda m: not m.regs[_RCX] & mask
+    elif opcode in LOOP_INSTRUCTIONS:
+        flag = {'loop': None, 'loope': True, 'loopz': True, 'loopne': False, 'loopnz': False}[opcode]
+
+        def condition(m):
+            m.regs[_RCX] = (m.regs[_RCX] - 1) & _MASKS[64]
+            return m.regs[_RCX] != 0 and (flag is None or m.zf == flag)
+    else:
+        condition = _condition(opcode[1:])
+
+    def step(m):
+        if condition(m):
+            return target if target is not None else leave(m)
+        return None
+    return step
+
+
+def _call_handler(instruction, decoder, index):
+    target = decoder.target(instruction)
+    if target is None:
+        # External call: modelled as returning 0 and leaving everything else alone
+        def step(m):
+            m.regs[_RAX] = 0
+        return step
+    return_address = RETURN_BASE + index + 1
+
+    def step(m):
+        m.push(return_address)
+        return target
+    return step
+
+
+def _return_handler(instruction, decoder, index):
+    if instruction.operands and (len(instruction.operands) > 1 or instruction.operands[0].kind != 'imm'):
+        raise EmulationError(f"Unsupported return: {instruction}")
+    extra = instruction.operands[0].value if instruction.operands else 0
+
+    def step(m):
+        address = m.pop()
+        m.regs[_RSP] = (m.regs[_RSP] + extra) & _MASKS[64]
+        if address == EXIT_ADDRESS:
+            m.halt = 'returned'
+            return -1
+        if address < RETURN_BASE:
+            raise EmulationError(f"Return to unknown address {address:#x}")
+        return address - RETURN_BASE
+    return step
+
+
+def _set_handler(instruction, decoder, index):
+    condition = _condition(instruction.opcode[3:])
+    write = decoder.writer(instruction.operands[0], 8)
+    return lambda m: write(m, 1 if condition(m) else 0)
+
+
+def _conditional_move_handler(instruction, decoder, index):
+    condition = _condition(instruction.opcode[4:])
+    dest, source = instruction.operands
+    size = decoder.width(instruction)
+    read_dest, read_source = decoder.reader(dest, size), decoder.reader(source, size)
+    write = decoder.writer(dest, size)
+    # A 32-bit cmov zero-extends its destination even when the move is not taken
+    return lambda m: write(m, read_source(m) if condition(m) else read_dest(m))
+
+
+def _flag_handler(instruction, decoder, index):
+    opcode = instruction.opcode
+    if opcode == 'nop':
+        return lambda m: None
+    if opcode == 'clc':
+        def step(m):
+            m.cf = False
+    elif opcode == 'stc':
+        def step(m):
+            m.cf = True
+    else:
+        def step(m):
+            m.cf = not m.cf
+    return step
+
+
+def _halt_handler(instruction, decoder, index):
+    def step(m):
+        m.halt = 'halted'
+        return -1
+    return step
+
+
+HANDLERS = {
+    'mov': _move_handler, 'movzx': _move_handler, 'movsx': _move_handler, 'movsxd': _move_handler,
+    'lea': _move_handler,
+    'add': _binary_handler, 'adc': _binary_handler, 'sub': _binary_handler, 'sbb': _binary_handler,
+    'and': _binary_handler, 'or': _binary_handler, 'xor': _binary_handler,
+    'shl': _binary_handler, 'sal': _binary_handler, 'shr': _binary_handler, 'sar': _binary_handler,
+    'rol': _binary_handler, 'ror': _binary_handler,
+    'cmp': _compare_handler, 'test': _compare_handler,
+    'inc': _unary_handler, 'dec': _unary_handler, 'neg': _unary_handler, 'not': _unary_handler,
+    'mul': _multiply_handler, 'imul': _multiply_handler,
+    'div': _divide_handler, 'idiv': _divide_handler,
+    'cqo': _sign_extend_handler, 'cdq': _sign_extend_handler, 'cwd': _sign_extend_handler,
+    'cdqe': _sign_extend_handler, 'cwde': _sign_extend_handler, 'cbw': _sign_extend_handler,
+    'push': _stack_handler, 'pop': _stack_handler, 'leave': _stack_handler,
+    'xchg': _exchange_handler,
+    'jmp': _jump_handler, 'jcxz': _jump_handler, 'jecxz': _jump_handler, 'jrcxz': _jump_handler,
+    'call': _call_handler,
+    'ret': _return_handler, 'retn': _return_handler,
+    'nop': _flag_handler, 'clc': _flag_handler, 'stc': _flag_handler, 'cmc': _flag_handler,
+    'hlt': _halt_handler,
+}
+HANDLERS.update({opcode: _jump_handler for opcode in CONDITIONAL_JUMPS | LOOP_INSTRUCTIONS})
+
+
+def _handler(opcode):
+    handler = HANDLERS.get(opcode)
+    if handler is None and opcode.startswith('set'):
+        return _set_handler
+    if handler is None and opcode.startswith('cmov'):
+        return _conditional_move_handler
+    if handler is None:
+        raise EmulationError(f"Unsupported instruction: {opcode}")
+    return handler
+
+
+class EmulatedProgram:
+    """An IR program decoded once into per-instruction closures and cycle costs"""
+
+    def __init__(self, program, memory_size=1 << 20):
+        self.memory_size = memory_size
+        instructions = []
+        labels = {}
+        for entry in program:
+            if entry.label is not None:
+                labels[entry.label] = len(instructions)
+            if entry.opcode is not None:
+                instructions.append(entry)
+        decoder = _Decoder(labels, memory_size)
+        self.instructions = instructions
+        self.steps = []
+        self.costs = []
+        for index, instruction in enumerate(instructions):
+            try:
+                self.steps.append(_handler(instruction.opcode)(instruction, decoder, index))
+            except (IndexError, ValueError, KeyError) as e:
+                raise EmulationError(f"Unsupported form: {instruction} ({e})")
+            self.costs.append(instruction_latency(instruction))
+
+    def run(self, inputs=None, max_steps=1000000):
+        """Run from the first instruction; returns counts, modelled cycles and final registers"""
+        machine = Machine(self.memory_size, inputs)
+        steps = self.steps
+        costs = self.costs
+        count = len(steps)
+        pc = 0
+        executed = 0
+        cycles = 0
+        try:
+            while 0 <= pc < count:
+                if executed >= max_steps:
+                    machine.halt = 'step limit reached'
+                    break
+                following = steps[pc](machine)
+                cycles += costs[pc]
+                executed += 1
+                pc = pc + 1 if following is None else following
+            else:
+                if machine.halt is None:
+                    machine.halt = 'fell off the end'
+        except EmulationError as e:
+            machine.halt = f"fault: {e}"
+        return {
+            'instructions': executed,
+            'cycles': cycles,
+            'halt': machine.halt,
+            'registers': machine.registers()
+        }
+
+
+def compare(baseline, optimized, inputs=None, max_steps=1000000):
+    """Run two versions of a program on the same inputs and report the measured speedup"""
+    before = EmulatedProgram(baseline).run(inputs, max_steps)
+    after = EmulatedProgram(optimized).run(inputs, max_steps)
+    return {
+        'baseline': {key: before[key] for key in ('instructions', 'cycles', 'halt')},
+        'optimized': {key: after[key] for key in ('instructions', 'cycles', 'halt')},
+        'speedup': round(before['cycles'] / after['cycles'], 4) if after['cycles'] else None,
+        'cycle_reduction_percent': round((1 - after['cycles'] / before['cycles']) * 100, 2)
+        if before['cycles'] else 0.0,
+        'instruction_reduction_percent': round((1 - after['instructions'] / before['instructions']) * 100, 2)
+        if before['instructions'] else 0.0,
+        'return_values_match': before['registers']['rax'] == after['registers']['rax']
+    }
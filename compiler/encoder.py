@@ -0,0 +1,610 @@
+from .isa import GPR_FAMILIES
+from .ir import SIZE_KEYWORDS
+
+_NUMBERS = {family: number for number, family in enumerate(GPR_FAMILIES)}
+_HIGH_BYTES = {'ah': 4, 'ch': 5, 'dh': 6, 'bh': 7}
+# Low bytes of rsp/rbp/rsi/rdi only exist with a REX prefix
+_REX_BYTES = frozenset({'spl', 'bpl', 'sil', 'dil'})
+_SEGMENT_PREFIXES = {'es': 0x26, 'cs': 0x2E, 'ss': 0x36, 'ds': 0x3E, 'fs': 0x64, 'gs': 0x65}
+
+CONDITION_CODES = {
+    'o': 0, 'no': 1, 'b': 2, 'c': 2, 'nae': 2, 'ae': 3, 'nb': 3, 'nc': 3,
+    'e': 4, 'z': 4, 'ne': 5, 'nz': 5, 'be': 6, 'na': 6, 'a': 7, 'nbe': 7,
+    's': 8, 'ns': 9, 'p': 10, 'pe': 10, 'np': 11, 'po': 11,
+    'l': 12, 'nge': 12, 'ge': 13, 'nl': 13, 'le': 14, 'ng': 14, 'g': 15, 'nle': 15,
+}
+
+# /digit of the 0x80/0x81/0x83 immediate group; the register forms are 8 * digit + 0..5
+_ALU_DIGITS = {'add': 0, 'or': 1, 'adc': 2, 'sbb': 3, 'and': 4, 'sub': 5, 'xor': 6, 'cmp': 7}
+_SHIFT_DIGITS = {'rol': 0, 'ror': 1, 'rcl': 2, 'rcr': 3, 'shl': 4, 'sal': 4, 'shr': 5, 'sar': 7}
+_UNARY_DIGITS = {'not': 2, 'neg': 3, 'mul': 4, 'imul': 5, 'div': 6, 'idiv': 7}
+_FIXED = {
+    'leave': b'\xc9', 'nop': b'\x90', 'hlt': b'\xf4',
+    'clc': b'\xf8', 'stc': b'\xf9', 'cmc': b'\xf5', 'cld': b'\xfc', 'std': b'\xfd',
+    'int3': b'\xcc', 'ud2': b'\x0f\x0b', 'syscall': b'\x0f\x05',
+    'cbw': b'\x66\x98', 'cwde': b'\x98', 'cdqe': b'\x48\x98',
+    'cwd': b'\x66\x99', 'cdq': b'\x99', 'cqo': b'\x48\x99',
+}
+# Branches with only an 8-bit displacement form
+_SHORT_ONLY = {'loop': b'\xe2', 'loope': b'\xe1', 'loopz': b'\xe1', 'loopne': b'\xe0', 'loopnz': b'\xe0',
+               'jrcxz': b'\xe3', 'jecxz': b'\x67\xe3'}
+
+
+class EncodingError(Exception):
+    """Instruction or operand form outside the encodable subset"""
+
+
+def _fits(value, bits):
+    return -(1 << (bits - 1)) <= value < 1 << (bits - 1)
+
+
+def _signed(value, size):
+    value &= (1 << size) - 1
+    return value - (1 << size) if value >> (size - 1) else value
+
+
+def _little(value, size):
+    return (value & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+
+
+def _register_number(register):
+    number = _HIGH_BYTES.get(register.name)
+    if number is None:
+        number = _NUMBERS.get(register.family)
+    if number is None:
+        raise EncodingError(f"Register {register} cannot be encoded")
+    return number
+
+
+def operand_size(instruction):
+    """Operand size in bits from a register or sized memory operand"""
+    for operand in instruction.operands:
+        if operand.kind == 'reg':
+            return operand.size
+    for operand in instruction.operands:
+        if operand.kind == 'mem' and operand.size is not None:
+            return SIZE_KEYWORDS[operand.size]
+    raise EncodingError(f"Operand size of '{instruction}' is ambiguous")
+
+
+class Encoding:
+    """Bytes of one instruction plus the symbols its displacement refers to"""
+
+    __slots__ = ('data', 'relocations')
+
+    def __init__(self, data, relocations=()):
+        self.data = bytes(data)
+        self.relocations = tuple(relocations)  # (byte position in data, symbol)
+
+
+def _encode(opcode, size, reg, rm, immediate=b'', default_64=False, byte_operands=(), low_register=None):
+    """Legacy prefixes, REX, opcode, ModRM/SIB/displacement and immediate of one instruction
+
+    reg is a register or a /digit opcode extension, rm a register or memory
+    operand or None; low_register is the register number of opcodes that
+    carry it in their low three bits. default_64 marks opcodes that are
+    64-bit without REX.W.
+    """
+    prefixes = bytearray()
+    rex = 0
+    if size == 16:
+        prefixes.append(0x66)
+    elif size == 64 and not default_64:
+        rex |= 0x08
+    reg_number = reg if isinstance(reg, int) else _register_number(reg)
+    if reg_number >= 8:
+        rex |= 0x04
+    if low_register is not None and low_register >= 8:
+        rex |= 0x01
+    needs_rex = any(operand.kind == 'reg' and operand.name in _REX_BYTES for operand in byte_operands)
+    high = any(operand.kind == 'reg' and operand.name in _HIGH_BYTES for operand in byte_operands)
+    tail = bytearray()
+    relocations = []
+    if rm is None:
+        pass
+    elif rm.kind == 'reg':
+        rm_number = _register_number(rm)
+        if rm_number >= 8:
+            rex |= 0x01
+        tail.append(0xC0 | (reg_number & 7) << 3 | rm_number & 7)
+    elif rm.kind == 'mem':
+        address_prefixes, address_rex, address, symbol_at = _address(rm, reg_number & 7)
+        prefixes[:0] = address_prefixes
+        rex |= address_rex
+        tail += address
+        if symbol_at is not None:
+            relocations.append((symbol_at, rm.symbol))
+    else:
+        raise EncodingError(f"Operand {rm} cannot be encoded")
+    if rex or needs_rex:
+        if high:
+            raise EncodingError("ah/bh/ch/dh cannot be used with a REX prefix")
+        prefixes.append(0x40 | rex)
+    start = len(prefixes) + len(opcode)
+    data = prefixes + opcode + tail + immediate
+    return Encoding(data, [(start + position, symbol) for position, symbol in relocations])
+
+
+def _address(operand, reg_field):
+    """(prefixes, REX bits, ModRM/SIB/displacement, position of a symbol displacement) of a memory operand"""
+    prefixes = bytearray()
+    rex = 0
+    if operand.segment is not None:
+        prefixes.append(_SEGMENT_PREFIXES[operand.segment])
+    base, index, disp = operand.base, operand.index, operand.disp
+    if not _fits(disp, 32):
+        raise EncodingError(f"Displacement of {operand} does not fit in 32 bits")
+    sizes = {register.size for register in operand.registers()}
+    if sizes == {32}:
+        prefixes.append(0x67)
+    elif sizes - {64}:
+        raise EncodingError(f"Address {operand} cannot be encoded in 64-bit mode")
+
+    if base is not None and base.family == 'rip':
+        if index is not None:
+            raise EncodingError(f"Address {operand} cannot be encoded")
+        return prefixes, rex, bytes([reg_field << 3 | 5]) + _little(disp, 4), 1 if operand.symbol else None
+    if base is None and index is None:
+        if operand.symbol is not None:
+            # Symbols are addressed rip-relative; the displacement is relocated
+            return prefixes, rex, bytes([reg_field << 3 | 5]) + _little(disp, 4), 1
+        return prefixes, rex, bytes([reg_field << 3 | 4, 0x25]) + _little(disp, 4), None
+
+    if index is not None:
+        index_number = _register_number(index)
+        if index_number == 4:
+            raise EncodingError(f"rsp cannot be an index register in {operand}")
+        if index_number >= 8:
+            rex |= 0x02
+    base_number = _register_number(base) if base is not None else None
+    if base_number is not None and base_number >= 8:
+        rex |= 0x01
+
+    if operand.symbol is not None or base is None:
+        mod, displacement = (0x80, _little(disp, 4)) if base is not None else (0x00, _little(disp, 4))
+    elif disp == 0 and base_number & 7 != 5:
+        mod, displacement = 0x00, b''
+    elif _fits(disp, 8):
+        mod, displacement = 0x40, _little(disp, 1)
+    else:
+        mod, displacement = 0x80, _little(disp, 4)
+
+    if index is None and base_number & 7 != 4:
+        address = bytes([mod | reg_field << 3 | base_number & 7])
+        symbol_at = 1 if operand.symbol is not None else None
+    else:
+        scale_bits = {1: 0, 2: 1, 4: 2, 8: 3}[operand.scale]
+        index_bits = index_number & 7 if index is not None else 4
+        base_bits = base_number & 7 if base is not None else 5
+        address = bytes([mod | reg_field << 3 | 4, scale_bits << 6 | index_bits << 3 | base_bits])
+        symbol_at = 2 if operand.symbol is not None else None
+    return prefixes, rex, address + displacement, symbol_at
+
+
+def _immediate(operand, size, width=None):
+    """Bytes of an immediate operand for a size-bit operation (width bytes, default min(size, 32) bits)"""
+    value = _signed(operand.value, size)
+    width = width if width is not None else min(size, 32) // 8
+    if not _fits(value, width * 8) and not (width * 8 == size and 0 <= operand.value < 1 << size):
+        raise EncodingError(f"Immediate {operand} does not fit in {width * 8} bits")
+    return _little(value, width)
+
+
+def _byte_opcode(size, byte_form, full_form):
+    return bytes([byte_form]) if size == 8 else bytes([full_form])
+
+
+# Encoders by opcode: instruction -> Encoding (branches are laid out separately)
+
+def _encode_alu(instruction):
+    digit = _ALU_DIGITS[instruction.opcode]
+    dest, source = instruction.operands
+    size = operand_size(instruction)
+    if source.kind == 'imm':
+        value = _signed(source.value, size)
+        if size != 8 and _fits(value, 8):
+            return _encode(b'\x83', size, digit, dest, _immediate(source, size, 1), byte_operands=(dest,))
+        if dest.kind == 'reg' and dest.family == 'rax' and dest.name not in _HIGH_BYTES:
+            # Accumulator short form, no ModRM
+            return _encode(_byte_opcode(size, 8 * digit + 4, 8 * digit + 5), size, 0, None,
+                           _immediate(source, size), byte_operands=(dest,))
+        return _encode(_byte_opcode(size, 0x80, 0x81), size, digit, dest, _immediate(source, size),
+                       byte_operands=(dest,))
+    if source.kind == 'reg':
+        return _encode(_byte_opcode(size, 8 * digit, 8 * digit + 1), size, source, dest,
+                       byte_operands=(dest, source))
+    if dest.kind == 'reg' and source.kind == 'mem':
+        return _encode(_byte_opcode(size, 8 * digit + 2, 8 * digit + 3), size, dest, source,
+                       byte_operands=(dest,))
+    raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+
+
+def _encode_test(instruction):
+    first, second = instruction.operands
+    size = operand_size(instruction)
+    if second.kind == 'imm':
+        if first.kind == 'reg' and first.family == 'rax' and first.name not in _HIGH_BYTES:
+            return _encode(_byte_opcode(size, 0xA8, 0xA9), size, 0, None, _immediate(second, size),
+                           byte_operands=(first,))
+        return _encode(_byte_opcode(size, 0xF6, 0xF7), size, 0, first, _immediate(second, size),
+                       byte_operands=(first,))
+    if first.kind == 'mem':
+        first, second = second, first
+    if first.kind != 'reg':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    return _encode(_byte_opcode(size, 0x84, 0x85), size, first, second, byte_operands=(first, second))
+
+
+def _encode_mov(instruction):
+    dest, source = instruction.operands
+    if dest.kind == 'sym' or source.kind == 'sym':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    size = operand_size(instruction)
+    if source.kind == 'imm':
+        if dest.kind == 'reg':
+            number = _register_number(dest)
+            value = _signed(source.value, size)
+            if size == 64 and _fits(value, 32):
+                return _encode(b'\xc7', size, 0, dest, _little(value, 4))
+            if size == 64:
+                return _encode(bytes([0xB8 + (number & 7)]), size, 0, None, _little(value, 8), low_register=number)
+            return _encode(bytes([(0xB0 if size == 8 else 0xB8) + (number & 7)]), size, 0, None,
+                           _immediate(source, size), byte_operands=(dest,), low_register=number)
+        return _encode(_byte_opcode(size, 0xC6, 0xC7), size, 0, dest, _immediate(source, size))
+    if source.kind == 'reg':
+        return _encode(_byte_opcode(size, 0x88, 0x89), size, source, dest, byte_operands=(dest, source))
+    if dest.kind == 'reg':
+        return _encode(_byte_opcode(size, 0x8A, 0x8B), size, dest, source, byte_operands=(dest,))
+    raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+
+
+def _encode_lea(instruction):
+    dest, source = instruction.operands
+    if dest.kind != 'reg' or source.kind != 'mem':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    return _encode(b'\x8d', dest.size, dest, source)
+
+
+def _encode_extend(instruction):
+    dest, source = instruction.operands
+    if dest.kind != 'reg' or source.kind not in ('reg', 'mem'):
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    opcode = instruction.opcode
+    if opcode == 'movsxd':
+        return _encode(b'\x63', dest.size, dest, source)
+    source_size = source.size if source.kind == 'reg' else SIZE_KEYWORDS.get(source.size) if source.size else None
+    if source_size not in (8, 16):
+        raise EncodingError(f"Source size of '{instruction}' is ambiguous")
+    second = {('movzx', 8): 0xB6, ('movzx', 16): 0xB7, ('movsx', 8): 0xBE, ('movsx', 16): 0xBF}[opcode, source_size]
+    return _encode(bytes([0x0F, second]), dest.size, dest, source, byte_operands=(source,))
+
+
+def _encode_unary(instruction):
+    operands = instruction.operands
+    opcode = instruction.opcode
+    size = operand_size(instruction)
+    if opcode in ('inc', 'dec'):
+        return _encode(_byte_opcode(size, 0xFE, 0xFF), size, 0 if opcode == 'inc' else 1, operands[0],
+                       byte_operands=operands)
+    if opcode == 'imul' and len(operands) > 1:
+        return _encode_imul(instruction, size)
+    if len(operands) != 1:
+        raise EncodingError(f"Form of '{instruction}' cannot be encoded")
+    return _encode(_byte_opcode(size, 0xF6, 0xF7), size, _UNARY_DIGITS[opcode], operands[0],
+                   byte_operands=operands)
+
+
+def _encode_imul(instruction, size):
+    operands = instruction.operands
+    dest = operands[0]
+    if dest.kind != 'reg' or size == 8:
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    if len(operands) == 2 and operands[1].kind != 'imm':
+        return _encode(b'\x0f\xaf', size, dest, operands[1])
+    source, factor = (dest, operands[1]) if len(operands) == 2 else operands[1:]
+    if factor.kind != 'imm':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    if _fits(_signed(factor.value, size), 8):
+        return _encode(b'\x6b', size, dest, source, _immediate(factor, size, 1))
+    return _encode(b'\x69', size, dest, source, _immediate(factor, size))
+
+
+def _encode_shift(instruction):
+    dest, count = instruction.operands
+    size = operand_size(instruction)
+    digit = _SHIFT_DIGITS[instruction.opcode]
+    if count.kind == 'imm' and count.value == 1:
+        return _encode(_byte_opcode(size, 0xD0, 0xD1), size, digit, dest, byte_operands=(dest,))
+    if count.kind == 'imm':
+        return _encode(_byte_opcode(size, 0xC0, 0xC1), size, digit, dest, _little(count.value, 1),
+                       byte_operands=(dest,))
+    if count.kind == 'reg' and count.name == 'cl':
+        return _encode(_byte_opcode(size, 0xD2, 0xD3), size, digit, dest, byte_operands=(dest,))
+    raise EncodingError(f"Shift count of '{instruction}' cannot be encoded")
+
+
+def _encode_stack(instruction):
+    if len(instruction.operands) != 1:
+        raise EncodingError(f"Form of '{instruction}' cannot be encoded")
+    operand = instruction.operands[0]
+    push = instruction.opcode == 'push'
+    if operand.kind not in ('reg', 'mem', 'imm'):
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    if operand.kind == 'imm':
+        if not push:
+            raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+        if _fits(operand.value, 8):
+            return Encoding(b'\x6a' + _little(operand.value, 1))
+        return Encoding(b'\x68' + _immediate(operand, 64))
+    size = operand.size if operand.kind == 'reg' else SIZE_KEYWORDS[operand.size] if operand.size else 64
+    if size not in (16, 64):
+        raise EncodingError(f"Operand size of '{instruction}' cannot be pushed or popped")
+    if operand.kind == 'reg':
+        number = _register_number(operand)
+        return _encode(bytes([(0x50 if push else 0x58) + (number & 7)]), size, 0, None,
+                       default_64=True, low_register=number)
+    return _encode(b'\xff' if push else b'\x8f', size, 6 if push else 0, operand, default_64=True)
+
+
+def _encode_xchg(instruction):
+    first, second = instruction.operands
+    size = operand_size(instruction)
+    if first.kind == 'mem':
+        first, second = second, first
+    if first.kind != 'reg':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    if size != 8 and second.kind == 'reg' and 'rax' in (first.family, second.family) and first is not second:
+        # Accumulator short form 90+r (xchg eax, eax keeps the ModRM form: 90 is nop)
+        other = second if first.family == 'rax' else first
+        number = _register_number(other)
+        return _encode(bytes([0x90 + (number & 7)]), size, 0, None, low_register=number)
+    return _encode(_byte_opcode(size, 0x86, 0x87), size, first, second, byte_operands=(first, second))
+
+
+def _encode_setcc(instruction):
+    code = CONDITION_CODES.get(instruction.opcode[3:])
+    if code is None or len(instruction.operands) != 1:
+        raise EncodingError(f"'{instruction}' cannot be encoded")
+    operand = instruction.operands[0]
+    if operand.kind == 'reg' and operand.size != 8:
+        raise EncodingError(f"'{instruction}' cannot be encoded")
+    return _encode(bytes([0x0F, 0x90 + code]), 8, 0, operand, byte_operands=(operand,))
+
+
+def _encode_cmov(instruction):
+    code = CONDITION_CODES.get(instruction.opcode[4:])
+    dest, source = instruction.operands
+    if code is None or dest.kind != 'reg' or dest.size == 8:
+        raise EncodingError(f"'{instruction}' cannot be encoded")
+    return _encode(bytes([0x0F, 0x40 + code]), dest.size, dest, source)
+
+
+def _encode_indirect(instruction):
+    """jmp/call through a register or memory operand"""
+    operand = instruction.operands[0]
+    return _encode(b'\xff', 64, 4 if instruction.opcode == 'jmp' else 2, operand, default_64=True)
+
+
+def _encode_ret(instruction):
+    if not instruction.operands:
+        return Encoding(b'\xc3')
+    if len(instruction.operands) != 1 or instruction.operands[0].kind != 'imm':
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded")
+    count = instruction.operands[0].value
+    if not 0 <= count < 1 << 16:
+        raise EncodingError(f"Immediate of '{instruction}' does not fit in 16 bits")
+    return Encoding(b'\xc2' + _little(count, 2))
+
+
+ENCODERS = {
+    'mov': _encode_mov, 'lea': _encode_lea,
+    'movzx': _encode_extend, 'movsx': _encode_extend, 'movsxd': _encode_extend,
+    'test': _encode_test, 'xchg': _encode_xchg,
+    'inc': _encode_unary, 'dec': _encode_unary, 'not': _encode_unary, 'neg': _encode_unary,
+    'mul': _encode_unary, 'imul': _encode_unary, 'div': _encode_unary, 'idiv': _encode_unary,
+    'push': _encode_stack, 'pop': _encode_stack,
+    'ret': _encode_ret, 'retn': _encode_ret,
+}
+ENCODERS.update({opcode: _encode_alu for opcode in _ALU_DIGITS})
+ENCODERS.update({opcode: _encode_shift for opcode in _SHIFT_DIGITS})
+
+
+def encode(instruction):
+    """Encoding of an instruction other than a direct branch; raises EncodingError outside the supported subset"""
+    opcode = instruction.opcode
+    if opcode in _FIXED:
+        if instruction.operands:
+            raise EncodingError(f"'{instruction}' takes no operands")
+        return Encoding(_FIXED[opcode])
+    encoder = ENCODERS.get(opcode)
+    if encoder is None:
+        if opcode in ('jmp', 'call') and len(instruction.operands) == 1 and instruction.operands[0].kind != 'sym':
+            encoder = _encode_indirect
+        elif opcode.startswith('set'):
+            encoder = _encode_setcc
+        elif opcode.startswith('cmov'):
+            encoder = _encode_cmov
+        else:
+            raise EncodingError(f"Instruction '{opcode}' is not supported by the encoder")
+    try:
+        return encoder(instruction)
+    except ValueError as e:
+        raise EncodingError(f"Operands of '{instruction}' cannot be encoded ({e})")
+
+
+def encoded_size(instruction):
+    """Byte size of a non-branch instruction, or None when it cannot be encoded"""
+    try:
+        return len(encode(instruction).data)
+    except EncodingError:
+        return None
+
+
+def _branch_forms(opcode):
+    """(short form opcode bytes or None, near form opcode bytes or None) of a direct branch"""
+    if opcode == 'jmp':
+        return b'\xeb', b'\xe9'
+    if opcode == 'call':
+        return None, b'\xe8'
+    if opcode in _SHORT_ONLY:
+        return _SHORT_ONLY[opcode], None
+    code = CONDITION_CODES.get(opcode[1:]) if opcode.startswith('j') else None
+    if code is None:
+        return None
+    return bytes([0x70 + code]), bytes([0x0F, 0x80 + code])
+
+
+class Assembly:
+    """Machine code of an IR program, with short/near branch relaxation
+
+    Branches to labels in the program start in their short form and are
+    widened to the near form until every displacement fits (widening only
+    grows the code, so this terminates). Branches to other symbols are
+    near and leave a relocation. Instructions outside the supported subset
+    are recorded in errors and take no bytes.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.encodings = [None] * len(program)
+        self.errors = []  # (position, message)
+        labels = {}
+        branches = {}  # position -> (short opcode, near opcode, target label or None)
+        for position, entry in enumerate(program):
+            if entry.label is not None:
+                labels[entry.label] = position
+            if entry.opcode is None:
+                continue
+            operands = entry.operands
+            forms = _branch_forms(entry.opcode) if len(operands) == 1 and operands[0].kind == 'sym' else None
+            if forms is not None:
+                branches[position] = forms + (operands[0].text,)
+                continue
+            try:
+                self.encodings[position] = encode(entry)
+            except EncodingError as e:
+                self.errors.append((position, str(e)))
+        self.labels = labels
+        # Labels outside the program that branches with a short form go to:
+        # placed next to the code defining them, those branches might be short
+        self.external_targets = frozenset(target for short, _, target in branches.values()
+                                          if short is not None and target not in labels)
+        self.near = self._relax(branches)
+        self._emit_branches(branches)
+        self.offsets = []
+        offset = 0
+        for encoding in self.encodings:
+            self.offsets.append(offset)
+            offset += len(encoding.data) if encoding is not None else 0
+        self.size = offset
+
+    def _relax(self, branches):
+        """Positions of branches that need their near form"""
+        near = {position for position, (short, _, target) in branches.items()
+                if short is None or target not in self.labels}
+        while True:
+            offsets = self._layout(branches, near)
+            widened = False
+            for position, (short, near_opcode, target) in branches.items():
+                if position in near or near_opcode is None:
+                    continue
+                end = offsets[position] + len(short) + 1
+                if not _fits(offsets[self.labels[target]] - end, 8):
+                    near.add(position)
+                    widened = True
+            if not widened:
+                return near
+
+    def _layout(self, branches, near):
+        offsets = []
+        offset = 0
+        for position, encoding in enumerate(self.encodings):
+            offsets.append(offset)
+            if encoding is not None:
+                offset += len(encoding.data)
+            elif position in branches:
+                short, near_opcode, _ = branches[position]
+                if position not in near:
+                    offset += len(short) + 1
+                elif near_opcode is not None:
+                    offset += len(near_opcode) + 4
+                # else a short-only branch out of range: an error, taking no bytes
+        offsets.append(offset)
+        return offsets
+
+    def _emit_branches(self, branches):
+        offsets = self._layout(branches, self.near)
+        for position, (short, near_opcode, target) in branches.items():
+            width = 4 if position in self.near else 1
+            opcode = near_opcode if position in self.near else short
+            if opcode is None:
+                self.errors.append((position, f"'{self.program[position].opcode}' cannot reach {target}"))
+                continue
+            if target not in self.labels:
+                self.encodings[position] = Encoding(opcode + bytes(4), [(len(opcode), target)])
+                continue
+            displacement = offsets[self.labels[target]] - (offsets[position] + len(opcode) + width)
+            if not _fits(displacement, width * 8):
+                # Only the short-only branches (loop, jrcxz) can end up here
+                self.errors.append((position, f"'{self.program[position].opcode}' cannot reach {target}"))
+                continue
+            self.encodings[position] = Encoding(opcode + _little(displacement, width))
+        self.errors.sort()
+
+    @property
+    def code(self):
+        """The machine code as one byte string"""
+        return b''.join(encoding.data for encoding in self.encodings if encoding is not None)
+
+    def sizes(self):
+        """Byte size per IR entry (0 for labels and comments, None for unencodable instructions)"""
+        failed = {position for position, _ in self.errors}
+        return [None if position in failed else len(encoding.data) if encoding is not None else 0
+                for position, encoding in enumerate(self.encodings)]
+
+    def report(self, cfg=None, with_hex=False):
+        """Sizes per instruction, per block (given the program's CFG) and in total; hex on request"""
+        instructions = []
+        relocations = []
+        for position, entry in enumerate(self.program):
+            if entry.opcode is None:
+                continue
+            encoding = self.encodings[position]
+            item = {
+                'instruction': _text(entry),
+                'offset': self.offsets[position],
+                'size': len(encoding.data) if encoding is not None else None
+            }
+            if with_hex and encoding is not None:
+                item['hex'] = encoding.data.hex()
+                relocations.extend({'offset': self.offsets[position] + at, 'symbol': symbol}
+                                   for at, symbol in encoding.relocations)
+            instructions.append(item)
+
+        report = {
+            'total_bytes': self.size,
+            'instructions': instructions,
+            'near_branches': len(self.near),
+            'unencodable': [{'instruction': _text(self.program[position]), 'error': message}
+                            for position, message in self.errors]
+        }
+        if cfg is not None:
+            report['blocks'] = [{
+                'block': block.index,
+                'labels': list(block.labels),
+                'offset': self.offsets[block.start] if block.start < len(self.offsets) else self.size,
+                'bytes': sum(len(encoding.data) for encoding in self.encodings[block.start:block.end]
+                             if encoding is not None)
+            } for block in cfg.blocks]
+        if with_hex:
+            report['hex'] = self.code.hex()
+            report['relocations'] = relocations
+        return report
+
+
+def _text(entry):
+    """An instruction without its trailing comment"""
+    text = entry.opcode
+    if entry.operands:
+        text += ' ' + ', '.join(str(operand) for operand in entry.operands)
+    return text
@@ -0,0 +1,477 @@
+import re
+import logging
+import threading
+from collections import OrderedDict
+from .cache import CompilationCache
+from .encoder import Assembly
+from .instrumentation import StageRecorder
+from .ir import Instruction, Symbol, parse_line, parse_lines, render
+from .isa import RETURNS, UNCONDITIONAL_JUMPS
+from .loops import program_labels, unique_label
+from .x86_compiler import COMPILER_VERSION, ReportPart
+
+logger = logging.getLogger(__name__)
+
+_PROC_RE = re.compile(r'([A-Za-z_.$@?][\w.$@?]*)\s+(proc|endp)\b', re.IGNORECASE)
+_GLOBAL_RE = re.compile(r'(?:\.globl|\.global|global|public)\s+(.+)$', re.IGNORECASE)
+
+# Directives that neither execute nor fall through to the next line
+_DIRECTIVES = frozenset({'section', 'segment', 'align', 'global', 'globl', 'public', 'extern', 'extrn',
+                         'bits', 'default'})
+_NO_FALLTHROUGH = RETURNS | UNCONDITIONAL_JUMPS
+
+
+class Function:
+    """A run of source lines compiled as one unit, with their parsed IR"""
+
+    __slots__ = ('name', 'lines', 'program')
+
+    def __init__(self, name, lines, program):
+        self.name = name
+        self.lines = lines
+        self.program = program
+
+    @property
+    def source(self):
+        return '\n'.join(self.lines)
+
+    def __repr__(self):
+        return f"Function({self.name}, {len(self.lines)} lines)"
+
+
+class SourceLine:
+    """What splitting needs from one cleaned source line, worked out once per distinct line"""
+
+    __slots__ = ('entries', 'proc', 'declares', 'falls_through')
+
+    def __init__(self, line):
+        self.entries = parse_line(line)
+        match = _PROC_RE.match(line)
+        # (name, True) for `name proc`, (name, False) for `name endp`
+        self.proc = (match.group(1), match.group(2).lower() == 'proc') if match else None
+        self.declares = _declared_names(line, self.proc)
+        self.falls_through = _falls_through(line, self.entries)
+
+
+def split_functions(lines, scan=SourceLine):
+    """Split cleaned source lines into functions, in source order
+
+    A function starts at a `name proc` line or at a label declared with
+    global/.globl/public; a source that declares neither is split at every
+    label not starting with '.' or '@'. A boundary is only taken where the
+    previous line cannot fall through into it (after ret or jmp). Functions
+    branching into the middle of another function, rather than to its entry
+    label, are merged with it, so each unit sees all the ways into its code.
+    scan gives the SourceLine of a line (a memoized one, say).
+    """
+    scanned = [scan(line) for line in lines]
+    declared = set()
+    for source_line in scanned:
+        declared.update(source_line.declares)
+    functions = []
+    current = []
+    program = []
+    name = None
+    # Whether the current function has code yet, and whether its last instruction falls through
+    executes = False
+    falls_through = False
+    for line, source_line in zip(lines, scanned):
+        start = _function_start(source_line, declared)
+        if start is not None and executes and not falls_through:
+            functions.append(Function(name, current, program))
+            current = []
+            program = []
+            name = None
+            executes = False
+        if name is None:
+            name = start
+        current.append(line)
+        program.extend(source_line.entries)
+        if source_line.falls_through is not None:
+            executes = True
+            falls_through = source_line.falls_through
+    if current:
+        functions.append(Function(name, current, program))
+    return _merge_entered(functions)
+
+
+def _declared_names(line, proc):
+    """Function names a line declares: global/.globl/public names or a proc's name"""
+    match = _GLOBAL_RE.match(line)
+    if match:
+        names = []
+        for name in match.group(1).split(','):
+            # NASM allows `global name:function`
+            name = name.split(':')[0].strip()
+            if name:
+                names.append(name)
+        return tuple(names)
+    if proc is not None and proc[1]:
+        return (proc[0],)
+    return ()
+
+
+def _function_start(source_line, declared):
+    """Name of the function a line begins, or None"""
+    if source_line.proc is not None:
+        name, opens = source_line.proc
+        return name if opens else None
+    entries = source_line.entries
+    if not entries or entries[0].label is None:
+        return None
+    label = entries[0].label
+    if declared:
+        return label if label in declared else None
+    return None if label.startswith(('.', '@')) else label
+
+
+def _falls_through(line, entries):
+    """Whether control can run off the end of line into the next one; None without an instruction"""
+    if _PROC_RE.match(line) or _GLOBAL_RE.match(line):
+        return None
+    for entry in entries:
+        if entry.opcode is None or entry.opcode.startswith('.') or entry.opcode in _DIRECTIVES:
+            continue
+        return entry.opcode not in _NO_FALLTHROUGH
+    return None
+
+
+def _merge_entered(functions):
+    """Merge functions until every cross-function reference names an entry label"""
+    programs = [function.program for function in functions]
+    references = [_referenced_labels(program) for program in programs]
+    # joined[k]: functions k and k + 1 are compiled together
+    joined = [False] * max(len(functions) - 1, 0)
+    changed = True
+    while changed:
+        changed = False
+        groups = _groups(joined, len(functions))
+        owner = {}
+        entries = []
+        for group, (first, last) in enumerate(groups):
+            entries.append(_entry_labels(programs[first]))
+            for index in range(first, last + 1):
+                for label in program_labels(programs[index]):
+                    owner[label] = group
+        for group, (first, last) in enumerate(groups):
+            for index in range(first, last + 1):
+                for label in references[index]:
+                    other = owner.get(label)
+                    if other is None or other == group or label in entries[other]:
+                        continue
+                    low, high = sorted((group, other))
+                    for k in range(groups[low][0], groups[high][0]):
+                        joined[k] = True
+                    changed = True
+
+    merged = []
+    for first, last in _groups(joined, len(functions)):
+        group = functions[first:last + 1]
+        lines = []
+        program = []
+        for function in group:
+            lines.extend(function.lines)
+            program.extend(function.program)
+        merged.append(Function(next((function.name for function in group if function.name), None), lines, program))
+    return merged
+
+
+def _groups(joined, count):
+    """(first, last) index ranges of consecutive joined functions"""
+    groups = []
+    first = 0
+    for index in range(count):
+        if index == count - 1 or not joined[index]:
+            groups.append((first, index))
+            first = index + 1
+    return groups
+
+
+def _entry_labels(program):
+    """Labels before a program's first instruction"""
+    labels = set()
+    for entry in program:
+        if entry.opcode is not None:
+            break
+        if entry.label is not None:
+            labels.add(entry.label)
+    return labels
+
+
+def _referenced_labels(program):
+    names = set()
+    for entry in program:
+        for operand in entry.operands:
+            if operand.kind == 'sym':
+                names.add(operand.text)
+            elif operand.kind == 'mem' and operand.symbol:
+                names.add(operand.symbol)
+    return names
+
+
+def _rename_labels(program, renames):
+    """Program with labels (definitions and symbol operands) renamed"""
+    renamed = []
+    for entry in program:
+        label = renames.get(entry.label, entry.label)
+        operands = entry.operands
+        if any(operand.kind == 'sym' and operand.text in renames for operand in operands):
+            operands = tuple(Symbol(renames[operand.text]) if operand.kind == 'sym' and operand.text in renames
+                             else operand for operand in operands)
+        if label != entry.label or operands is not entry.operands:
+            entry = Instruction(entry.opcode, operands, label, entry.comment)
+        renamed.append(entry)
+    return renamed
+
+
+class _Unit:
+    """A compiled function as the merge needs it: parsed output, its text and its report figures"""
+
+    __slots__ = ('labels', 'code', 'generated', 'text', 'translated', 'part')
+
+    def __init__(self, function, compiled_code, translated):
+        self.labels = program_labels(function.program)
+        self.code = parse_lines(compiled_code.split('\n'))
+        # Labels the passes added, which may clash with another function's
+        self.generated = [entry.label for entry in self.code
+                          if entry.label is not None and entry.label not in self.labels]
+        self.text = render(self.code)
+        self.translated = translated
+        self.part = ReportPart(function.lines, translated, self.code)
+
+
+class FunctionCompiler:
+    """Compiles a large source one function at a time, across the batch process pool
+
+    Functions are optimized independently, each through a per-function
+    cache, so editing one function of a listing only recompiles that
+    function. Sources with fewer than min_functions functions are compiled
+    whole. Results are merged in source order; labels that optimization
+    passes generate are renamed where two functions produced the same one,
+    so the output is the same whichever workers ran.
+
+    The parsed output, encodings and report figures of each function are
+    kept too (in memory, as units), so an edit costs the functions it
+    touched plus joining the others' pieces, not a pass over the whole
+    source. Source lines are scanned for splitting once per distinct line.
+    """
+
+    def __init__(self, compiler, batch_compiler, cache_entries=4096, min_functions=8, time_budget=None,
+                 line_entries=1 << 18):
+        self.compiler = compiler
+        self.batch_compiler = batch_compiler
+        self.min_functions = min_functions
+        # Per-function limit, as for single compilations
+        self.time_budget = time_budget
+        self.cache = CompilationCache(max_entries=cache_entries, version=COMPILER_VERSION)
+        self.cache_entries = cache_entries
+        self.line_entries = line_entries
+        self._units = OrderedDict()  # cache key -> _Unit, least recently used first
+        self._lines = {}  # source line -> SourceLine
+        self._lock = threading.Lock()
+        self.compilations = 0
+        self.functions = 0
+        self.recompiled = 0
+
+    def compile(self, assembly_code, optimization_level='none', min_functions=None):
+        """Compile a source, per function when it has enough of them (same result shape as X86Compiler.compile)
+
+        min_functions overrides the instance threshold; editor sessions pass
+        1 so that every compile goes through the per-function cache.
+        """
+        recorder = StageRecorder()
+        recorder.start()
+        lines = self.compiler.clean(assembly_code)
+        functions = recorder.run('split_functions', split_functions, lines, self._scan_line)
+        if len(functions) < (self.min_functions if min_functions is None else min_functions):
+            return self.compiler.compile(assembly_code, optimization_level, time_budget=self.time_budget)
+        try:
+            return self._compile_split(assembly_code, optimization_level, lines, functions, recorder)
+        except Exception as e:
+            logger.error(f"Per-function compilation failed: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def _compile_split(self, assembly_code, optimization_level, lines, functions, recorder):
+        logger.info(f"Compiling {len(functions)} functions with optimization level: {optimization_level}")
+
+        keys = [self.cache.make_key(function.source, optimization_level) for function in functions]
+        results = [self.cache.get(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        reusable = set()
+        for position, result in zip(missing, self._compile_functions([functions[position] for position in missing],
+                                                                     optimization_level)):
+            if not result['success']:
+                name = functions[position].name or 'top level'
+                return {'success': False, 'error': f"{name}: {result['error']}"}
+            result = {key: result[key] for key in ('compiled_code', 'skipped_passes', 'stats')}
+            # Passes dropped for time depend on load, so those results are not reused
+            if all(skipped['reason'] == 'program too large' for skipped in result['skipped_passes']):
+                self.cache.put(keys[position], result)
+                reusable.add(position)
+            results[position] = result
+        compiled = set(missing)
+        merged = recorder.run('merge_functions', self._merge, functions, keys, results, compiled, reusable)
+        result = self.compiler.combine_reports(assembly_code, merged.text, optimization_level, merged.parts)
+        if result is None:
+            # Functions that do not assemble the same apart: encode the joined program
+            assembly = recorder.run('encode_program', Assembly, merged.program)
+            translated_code = [entry for unit in merged.units for entry in unit.translated]
+            result = self.compiler.report(assembly_code, lines, translated_code, merged.program, merged.text,
+                                          optimization_level, assembly)
+        recorder.stop()
+
+        with self._lock:
+            self.compilations += 1
+            self.functions += len(functions)
+            self.recompiled += len(missing)
+
+        result['skipped_passes'] = _merge_skipped([results[position] for position in missing])
+        result['stats'] = _merge_stats(recorder, [results[position]['stats'] for position in missing])
+        result['functions'] = [{
+            'name': function.name,
+            'lines': len(function.lines),
+            'cached': position not in compiled
+        } for position, function in enumerate(functions)]
+        return result
+
+    def _scan_line(self, line):
+        """SourceLine of a line, memoized: most lines of an edited source were split before"""
+        scanned = self._lines.get(line)
+        if scanned is None:
+            if len(self._lines) >= self.line_entries:
+                self._lines.clear()
+            scanned = self._lines[line] = SourceLine(line)
+        return scanned
+
+    def _unit(self, function, key, result, compiled, reusable):
+        """A function's unit: from the unit cache unless the function was just compiled"""
+        if not compiled:
+            with self._lock:
+                unit = self._units.get(key)
+                if unit is not None:
+                    self._units.move_to_end(key)
+                    return unit
+        unit = _Unit(function, result['compiled_code'], self.compiler.translate(function.source))
+        if reusable:
+            with self._lock:
+                self._units[key] = unit
+                while len(self._units) > self.cache_entries:
+                    self._units.popitem(last=False)
+        return unit
+
+    def stats(self):
+        """Compilation counters and per-function cache occupancy"""
+        cache = self.cache.stats()
+        with self._lock:
+            return {
+                'compilations': self.compilations,
+                'functions': self.functions,
+                'recompiled': self.recompiled,
+                'cache_entries': cache['entries'],
+                'cache_hits': cache['hits'],
+                'cache_misses': cache['misses']
+            }
+
+    def _compile_functions(self, functions, optimization_level):
+        """Compile functions in order, in-process when there is only one"""
+        if len(functions) == 1:
+            return [self.compiler.compile(functions[0].source, optimization_level, time_budget=self.time_budget)]
+        return self.batch_compiler.compile_batch([{
+            'id': position,
+            'assembly_code': function.source,
+            'optimization_level': optimization_level
+        } for position, function in enumerate(functions)])
+
+    def _merge(self, functions, keys, results, compiled, reusable):
+        """Concatenate compiled functions, renaming generated labels another function already uses
+
+        compiled holds the positions just compiled and reusable those of
+        them whose units may be cached. Report parts are computed again
+        only for functions whose labels were renamed.
+        """
+        units = [self._unit(function, key, result, position in compiled,
+                            position not in compiled or position in reusable)
+                 for position, (function, key, result) in enumerate(zip(functions, keys, results))]
+        taken = set().union(*(unit.labels for unit in units))
+        program = []
+        texts = []
+        parts = []
+        for function, unit in zip(functions, units):
+            renames = {}
+            for label in unit.generated:
+                if label in renames:
+                    continue
+                if label in taken:
+                    renames[label] = unique_label(label, taken)
+                else:
+                    taken.add(label)
+            if renames:
+                code = _rename_labels(unit.code, renames)
+                text = render(code)
+                part = ReportPart(function.lines, unit.translated, code)
+            else:
+                code, text, part = unit.code, unit.text, unit.part
+            program.extend(code)
+            if code:
+                texts.append(text)
+            parts.append(part)
+        return _Merged(units, program, '\n'.join(texts), parts)
+
+
+class _Merged:
+    """The joined output of a split compile, with each function's unit and report part"""
+
+    __slots__ = ('units', 'program', 'text', 'parts')
+
+    def __init__(self, units, program, text, parts):
+        self.units = units
+        self.program = program
+        self.text = text
+        self.parts = parts
+
+
+def _merge_skipped(results):
+    skipped = []
+    for result in results:
+        for entry in result['skipped_passes']:
+            if entry not in skipped:
+                skipped.append(entry)
+    return skipped
+
+
+def _merge_stats(recorder, function_stats):
+    """Stages of the whole compile, with each compiler stage summed over the recompiled functions
+
+    Function stages ran in parallel workers, so their times can add up to
+    more than the total wall time.
+    """
+    stages = {}
+    pipeline = None
+    for stats in function_stats:
+        for stage in stats['stages']:
+            total = stages.get(stage['name'])
+            if total is None:
+                stages[stage['name']] = dict(stage)
+                continue
+            for field in ('time_ns', 'instructions_in', 'instructions_out'):
+                total[field] += stage[field]
+        summary = stats.get('pipeline')
+        if summary is None:
+            continue
+        if pipeline is None:
+            pipeline = dict(summary, skipped_passes=[])
+        else:
+            pipeline['iterations'] = max(pipeline['iterations'], summary['iterations'])
+            pipeline['pass_runs'] += summary['pass_runs']
+            pipeline['passes_skipped_unchanged'] += summary['passes_skipped_unchanged']
+    result = recorder.as_dict()
+    result['stages'] = recorder.stages[:1] + list(stages.values()) + recorder.stages[1:]
+    result['functions_compiled'] = len(function_stats)
+    if pipeline is not None:
+        pipeline['skipped_passes'] = _merge_skipped([stats['pipeline'] for stats in function_stats
+                                                     if 'pipeline' in stats])
+        result['pipeline'] = pipeline
+    return result
@@ -0,0 +1,85 @@
+import time
+import tracemalloc
+
+
+def count_instructions(code):
+    """Count real instructions in source text, source lines, IR, an assembled program or split functions
+
+    Labels and comments in IR are excluded; source lines count as they are.
+    """
+    code = getattr(code, 'program', code)
+    if isinstance(code, str):
+        return code.count('\n') + 1 if code else 0
+    count = 0
+    for entry in code:
+        if isinstance(entry, str) or getattr(entry, 'opcode', None) is not None:
+            count += 1
+        elif hasattr(entry, 'lines'):
+            count += len(entry.lines)
+    return count
+
+
+class StageRecorder:
+    """Records wall time, instruction counts and optional peak memory per compiler stage"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.details = {}  # extra report sections (e.g. the optimization pipeline)
+        self.total_time_ns = 0
+        self._start_ns = None
+        self._owns_tracing = False
+
+    def start(self):
+        """Begin timing a compilation (and memory tracing, if requested)"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        self._start_ns = time.perf_counter_ns()
+
+    def stop(self):
+        """Finish timing a compilation"""
+        if self._start_ns is not None:
+            self.total_time_ns = time.perf_counter_ns() - self._start_ns
+            self._start_ns = None
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    def run(self, name, func, code, *args, kind='stage'):
+        """Run one stage on code, recording its measurements, and return its output"""
+        instructions_in = count_instructions(code)
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        started = time.perf_counter_ns()
+        result = func(code, *args)
+        elapsed = time.perf_counter_ns() - started
+
+        stage = {
+            'name': name,
+            'kind': kind,
+            'time_ns': elapsed,
+            'instructions_in': instructions_in,
+            'instructions_out': count_instructions(result)
+        }
+        if tracing:
+            stage['peak_memory_bytes'] = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        self.stages.append(stage)
+        return result
+
+    def annotate(self, **fields):
+        """Attach extra fields to the most recent stage"""
+        self.stages[-1].update(fields)
+
+    def as_dict(self):
+        """Measurements in a JSON-friendly form"""
+        result = {
+            'total_time_ns': self.total_time_ns,
+            'memory_traced': self.trace_memory,
+            'stages': self.stages
+        }
+        result.update(self.details)
+        return result
@@ -0,0 +1,421 @@
+import re
+
+
+class Register:
+    """Machine register operand (interned, one instance per name)"""
+
+    __slots__ = ('name', 'family', 'size')
+    kind = 'reg'
+
+    def __init__(self, name, family, size):
+        self.name = name
+        self.family = family  # 64-bit register this one aliases, or itself
+        self.size = size      # width in bits
+
+    def registers(self):
+        return (self,)
+
+    def __reduce__(self):
+        # Keep registers interned across pickling (process pools)
+        return (get_register, (self.name,))
+
+    def __repr__(self):
+        return f"Register({self.name})"
+
+    def __str__(self):
+        return self.name
+
+
+class Immediate:
+    """Integer immediate operand"""
+
+    __slots__ = ('value', 'text')
+    kind = 'imm'
+
+    def __init__(self, value, text=None):
+        self.value = value
+        self.text = text
+
+    def registers(self):
+        return ()
+
+    def __eq__(self, other):
+        return isinstance(other, Immediate) and other.value == self.value
+
+    def __hash__(self):
+        return hash(('imm', self.value))
+
+    def __repr__(self):
+        return f"Immediate({self.value})"
+
+    def __str__(self):
+        return self.text if self.text is not None else str(self.value)
+
+
+class Memory:
+    """Memory operand: [base + index*scale + symbol + disp]"""
+
+    __slots__ = ('base', 'index', 'scale', 'disp', 'symbol', 'size', 'segment', 'ptr')
+    kind = 'mem'
+
+    def __init__(self, base=None, index=None, scale=1, disp=0, symbol=None,
+                 size=None, segment=None, ptr=False):
+        self.base = base
+        self.index = index
+        self.scale = scale
+        self.disp = disp
+        self.symbol = symbol
+        self.size = size
+        self.segment = segment
+        self.ptr = ptr
+
+    def registers(self):
+        if self.base is not None and self.index is not None:
+            return (self.base, self.index)
+        if self.base is not None:
+            return (self.base,)
+        if self.index is not None:
+            return (self.index,)
+        return ()
+
+    def address_key(self):
+        """Hashable address expression, ignoring the access size"""
+        return (self.segment, self.base, self.index, self.scale, self.symbol, self.disp)
+
+    def __eq__(self, other):
+        return (isinstance(other, Memory) and other.size == self.size
+                and other.address_key() == self.address_key())
+
+    def __hash__(self):
+        return hash(('mem', self.size) + self.address_key())
+
+    def __repr__(self):
+        return f"Memory({self})"
+
+    def __str__(self):
+        terms = []
+        if self.base is not None:
+            terms.append(self.base.name)
+        if self.index is not None:
+            term = self.index.name if self.scale == 1 else f"{self.index.name}*{self.scale}"
+            terms.append(term)
+        if self.symbol is not None:
+            terms.append(self.symbol)
+        address = '+'.join(terms)
+        if self.disp or not address:
+            if self.disp < 0:
+                address += f"-{-self.disp}"
+            elif address:
+                address += f"+{self.disp}"
+            else:
+                address = str(self.disp)
+        text = f"[{address}]"
+        if self.segment is not None:
+            text = f"{self.segment}:{text}"
+        if self.size is not None:
+            text = f"{self.size} ptr {text}" if self.ptr else f"{self.size} {text}"
+        return text
+
+
+class Symbol:
+    """Label reference or any operand the parser does not model"""
+
+    __slots__ = ('text',)
+    kind = 'sym'
+
+    def __init__(self, text):
+        self.text = text
+
+    def registers(self):
+        return ()
+
+    def __eq__(self, other):
+        return isinstance(other, Symbol) and other.text == self.text
+
+    def __hash__(self):
+        return hash(('sym', self.text))
+
+    def __repr__(self):
+        return f"Symbol({self.text})"
+
+    def __str__(self):
+        return self.text
+
+
+class Instruction:
+    """One IR entry: an instruction, a label or a comment line"""
+
+    __slots__ = ('opcode', 'operands', 'label', 'comment')
+
+    def __init__(self, opcode=None, operands=(), label=None, comment=None):
+        self.opcode = opcode
+        self.operands = operands
+        self.label = label
+        self.comment = comment
+
+    @property
+    def is_comment(self):
+        return self.opcode is None and self.label is None
+
+    @property
+    def key(self):
+        """Hashable identity of the instruction, ignoring trailing comments"""
+        return (self.opcode, self.operands, self.label)
+
+    def registers(self):
+        """All registers referenced by the operands, including address registers"""
+        regs = []
+        for operand in self.operands:
+            regs.extend(operand.registers())
+        return regs
+
+    def __repr__(self):
+        return f"Instruction({self})"
+
+    def __str__(self):
+        if self.opcode is None:
+            if self.label is not None:
+                return f"{self.label}:"
+            return f"; {self.comment}" if self.comment else ';'
+        text = self.opcode
+        if self.operands:
+            text += ' ' + ', '.join(str(operand) for operand in self.operands)
+        if self.comment:
+            text += f"  ; {self.comment}"
+        return text
+
+
+def comment(text):
+    """Build a comment-only IR entry"""
+    return Instruction(comment=text)
+
+
+def _build_register_table():
+    table = {}
+
+    def add(name, family, size):
+        table[name] = Register(name, family, size)
+
+    for letter in 'abcd':
+        family = f"r{letter}x"
+        add(family, family, 64)
+        add(f"e{letter}x", family, 32)
+        add(f"{letter}x", family, 16)
+        add(f"{letter}l", family, 8)
+        add(f"{letter}h", family, 8)
+    for base in ('si', 'di', 'sp', 'bp'):
+        family = f"r{base}"
+        add(family, family, 64)
+        add(f"e{base}", family, 32)
+        add(base, family, 16)
+        add(f"{base}l", family, 8)
+    for number in range(8, 16):
+        family = f"r{number}"
+        add(family, family, 64)
+        add(f"r{number}d", family, 32)
+        add(f"r{number}w", family, 16)
+        add(f"r{number}b", family, 8)
+    for segment in ('cs', 'ds', 'es', 'fs', 'gs', 'ss'):
+        add(segment, segment, 16)
+    add('rip', 'rip', 64)
+    add('eip', 'rip', 32)
+    add('ip', 'rip', 16)
+    return table
+
+
+REGISTERS = _build_register_table()
+
+SIZE_KEYWORDS = {'byte': 8, 'word': 16, 'dword': 32, 'fword': 48, 'qword': 64,
+                 'tbyte': 80, 'oword': 128, 'xmmword': 128, 'ymmword': 256}
+
+PREFIXES = {'rep', 'repe', 'repz', 'repne', 'repnz', 'lock'}
+
+_INT_PATTERNS = (
+    (re.compile(r'[-+]?\d+$'), 10, 0),
+    (re.compile(r'[-+]?0[xX][0-9a-fA-F]+$'), 16, 0),
+    (re.compile(r'[-+]?[0-9][0-9a-fA-F]*[hH]$'), 16, 1),
+    (re.compile(r'[-+]?[01]+[bB]$'), 2, 1),
+)
+_LABEL_RE = re.compile(r'([A-Za-z_.$@?][\w.$@?]*):(?!\[)\s*(.*)$')
+_MEMORY_RE = re.compile(r'(?:(\w+)\s+(?:(ptr)\s+)?)?(?:(\w+)\s*:\s*)?\[(.*)\]$', re.IGNORECASE)
+_TERM_RE = re.compile(r'\s*([+-]?)\s*([^+-]+)')
+
+
+def get_register(name):
+    """Return the interned register for a name, or None"""
+    return REGISTERS.get(name.lower())
+
+
+def sized_register(family, size):
+    """The register of a 64-bit family with the given width (low byte for 8 bits)"""
+    for register in REGISTERS.values():
+        if register.family == family and register.size == size and not register.name.endswith('h'):
+            return register
+    return None
+
+
+def parse_int(text):
+    """Parse an integer literal (decimal, 0x.., ..h, ..b); None if not numeric"""
+    for pattern, base, suffix in _INT_PATTERNS:
+        if pattern.match(text):
+            return int(text[:len(text) - suffix], base)
+    return None
+
+
+def parse_operand(text):
+    """Parse one operand into a Register, Immediate, Memory or Symbol"""
+    text = text.strip()
+    register = REGISTERS.get(text.lower())
+    if register is not None:
+        return register
+    value = parse_int(text)
+    if value is not None:
+        return Immediate(value, text)
+    if text.endswith(']'):
+        memory = _parse_memory(text)
+        if memory is not None:
+            return memory
+    lowered = text.lower()
+    if lowered.startswith(('short ', 'near ')):
+        return Symbol(text.split(None, 1)[1].strip())
+    return Symbol(text)
+
+
+def _parse_memory(text):
+    match = _MEMORY_RE.match(text)
+    if not match:
+        return None
+    size, ptr, segment, inner = match.groups()
+    if size is not None:
+        size = size.lower()
+        if size not in SIZE_KEYWORDS:
+            return None
+    if segment is not None:
+        segment = segment.lower()
+        if segment not in ('cs', 'ds', 'es', 'fs', 'gs', 'ss'):
+            return None
+    base = index = symbol = None
+    scale = 1
+    disp = 0
+    position = 0
+    inner = inner.strip()
+    for term_match in _TERM_RE.finditer(inner):
+        if term_match.start() != position:
+            return None
+        position = term_match.end()
+        sign, term = term_match.groups()
+        term = term.strip()
+        if '*' in term:
+            left, _, right = term.partition('*')
+            left, right = left.strip(), right.strip()
+            register = REGISTERS.get(left.lower()) or REGISTERS.get(right.lower())
+            factor = parse_int(right if REGISTERS.get(left.lower()) else left)
+            if register is None or factor not in (1, 2, 4, 8) or sign == '-' or index is not None:
+                return None
+            index, scale = register, factor
+            continue
+        register = REGISTERS.get(term.lower())
+        if register is not None:
+            if sign == '-':
+                return None
+            if base is None:
+                base = register
+            elif index is None:
+                index = register
+            else:
+                return None
+            continue
+        value = parse_int(term)
+        if value is not None:
+            disp += -value if sign == '-' else value
+            continue
+        if symbol is not None or sign == '-':
+            return None
+        symbol = term
+    if position != len(inner) or not inner:
+        return None
+    return Memory(base, index, scale, disp, symbol, size, segment, ptr is not None)
+
+
+def _split_comment(line):
+    if '"' not in line and "'" not in line:
+        code, _, note = line.partition(';')
+        return code, note if _ else None
+    quote = None
+    for position, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == ';':
+            return line[:position], line[position + 1:]
+    return line, None
+
+
+def _split_operands(text):
+    if '"' not in text and "'" not in text and '[' not in text:
+        return text.split(',')
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for position, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:position])
+            start = position + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_line(line):
+    """Parse one source line into a list of IR entries (label and/or instruction)"""
+    code, note = _split_comment(line)
+    code = code.strip()
+    note = note.strip() if note else None
+    entries = []
+
+    match = _LABEL_RE.match(code)
+    if match and not REGISTERS.get(match.group(1).lower()):
+        entries.append(Instruction(label=match.group(1)))
+        code = match.group(2)
+
+    if not code:
+        if note and not entries:
+            entries.append(Instruction(comment=note))
+        return entries
+
+    parts = code.split(None, 1)
+    opcode = parts[0].lower()
+    rest = parts[1] if len(parts) > 1 else ''
+    if opcode in PREFIXES and rest:
+        parts = rest.split(None, 1)
+        opcode = f"{opcode} {parts[0].lower()}"
+        rest = parts[1] if len(parts) > 1 else ''
+
+    rest = rest.strip()
+    operands = tuple(parse_operand(part) for part in _split_operands(rest)) if rest else ()
+    entries.append(Instruction(opcode, operands, comment=note))
+    return entries
+
+
+def parse_lines(lines):
+    """Parse source lines into a flat IR list"""
+    program = []
+    for line in lines:
+        program.extend(parse_line(line))
+    return program
+
+
+def render(program):
+    """Render an IR list back to assembly text"""
+    return '\n'.join(str(instruction) for instruction in program)
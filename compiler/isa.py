@@ -0,0 +1,351 @@
+from .ir import SIZE_KEYWORDS
+
+# Opcode classes shared by the analyses and passes
+CONDITIONAL_JUMPS = frozenset({
+    'ja', 'jae', 'jb', 'jbe', 'jc', 'je', 'jg', 'jge', 'jl', 'jle',
+    'jna', 'jnae', 'jnb', 'jnbe', 'jnc', 'jne', 'jng', 'jnge', 'jnl', 'jnle',
+    'jno', 'jnp', 'jns', 'jnz', 'jo', 'jp', 'jpe', 'jpo', 'js', 'jz',
+    'jcxz', 'jecxz', 'jrcxz'
+})
+
+LOOP_INSTRUCTIONS = frozenset({'loop', 'loope', 'loopne', 'loopz', 'loopnz'})
+
+UNCONDITIONAL_JUMPS = frozenset({'jmp'})
+
+RETURNS = frozenset({'ret', 'retn', 'retf', 'iret', 'iretd', 'iretq', 'hlt', 'ud2'})
+
+CALLS = frozenset({'call'})
+
+# Instructions that end a basic block
+BLOCK_TERMINATORS = CONDITIONAL_JUMPS | LOOP_INSTRUCTIONS | UNCONDITIONAL_JUMPS | RETURNS | CALLS
+
+# Branches whose first operand may name a label in the same program
+BRANCHES = CONDITIONAL_JUMPS | LOOP_INSTRUCTIONS | UNCONDITIONAL_JUMPS
+
+
+def branch_target(instruction):
+    """Label named by a jump/branch operand, or None for indirect or missing targets"""
+    if instruction.opcode in BRANCHES and instruction.operands:
+        target = instruction.operands[0]
+        if target.kind == 'sym':
+            return target.text
+    return None
+
+
+# Register and flag bits for bitset dataflow analyses. Sub-registers alias
+# their 64-bit family (eax/ax/al/ah -> rax); flags are split into CF and
+# the remaining arithmetic flags because inc/dec leave CF untouched.
+GPR_FAMILIES = ('rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi',
+                'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15')
+REGISTER_BITS = {family: 1 << position for position, family in enumerate(GPR_FAMILIES)}
+CF_BIT = 1 << len(GPR_FAMILIES)
+FLAGS_BIT = 1 << (len(GPR_FAMILIES) + 1)
+FLAGS = CF_BIT | FLAGS_BIT
+ALL_REGISTERS = (1 << (len(GPR_FAMILIES) + 2)) - 1
+
+# System V registers a call may overwrite
+CALLER_SAVED = (REGISTER_BITS['rax'] | REGISTER_BITS['rcx'] | REGISTER_BITS['rdx'] | REGISTER_BITS['rsi']
+                | REGISTER_BITS['rdi'] | REGISTER_BITS['r8'] | REGISTER_BITS['r9'] | REGISTER_BITS['r10']
+                | REGISTER_BITS['r11'] | FLAGS)
+
+# Volatile in every x86-64 calling convention and never used for return values
+SCRATCH_REGISTERS = REGISTER_BITS['r8'] | REGISTER_BITS['r9'] | REGISTER_BITS['r10'] | REGISTER_BITS['r11']
+
+_RAX = REGISTER_BITS['rax']
+_RCX = REGISTER_BITS['rcx']
+_RDX = REGISTER_BITS['rdx']
+_RSP = REGISTER_BITS['rsp']
+
+MOVES = frozenset({'mov', 'movzx', 'movsx', 'movsxd'})
+ALU_FLAGS = frozenset({'add', 'sub', 'and', 'or', 'xor'})
+CARRY_ALU = frozenset({'adc', 'sbb'})
+COMPARES = frozenset({'cmp', 'test'})
+SHIFTS = frozenset({'shl', 'sal', 'shr', 'sar'})
+ROTATES = frozenset({'rol', 'ror'})
+CARRY_ROTATES = frozenset({'rcl', 'rcr'})
+# opcode -> (uses, defs, kills); 16-bit forms merge into the old value
+SIGN_EXTENDS = {'cdq': (_RAX, _RDX, _RDX), 'cqo': (_RAX, _RDX, _RDX), 'cwd': (_RAX | _RDX, _RDX, 0),
+                'cdqe': (_RAX, _RAX, _RAX), 'cwde': (_RAX, _RAX, _RAX), 'cbw': (_RAX, _RAX, 0)}
+
+
+class Effects:
+    """Registers and flags an instruction reads, writes and fully overwrites"""
+
+    __slots__ = ('uses', 'defs', 'kills', 'pure')
+
+    def __init__(self, uses=0, defs=0, kills=0, pure=True):
+        self.uses = uses
+        self.defs = defs
+        self.kills = kills
+        # No memory, stack, control-flow or unmodelled effects: removable if dead
+        self.pure = pure
+
+
+UNKNOWN_EFFECTS = Effects(uses=ALL_REGISTERS, pure=False)
+
+
+def register_bit(register):
+    """Bit of a register's 64-bit family (0 for untracked registers)"""
+    return REGISTER_BITS.get(register.family, 0)
+
+
+def condition_flags(condition):
+    """Flags read by a condition code suffix (e, nz, b, ...)"""
+    if condition in ('b', 'c', 'nae', 'ae', 'nb', 'nc'):
+        return CF_BIT
+    if condition in ('a', 'nbe', 'be', 'na'):
+        return FLAGS
+    return FLAGS_BIT
+
+
+def _reads(operand):
+    if operand.kind == 'reg':
+        return register_bit(operand)
+    if operand.kind == 'mem':
+        mask = 0
+        for register in operand.registers():
+            mask |= register_bit(register)
+        return mask
+    return 0
+
+
+def _address_reads(operand):
+    return _reads(operand) if operand.kind == 'mem' else 0
+
+
+def _write(effects, operand, merge=False):
+    """Record a write to an operand; merge=True when the old value is also read"""
+    if operand.kind == 'reg':
+        bit = register_bit(operand)
+        if not bit:
+            effects.pure = False
+            return
+        effects.defs |= bit
+        if operand.size >= 32 and not merge:
+            effects.kills |= bit
+        else:
+            # 8/16-bit writes merge into the untouched upper bits
+            effects.uses |= bit
+    elif operand.kind == 'mem':
+        effects.uses |= _address_reads(operand)
+        effects.pure = False
+    else:
+        effects.pure = False
+
+
+def _width(operand):
+    """Access width in bits of a register or sized memory operand, or None"""
+    if operand.kind == 'reg':
+        return operand.size
+    if operand.kind == 'mem' and operand.size is not None:
+        return SIZE_KEYWORDS.get(operand.size)
+    return None
+
+
+def _compute_effects(opcode, operands):
+    count = len(operands)
+    effects = Effects()
+
+    if opcode in MOVES and count == 2:
+        effects.uses |= _reads(operands[1])
+        _write(effects, operands[0])
+    elif opcode == 'lea' and count == 2:
+        effects.uses |= _address_reads(operands[1])
+        _write(effects, operands[0])
+    elif opcode in ('xor', 'sub') and count == 2 and operands[0].kind == 'reg' and operands[0] is operands[1]:
+        # Zeroing idiom: does not depend on the old value
+        _write(effects, operands[0])
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif (opcode in ALU_FLAGS or opcode in CARRY_ALU) and count == 2:
+        effects.uses |= _reads(operands[0]) | _reads(operands[1])
+        _write(effects, operands[0], merge=True)
+        if operands[0].kind == 'reg' and operands[0].size == 32:
+            effects.kills |= register_bit(operands[0])
+        if opcode in CARRY_ALU:
+            effects.uses |= CF_BIT
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif opcode in COMPARES and count == 2:
+        effects.uses |= _reads(operands[0]) | _reads(operands[1])
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif opcode in ('inc', 'dec') and count == 1:
+        effects.uses |= _reads(operands[0])
+        _write(effects, operands[0], merge=True)
+        effects.defs |= FLAGS_BIT
+        effects.kills |= FLAGS_BIT
+    elif opcode in ('neg', 'not') and count == 1:
+        effects.uses |= _reads(operands[0])
+        _write(effects, operands[0], merge=True)
+        if opcode == 'neg':
+            effects.defs |= FLAGS
+            effects.kills |= FLAGS
+    elif (opcode in SHIFTS or opcode in ROTATES or opcode in CARRY_ROTATES) and count in (1, 2):
+        effects.uses |= _reads(operands[0])
+        if count == 2:
+            effects.uses |= _reads(operands[1])
+        _write(effects, operands[0], merge=True)
+        effects.defs |= FLAGS
+        count_known = count == 1 or (operands[1].kind == 'imm' and operands[1].value & 63)
+        if opcode in SHIFTS and count_known:
+            effects.kills |= FLAGS
+        else:
+            # Rotates and shifts by a possibly-zero count keep some flags
+            effects.uses |= FLAGS
+        if opcode in CARRY_ROTATES:
+            effects.uses |= CF_BIT
+    elif opcode in ('mul', 'imul', 'div', 'idiv') and count == 1:
+        effects.uses |= _reads(operands[0]) | _RAX
+        if opcode in ('div', 'idiv'):
+            # Division by zero traps
+            effects.pure = False
+        width = _width(operands[0])
+        if width == 8:
+            # AX only (AL * src, or AX / src into AL and AH)
+            effects.defs |= _RAX
+        elif width in (32, 64):
+            # EDX:EAX writes zero-extend, so both are fully replaced
+            effects.uses |= _RDX if opcode in ('div', 'idiv') else 0
+            effects.defs |= _RAX | _RDX
+            effects.kills |= _RAX | _RDX
+        else:
+            # DX:AX (or an unknown width): the upper bits of RAX and RDX survive
+            effects.uses |= _RDX
+            effects.defs |= _RAX | _RDX
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif opcode in ('mul', 'imul') and count == 2:
+        # Two-operand multiply: dst *= src
+        effects.uses |= _reads(operands[0]) | _reads(operands[1])
+        _write(effects, operands[0], merge=True)
+        if operands[0].kind == 'reg' and operands[0].size == 32:
+            effects.kills |= register_bit(operands[0])
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif opcode == 'imul' and count == 3:
+        effects.uses |= _reads(operands[1])
+        _write(effects, operands[0])
+        effects.defs |= FLAGS
+        effects.kills |= FLAGS
+    elif opcode in SIGN_EXTENDS and count == 0:
+        uses, defs, kills = SIGN_EXTENDS[opcode]
+        effects.uses |= uses
+        effects.defs |= defs
+        effects.kills |= kills
+    elif opcode == 'xchg' and count == 2:
+        effects.uses |= _reads(operands[0]) | _reads(operands[1])
+        _write(effects, operands[0], merge=True)
+        _write(effects, operands[1], merge=True)
+    elif opcode == 'push' and count == 1:
+        effects.uses |= _reads(operands[0]) | _RSP
+        effects.defs |= _RSP
+        effects.pure = False
+    elif opcode == 'pop' and count == 1:
+        effects.uses |= _RSP
+        _write(effects, operands[0])
+        effects.defs |= _RSP
+        effects.pure = False
+    elif opcode.startswith('set') and count == 1:
+        effects.uses |= condition_flags(opcode[3:])
+        _write(effects, operands[0], merge=True)
+    elif opcode.startswith('cmov') and count == 2:
+        effects.uses |= condition_flags(opcode[4:]) | _reads(operands[1]) | _reads(operands[0])
+        _write(effects, operands[0], merge=True)
+    elif opcode in CONDITIONAL_JUMPS:
+        if opcode in ('jcxz', 'jecxz', 'jrcxz'):
+            effects.uses |= _RCX
+        else:
+            effects.uses |= condition_flags(opcode[1:])
+        effects.pure = False
+    elif opcode in LOOP_INSTRUCTIONS:
+        effects.uses |= _RCX
+        if opcode != 'loop':
+            effects.uses |= FLAGS_BIT
+        effects.defs |= _RCX
+        effects.pure = False
+    elif opcode in UNCONDITIONAL_JUMPS:
+        effects.uses |= _reads(operands[0]) if operands else 0
+        effects.pure = False
+    elif opcode in CALLS:
+        # Unknown callee: may read anything, clobbers the caller-saved set
+        effects.uses |= ALL_REGISTERS
+        effects.defs |= CALLER_SAVED
+        effects.kills |= CALLER_SAVED
+        effects.pure = False
+    elif opcode in ('ret', 'retn', 'retf') and count <= 1:
+        # Return values and callee-saved registers may live in any register
+        # except r8-r11 and the flags, which no calling convention preserves
+        effects.uses |= ALL_REGISTERS & ~FLAGS & ~SCRATCH_REGISTERS
+        effects.pure = False
+    elif opcode in ('nop', 'clc', 'stc', 'cmc'):
+        if opcode != 'nop':
+            effects.defs |= CF_BIT
+            effects.kills |= CF_BIT if opcode != 'cmc' else 0
+            effects.uses |= CF_BIT if opcode == 'cmc' else 0
+        effects.pure = opcode != 'nop'
+    else:
+        return UNKNOWN_EFFECTS
+
+    return effects
+
+
+_WRITE_ONLY = MOVES | {'pop'}
+
+
+def memory_operands(instruction):
+    """(read, written) explicit memory operands of an instruction; lea only computes an address"""
+    opcode = instruction.opcode
+    reads = []
+    writes = []
+    if opcode is None or opcode == 'lea':
+        return reads, writes
+    for position, operand in enumerate(instruction.operands):
+        if operand.kind != 'mem':
+            continue
+        if opcode == 'xchg':
+            reads.append(operand)
+            writes.append(operand)
+        elif position == 0 and opcode not in COMPARES and opcode != 'push':
+            writes.append(operand)
+            if opcode not in _WRITE_ONLY and not opcode.startswith('set'):
+                reads.append(operand)
+        else:
+            reads.append(operand)
+    return reads, writes
+
+
+def access_width(instruction, operand):
+    """Bytes touched by a memory operand, or None when unknown"""
+    if operand.size is not None:
+        return SIZE_KEYWORDS[operand.size] // 8
+    for other in instruction.operands:
+        if other.kind == 'reg':
+            return other.size // 8
+    return None
+
+
+_effects_cache = {}
+
+
+def instruction_effects(instruction):
+    """Register/flag effects of an IR entry (labels and comments have none)"""
+    if instruction.opcode is None:
+        return Effects(pure=False)
+    key = (instruction.opcode, instruction.operands)
+    effects = _effects_cache.get(key)
+    if effects is None:
+        effects = _compute_effects(instruction.opcode, instruction.operands)
+        if len(_effects_cache) < 65536:
+            _effects_cache[key] = effects
+    return effects
+
+
+def register_names(mask):
+    """64-bit register and flag names in a bitmask (for debugging and reports)"""
+    names = [family for family, bit in REGISTER_BITS.items() if mask & bit]
+    if mask & CF_BIT:
+        names.append('cf')
+    if mask & FLAGS_BIT:
+        names.append('flags')
+    return names
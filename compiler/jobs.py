@@ -0,0 +1,204 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = frozenset({DONE, FAILED, CANCELLED})
+
+
+class Job:
+    """One submitted compilation and its outcome"""
+
+    __slots__ = ('id', 'payload', 'status', 'result', 'error', 'future',
+                 'submitted_at', 'started_at', 'finished_at', 'cancel_requested')
+
+    def __init__(self, payload, now):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.future = None
+        self.submitted_at = now
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+
+    def to_dict(self, now):
+        """Status report; the result is included once the job is done"""
+        report = {
+            'job_id': self.id,
+            'status': self.status,
+            'queued_seconds': round((self.started_at or self.finished_at or now) - self.submitted_at, 6)
+        }
+        if self.started_at is not None:
+            report['run_seconds'] = round((self.finished_at or now) - self.started_at, 6)
+        if self.status == RUNNING and self.cancel_requested:
+            report['cancel_requested'] = True
+        if self.status == DONE:
+            report['result'] = self.result
+        elif self.status == FAILED:
+            report['error'] = self.error
+        return report
+
+
+class JobQueue:
+    """Bounded background pool running compile jobs, with polling, cancellation and result expiry
+
+    runner is called with a job's payload as keyword arguments in a worker
+    thread. At most max_pending jobs may wait; finished jobs are kept for
+    result_ttl seconds and then forgotten.
+    """
+
+    def __init__(self, runner, max_workers=2, max_pending=100, result_ttl=600, clock=time.monotonic):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._clock = clock
+        self._jobs = OrderedDict()  # job id -> Job, in submission order
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.rejected = 0
+        self._waited = 0.0
+        self._started = 0
+        self._max_wait = 0.0
+
+    def submit(self, **payload):
+        """Queue a job; None when the queue is full"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            if self._pending_count() >= self.max_pending:
+                self.rejected += 1
+                return None
+            job = Job(payload, now)
+            self._jobs[job.id] = job
+            self.submitted += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='compile-job')
+            job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Status report of a job, or None if unknown or expired"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            job = self._jobs.get(job_id)
+            return job.to_dict(now) if job is not None else None
+
+    def cancel(self, job_id):
+        """Cancel a job; queued jobs never run, running ones have their result discarded
+
+        Returns the job's status report, or None if unknown or expired.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.future.cancel()
+                self._finish(job, CANCELLED, now)
+            elif job.status == RUNNING:
+                job.cancel_requested = True
+            return job.to_dict(now)
+
+    def stats(self):
+        """Queue depth, job counters and wait times"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            queued = [job for job in self._jobs.values() if job.status == QUEUED]
+            return {
+                'workers': self.max_workers,
+                'queue_depth': len(queued),
+                'running': running,
+                'oldest_queued_seconds': round(now - queued[0].submitted_at, 6) if queued else 0.0,
+                'average_wait_seconds': round(self._waited / self._started, 6) if self._started else 0.0,
+                'max_wait_seconds': round(self._max_wait, 6),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'expired': self.expired,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self):
+        """Stop the worker pool, dropping queued jobs"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, job):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            now = self._clock()
+            job.status = RUNNING
+            job.started_at = now
+            wait = now - job.submitted_at
+            self._waited += wait
+            self._started += 1
+            self._max_wait = max(self._max_wait, wait)
+
+        try:
+            result = self.runner(**job.payload)
+            error = None
+        except Exception as e:
+            logger.error(f"Compile job {job.id} failed: {str(e)}")
+            result = None
+            error = str(e)
+
+        with self._lock:
+            now = self._clock()
+            if job.cancel_requested:
+                self._finish(job, CANCELLED, now)
+            elif error is not None:
+                job.error = error
+                self._finish(job, FAILED, now)
+            else:
+                job.result = result
+                self._finish(job, DONE, now)
+
+    def _finish(self, job, status, now):
+        job.status = status
+        job.finished_at = now
+        job.payload = None
+        if status == DONE:
+            self.completed += 1
+        elif status == FAILED:
+            self.failed += 1
+        else:
+            self.cancelled += 1
+
+    def _pending_count(self):
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def _expire(self, now):
+        """Forget finished jobs older than the result TTL"""
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.status in FINISHED and now - job.finished_at > self.result_ttl]:
+            del self._jobs[job_id]
+            self.expired += 1
@@ -0,0 +1,63 @@
+from .isa import ALL_REGISTERS, instruction_effects
+
+
+class Liveness:
+    """Backward bitset liveness of registers and flags over a control-flow graph"""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        count = len(cfg.blocks)
+        self.uses = [0] * count   # read before being overwritten in the block
+        self.kills = [0] * count  # fully overwritten in the block
+        self.live_in = [0] * count
+        self.live_out = [0] * count
+        self._summarize_blocks()
+        self._solve()
+
+    def live_after(self, block):
+        """Live mask after each entry of a block, in program order"""
+        entries = self.cfg.block_entries(block)
+        live = self.live_out[block.index]
+        masks = [0] * len(entries)
+        for position in range(len(entries) - 1, -1, -1):
+            masks[position] = live
+            effects = instruction_effects(entries[position])
+            live = (live & ~effects.kills) | effects.uses
+        return masks
+
+    def _summarize_blocks(self):
+        for block in self.cfg.blocks:
+            uses = 0
+            kills = 0
+            for entry in self.cfg.block_entries(block):
+                if entry.opcode is None:
+                    continue
+                effects = instruction_effects(entry)
+                uses |= effects.uses & ~kills
+                kills |= effects.kills
+            self.uses[block.index] = uses
+            self.kills[block.index] = kills
+
+    def _solve(self):
+        blocks = self.cfg.blocks
+        # Unreachable blocks are solved too, after the reachable ones
+        order = list(reversed(self.cfg.reverse_postorder))
+        seen = set(order)
+        order.extend(block.index for block in blocks if block.index not in seen)
+
+        changed = True
+        while changed:
+            changed = False
+            for index in order:
+                block = blocks[index]
+                if block.unknown_exit:
+                    live_out = ALL_REGISTERS
+                else:
+                    live_out = 0
+                    for successor in block.successors:
+                        live_out |= self.live_in[successor]
+                live_in = self.uses[index] | (live_out & ~self.kills[index])
+                if live_out != self.live_out[index] or live_in != self.live_in[index]:
+                    self.live_out[index] = live_out
+                    self.live_in[index] = live_in
+                    changed = True
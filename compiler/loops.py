@@ -0,0 +1,268 @@
+from .ir import Immediate, Instruction, Symbol, get_register
+from .isa import BRANCHES, FLAGS, REGISTER_BITS, branch_target, instruction_effects
+
+_RCX = get_register('rcx')
+_RCX_BIT = REGISTER_BITS['rcx']
+
+
+def program_labels(program):
+    """Set of every label defined in a program"""
+    return {entry.label for entry in program if entry.label is not None}
+
+
+def unique_label(base, taken):
+    """A label derived from base that is not yet in taken (which is updated)"""
+    label = base
+    suffix = 1
+    while label in taken:
+        suffix += 1
+        label = f"{base}{suffix}"
+    taken.add(label)
+    return label
+
+
+def _is_load(instruction):
+    return instruction.opcode != 'lea' and any(operand.kind == 'mem' for operand in instruction.operands)
+
+
+def _label_references(program):
+    """label -> number of operands naming it outside of branch instructions"""
+    references = {}
+    for entry in program:
+        if entry.opcode is None or entry.opcode in BRANCHES:
+            continue
+        for operand in entry.operands:
+            if operand.kind == 'sym':
+                references[operand.text] = references.get(operand.text, 0) + 1
+    return references
+
+
+def find_invariants(program, cfg, liveness, loop):
+    """Program positions of loop instructions that can move to a preheader"""
+    header = cfg.blocks[loop.header]
+    blocks = [cfg.blocks[index] for index in sorted(loop.blocks)]
+
+    instructions = []  # (position, instruction, effects, live after, block index)
+    clobbers_memory = False
+    exits_live = 0
+    exiting = []
+    for block in blocks:
+        live_after = liveness.live_after(block)
+        for offset, entry in enumerate(cfg.block_entries(block)):
+            if entry.opcode is None:
+                continue
+            effects = instruction_effects(entry)
+            if not effects.pure and entry.opcode not in BRANCHES:
+                clobbers_memory = True
+            instructions.append((block.start + offset, entry, effects, live_after[offset], block.index))
+        outside = [successor for successor in block.successors if successor not in loop.blocks]
+        if outside or block.unknown_exit:
+            exiting.append(block.index)
+            exits_live |= ~0 if block.unknown_exit else 0
+            for successor in outside:
+                exits_live |= liveness.live_in[successor]
+
+    # Per-bit count of in-loop definitions
+    def_counts = {}
+    for _, _, effects, _, _ in instructions:
+        mask = effects.defs
+        while mask:
+            bit = mask & -mask
+            def_counts[bit] = def_counts.get(bit, 0) + 1
+            mask ^= bit
+
+    def other_defs(defs):
+        mask = 0
+        for bit, count in def_counts.items():
+            if count - (1 if defs & bit else 0) > 0:
+                mask |= bit
+        return mask
+
+    hoisted = []
+    hoisted_positions = set()
+    changed = True
+    while changed:
+        changed = False
+        for position, entry, effects, live_after, block_index in instructions:
+            if position in hoisted_positions or not effects.pure or not effects.defs:
+                continue
+            if effects.uses & effects.defs:
+                continue  # read-modify-write of its own result
+            dominates_exits = all(cfg.dominates(block_index, exiting_block) for exiting_block in exiting)
+            if _is_load(entry) and (clobbers_memory or not dominates_exits
+                                    or not all(cfg.dominates(block_index, latch) for latch in loop.latches)):
+                continue
+            relevant = effects.defs
+            if not effects.defs & FLAGS & live_after:
+                relevant &= ~FLAGS
+            elif effects.defs & FLAGS:
+                continue
+            others = other_defs(effects.defs)
+            if effects.uses & others or relevant & others:
+                continue
+            if effects.defs & liveness.live_in[header.index]:
+                continue
+            if not dominates_exits and effects.defs & exits_live:
+                continue
+            hoisted.append(position)
+            hoisted_positions.add(position)
+            mask = effects.defs
+            while mask:
+                bit = mask & -mask
+                def_counts[bit] -= 1
+                mask ^= bit
+            changed = True
+    return sorted(hoisted)
+
+
+def hoist_invariants(program, cfg, liveness, loop):
+    """Move invariant instructions of one loop into its preheader; None if nothing moved"""
+    header = cfg.blocks[loop.header]
+    outside = [pred for pred in header.predecessors if pred not in loop.blocks]
+    # In a program fragment, jumps from outside it would bypass the preheader
+    if not outside or (header.index - 1) in loop.blocks or cfg.open_labels:
+        return None
+    references = _label_references(program)
+    if any(references.get(label) for label in header.labels):
+        return None
+
+    positions = find_invariants(program, cfg, liveness, loop)
+    if not positions:
+        return None
+    moved = [Instruction(program[position].opcode, program[position].operands,
+                         comment='Optimized: hoisted loop invariant') for position in positions]
+    removed = set(positions)
+
+    insert_at = None
+    retarget = {}
+    if len(outside) == 1:
+        pred = cfg.blocks[outside[0]]
+        last_position = max((position for position in range(pred.start, pred.end)
+                             if program[position].opcode is not None), default=None)
+        last = program[last_position] if last_position is not None else None
+        if pred.successors == [header.index]:
+            if last is not None and last.opcode == 'jmp':
+                insert_at = last_position
+            elif pred.index == header.index - 1:
+                insert_at = pred.end
+    preheader = []
+    if insert_at is None:
+        # Build a dedicated preheader just above the header and send every
+        # outside edge to it
+        label = unique_label(f"{header.labels[0]}_preheader" if header.labels else 'preheader',
+                             program_labels(program))
+        preheader = [Instruction(label=label)]
+        insert_at = header.start
+        for pred_index in outside:
+            pred = cfg.blocks[pred_index]
+            for position in range(pred.end - 1, pred.start - 1, -1):
+                entry = program[position]
+                if entry.opcode is None:
+                    continue
+                if branch_target(entry) in header.labels:
+                    retarget[position] = Instruction(entry.opcode, (Symbol(label),) + entry.operands[1:],
+                                                     comment=entry.comment)
+                break
+
+    result = []
+    for position, entry in enumerate(program):
+        if position == insert_at:
+            result.extend(preheader)
+            result.extend(moved)
+        if position in removed:
+            continue
+        result.append(retarget.get(position, entry))
+    return result
+
+
+def _counted_loop(program, cfg, liveness, loop, max_body):
+    """(body, counter update) for a single-block rcx-counted loop, or None"""
+    if loop.blocks != {loop.header}:
+        return None
+    block = cfg.blocks[loop.header]
+    if not block.labels or block.unknown_exit:
+        return None
+    entries = [entry for entry in cfg.block_entries(block) if entry.opcode is not None]
+    if not entries or branch_target(entries[-1]) not in block.labels:
+        return None
+
+    last = entries[-1]
+    if last.opcode == 'loop':
+        body, update = entries[:-1], entries[-1:]
+    elif last.opcode in ('jnz', 'jne') and len(entries) >= 2:
+        counter = entries[-2]
+        operands = counter.operands
+        decrements = (counter.opcode == 'dec' and operands == (_RCX,)) or (
+            counter.opcode == 'sub' and len(operands) == 2 and operands[0] is _RCX
+            and operands[1].kind == 'imm' and operands[1].value == 1)
+        if not decrements:
+            return None
+        body, update = entries[:-2], entries[-2:]
+    else:
+        return None
+
+    if not body or len(body) > max_body:
+        return None
+    for entry in body:
+        effects = instruction_effects(entry)
+        if entry.opcode in BRANCHES or (effects.uses | effects.defs) & _RCX_BIT:
+            return None
+    # The unrolled control code clobbers flags at entry and exit
+    if liveness.live_in[block.index] & FLAGS:
+        return None
+    for successor in block.successors:
+        if successor != block.index and liveness.live_in[successor] & FLAGS:
+            return None
+    return body, update
+
+
+def unroll_counted_loops(program, cfg, liveness, factor, max_body):
+    """Unroll small rcx-counted loops by factor with a remainder loop; None if none qualify"""
+    if factor < 2:
+        return None
+    replacements = {}
+    taken = program_labels(program)
+    for loop in cfg.loops:
+        counted = _counted_loop(program, cfg, liveness, loop, max_body)
+        if counted is None:
+            continue
+        body, update = counted
+        block = cfg.blocks[loop.header]
+        base = block.labels[0]
+        unrolled = unique_label(f"{base}_unrolled", taken)
+        remainder = unique_label(f"{base}_remainder", taken)
+        single = unique_label(f"{base}_single", taken)
+        done = unique_label(f"{base}_done", taken)
+
+        code = [entry for entry in cfg.block_entries(block) if entry.opcode is None]
+        code.append(Instruction('cmp', (_RCX, Immediate(factor)), comment=f"Optimized: loop unrolled x{factor}"))
+        code.append(Instruction('jb', (Symbol(remainder),)))
+        code.append(Instruction(label=unrolled))
+        for _ in range(factor):
+            code.extend(body)
+        code.append(Instruction('sub', (_RCX, Immediate(factor))))
+        code.append(Instruction('cmp', (_RCX, Immediate(factor))))
+        code.append(Instruction('jae', (Symbol(unrolled),)))
+        code.append(Instruction(label=remainder))
+        code.append(Instruction('test', (_RCX, _RCX)))
+        code.append(Instruction('jz', (Symbol(done),)))
+        code.append(Instruction(label=single))
+        code.extend(body)
+        code.extend(update[:-1])
+        code.append(Instruction(update[-1].opcode, (Symbol(single),) + update[-1].operands[1:]))
+        code.append(Instruction(label=done))
+        replacements[block.start] = (block.end, code)
+
+    if not replacements:
+        return None
+    result = []
+    position = 0
+    while position < len(program):
+        if position in replacements:
+            end, code = replacements[position]
+            result.extend(code)
+            position = end
+        else:
+            result.append(program[position])
+            position += 1
+    return result
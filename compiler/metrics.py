@@ -0,0 +1,168 @@
+import bisect
+import threading
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Input size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), preset=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {tuple(labels): 0 for labels in preset}
+        if not self.labelnames:
+            self._values[()] = 0
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        """Add to the counter for a tuple of label values"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=(), preset=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        for labels in preset:
+            self._series[tuple(labels)] = self._new_series()
+        if not self.labelnames:
+            self._series[()] = self._new_series()
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, labels=()):
+        """Record one observation for a tuple of label values"""
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = self._new_series()
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, labels=()):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = [(labels, (list(series[0]), series[1], series[2])) for labels, series in self._series.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                label_text = _format_labels(self.labelnames, labels, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauges read from a callback at scrape time (no cost between scrapes)"""
+
+    def __init__(self, prefix, documentation, callback, kinds=None):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.callback = callback
+        self.kinds = kinds or {}
+
+    def render_family(self):
+        lines = []
+        for key, value in sorted(self.callback().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            kind = self.kinds.get(key, 'gauge')
+            if kind == 'counter':
+                name += '_total'
+            lines.append(f"# HELP {name} {self.documentation} ({key})")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, *args, **kwargs):
+        collector = GaugeCallback(*args, **kwargs)
+        self._callbacks.append(collector)
+        return collector
+
+    def render(self):
+        """Render every metric; formatting only happens here, at scrape time"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self._callbacks:
+            lines.extend(collector.render_family())
+        return '\n'.join(lines) + '\n'
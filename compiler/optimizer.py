@@ -1,5 +1,18 @@
-import re
 import logging
+import threading
+from functools import partial
+from .cfg import ControlFlowGraph
+from .ir import comment
+from .isa import instruction_effects
+from .liveness import Liveness
+from .loops import hoist_invariants, unroll_counted_loops
+from .passes import Pass, PassManager, Pipeline
+from .peephole import RULES as PEEPHOLE_RULES, PeepholeMatcher
+from .regalloc import allocate_registers
+from .sccp import ConstantPropagation
+from .scheduler import schedule_block
+from .strength import StrengthReduction
+from .valuenum import ValueNumbering
 
 logger = logging.getLogger(__name__)
 
@@ -7,215 +20,262 @@ class OptimizationEngine:
     """Handles different levels of assembly code optimization"""
     
     def __init__(self):
-        self.optimization_passes = {
-            'none': [],
-            'basic': [self._remove_redundant, self._basic_peephole],
-            'standard': [self._remove_redundant, self._basic_peephole, self._constant_folding, self._register_reuse],
-            'aggressive': [self._remove_redundant, self._basic_peephole, self._constant_folding, 
-                          self._register_reuse, self._loop_optimization, self._instruction_reordering]
+        # Every pass the pipelines can name, with the analyses it reads and keeps valid
+        self.passes = {optimization_pass.name: optimization_pass for optimization_pass in (
+            Pass('peephole', self._peephole_block, scope='block', requires=('cfg',)),
+            Pass('constant_propagation', self._constant_propagation, requires=('liveness',)),
+            Pass('strength_reduction', self._strength_reduction, requires=('liveness',)),
+            Pass('value_numbering', self._value_numbering, requires=('liveness',), preserves=('cfg',),
+                 expensive=True),
+            Pass('dead_code_elimination', self._dead_code_elimination, requires=('liveness',),
+                 preserves=('cfg',)),
+            Pass('loop_optimization', self._loop_optimization, requires=('cfg', 'liveness'), repeat=False,
+                 expensive=True),
+            Pass('register_allocation', self._register_allocation, requires=('cfg',), repeat=False,
+                 expensive=True),
+            Pass('instruction_reordering', self._schedule_block, scope='block', requires=('cfg',),
+                 repeat=False, expensive=True)
+        )}
+        
+        # Levels are pipelines iterated to a fixed point (within a cap);
+        # O0-O3 are aliases and optimize() also takes comma-separated pass names
+        self.max_iterations = 3
+        cleanup = ('peephole', 'constant_propagation', 'strength_reduction', 'value_numbering',
+                   'dead_code_elimination')
+        self.pipelines = {
+            'none': Pipeline(()),
+            'basic': Pipeline(('peephole',)),
+            'standard': Pipeline(cleanup, self.max_iterations),
+            'aggressive': Pipeline(cleanup + ('loop_optimization', 'register_allocation', 'instruction_reordering'),
+                                   self.max_iterations)
         }
-    
-    def optimize(self, code_lines, level='none'):
-        """Apply optimization passes based on level"""
-        if level not in self.optimization_passes:
-            level = 'none'
+        for alias, level in (('O0', 'none'), ('O1', 'basic'), ('O2', 'standard'), ('O3', 'aggressive')):
+            self.pipelines[alias] = self.pipelines[level]
         
-        optimized = code_lines.copy()
-        passes = self.optimization_passes[level]
+        # Adaptive optimization: expensive passes are skipped for programs
+        # above this many IR entries, and once less than this fraction of
+        # a compile-time budget is left
+        self.large_program_entries = 20000
+        self.expensive_pass_reserve = 0.5
         
-        logger.info(f"Applying {len(passes)} optimization passes for level: {level}")
+        # Peephole rule table, compiled once into an opcode-indexed matcher
+        self.peephole = PeepholeMatcher(PEEPHOLE_RULES)
+        # Examined entries kept back while streaming, so rewrites can still
+        # reach into recent output
+        self.peephole_retain = 64
         
-        for optimization_pass in passes:
-            optimized = optimization_pass(optimized)
+        # Generator versions of the windowed passes, used by optimize_stream
+        self.streaming_passes = {
+            'peephole': self._iter_peephole
+        }
+        self.stream_chunk_size = 4096
         
-        return optimized
-    
-    def _remove_redundant(self, code_lines):
-        """Remove redundant instructions"""
-        optimized = []
-        prev_line = None
-        
-        for line in code_lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Skip duplicate consecutive instructions
-            if line != prev_line:
-                # Check for redundant moves
-                if line.startswith('mov') and prev_line and prev_line.startswith('mov'):
-                    # Check if moving same value to same register
-                    if self._is_redundant_mov(prev_line, line):
-                        optimized.append(f"; Removed redundant: {line}")
-                        continue
-                
-                optimized.append(line)
-                prev_line = line
+        # Loop unrolling: copies of the body per iteration, and the largest
+        # body (in instructions) worth unrolling
+        self.unroll_factor = 4
+        self.unroll_max_body = 8
         
-        return optimized
-    
-    def _basic_peephole(self, code_lines):
-        """Basic peephole optimizations"""
-        optimized = []
-        i = 0
-        
-        while i < len(code_lines):
-            line = code_lines[i].strip()
-            
-            # Look for push/pop pairs that can be optimized
-            if i < len(code_lines) - 1:
-                next_line = code_lines[i + 1].strip()
-                
-                # Optimize push followed by immediate pop
-                if line.startswith('push') and next_line.startswith('pop'):
-                    reg1 = self._extract_register(line)
-                    reg2 = self._extract_register(next_line)
-                    
-                    if reg1 and reg2 and reg1 != reg2:
-                        # Convert push/pop to mov
-                        optimized.append(f"mov {reg2}, {reg1}  ; Optimized push/pop pair")
-                        i += 2
-                        continue
-            
-            optimized.append(line)
-            i += 1
+        # Instructions per list-scheduling region (bounds the quadratic DAG build)
+        self.schedule_window = 64
         
-        return optimized
+        # Analyses passes can request; results are cached per program until
+        # a pass produces a different program or invalidates them explicitly
+        self.analyses = {
+            'cfg': self._cfg_analysis,
+            'liveness': self._liveness_analysis
+        }
+        self._analysis_state = threading.local()
     
-    def _constant_folding(self, code_lines):
-        """Fold constants and simplify expressions"""
-        optimized = []
-        
-        for line in code_lines:
-            line = line.strip()
-            
-            # Look for arithmetic with constants
-            if any(op in line for op in ['add', 'sub', 'mul']) and re.search(r', \d+', line):
-                parts = line.split()
-                if len(parts) >= 3:
-                    instruction = parts[0]
-                    operands = ' '.join(parts[1:])
-                    
-                    # Simple constant folding for add/sub with 0
-                    if ', 0' in operands:
-                        if instruction in ['add', 'sub']:
-                            optimized.append(f"; Constant folded: {line}")
-                            continue
-                    
-                    # Multiply by 1 optimization
-                    if instruction == 'mul' and ', 1' in operands:
-                        optimized.append(f"; Constant folded: {line}")
-                        continue
-            
-            optimized.append(line)
-        
-        return optimized
+    def get_analysis(self, name, code):
+        """Return a (cached) analysis result for the given program"""
+        cache = self._analysis_cache()
+        cached = cache.get(name)
+        if cached is not None and cached[0] is code:
+            return cached[1]
+        result = self.analyses[name](code)
+        cache[name] = (code, result)
+        return result
     
-    def _register_reuse(self, code_lines):
-        """Optimize register usage"""
-        optimized = []
-        register_values = {}
-        
-        for line in code_lines:
-            line = line.strip()
-            
-            # Track register assignments
-            if line.startswith('mov'):
-                parts = line.split(',')
-                if len(parts) == 2:
-                    dest = parts[0].replace('mov', '').strip()
-                    src = parts[1].strip()
-                    
-                    # Check if source value is already in another register
-                    for reg, value in register_values.items():
-                        if value == src and reg != dest:
-                            optimized.append(f"mov {dest}, {reg}  ; Reused register value")
-                            register_values[dest] = src
-                            break
-                    else:
-                        optimized.append(line)
-                        register_values[dest] = src
-                else:
-                    optimized.append(line)
+    def invalidate_analyses(self, *names):
+        """Drop cached analyses (all of them when no names are given)"""
+        cache = self._analysis_cache()
+        for name in names or list(cache):
+            cache.pop(name, None)
+    
+    def _cfg_analysis(self, code):
+        """Control-flow graph; while a stream chunk is optimized its labels are open entries"""
+        return ControlFlowGraph(code, open_labels=getattr(self._analysis_state, 'open_labels', False))
+    
+    def _liveness_analysis(self, code):
+        """Register/flag liveness over the (cached) control-flow graph"""
+        return Liveness(self.get_analysis('cfg', code))
+    
+    def _analysis_cache(self):
+        # The engine is shared between request threads; analyses are not
+        cache = getattr(self._analysis_state, 'cache', None)
+        if cache is None:
+            cache = self._analysis_state.cache = {}
+        return cache
+    
+    def carry_analyses(self, old, new, names):
+        """Re-key cached analyses a pass preserved from its input program to its output"""
+        cache = self._analysis_cache()
+        for name in list(cache):
+            program, result = cache[name]
+            if name in names and program is old and hasattr(result, 'rebind'):
+                cache[name] = (new, result.rebind(new))
             else:
-                optimized.append(line)
-                # Invalidate registers that might be modified
-                if any(reg in line for reg in register_values.keys()):
-                    register_values.clear()
-        
-        return optimized
+                del cache[name]
     
-    def _loop_optimization(self, code_lines):
-        """Basic loop optimizations"""
-        optimized = []
-        in_loop = False
-        loop_start = -1
-        
-        for i, line in enumerate(code_lines):
-            line = line.strip()
-            
-            # Detect simple loops
-            if 'loop' in line.lower() or 'jmp' in line.lower():
-                if not in_loop:
-                    in_loop = True
-                    loop_start = i
-                    optimized.append(f"; Loop optimization opportunity at line {i}")
-            
-            optimized.append(line)
+    def resolve_pipeline(self, level):
+        """Pipeline for a level name or a comma-separated list of pass names (None if neither)"""
+        pipeline = self.pipelines.get(level)
+        if pipeline is not None or not isinstance(level, str):
+            return pipeline
+        names = tuple(name.strip() for name in level.split(',') if name.strip())
+        if names and all(name in self.passes for name in names):
+            return Pipeline(names, self.max_iterations)
+        return None
+    
+    def optimize(self, code_lines, level='none', recorder=None, budget=None):
+        """Apply optimization passes based on level, within an optional CompileBudget"""
+        pipeline = self.resolve_pipeline(level) or self.pipelines['none']
+        
+        logger.info(f"Applying {len(pipeline.passes)} optimization passes for level: {level}")
         
+        manager = PassManager(self, pipeline, recorder, budget)
+        try:
+            optimized = manager.run(list(code_lines))
+        finally:
+            self.invalidate_analyses()
+            if recorder is not None:
+                recorder.details['pipeline'] = manager.summary()
+        
+        if manager.skipped_passes:
+            logger.info(f"Skipped optimization passes: {manager.skipped_passes}")
         return optimized
     
-    def _instruction_reordering(self, code_lines):
-        """Reorder instructions for better performance"""
-        optimized = []
-        
-        # Simple instruction scheduling
-        for i, line in enumerate(code_lines):
-            line = line.strip()
-            
-            # Look for opportunities to reorder independent instructions
-            if i < len(code_lines) - 1:
-                next_line = code_lines[i + 1].strip()
-                
-                # If current instruction doesn't depend on next, consider reordering
-                if self._are_independent(line, next_line):
-                    # For now, just add a comment about the opportunity
-                    optimized.append(f"; Reordering opportunity: {line}")
-                    optimized.append(line)
-                else:
-                    optimized.append(line)
+    def optimize_stream(self, code, level='none'):
+        """Apply optimization passes lazily to an iterable of IR entries (one iteration of the pipeline)"""
+        pipeline = self.resolve_pipeline(level) or self.pipelines['none']
+        manager = PassManager(self, pipeline)
+        
+        # Windowed passes stream with bounded lookahead; the others run over
+        # bounded chunks split at control-flow boundaries
+        optimized = iter(code)
+        for name in pipeline.passes:
+            streaming_pass = self.streaming_passes.get(name)
+            if streaming_pass is not None:
+                optimized = streaming_pass(optimized)
             else:
-                optimized.append(line)
+                optimized = self._iter_chunked(partial(manager.run_pass, optimization_pass=self.passes[name]), optimized)
         
         return optimized
     
-    def _is_redundant_mov(self, line1, line2):
-        """Check if two mov instructions are redundant"""
-        # Extract operands from both lines
-        try:
-            op1 = line1.split('mov')[1].strip()
-            op2 = line2.split('mov')[1].strip()
-            return op1 == op2
-        except:
-            return False
-    
-    def _extract_register(self, line):
-        """Extract register name from instruction"""
+    def _iter_chunked(self, optimization_pass, code):
+        """Run a whole-list pass over bounded chunks of a stream"""
+        buffer = []
+        for instruction in code:
+            buffer.append(instruction)
+            if len(buffer) >= self.stream_chunk_size and (
+                    instruction.opcode in ('ret', 'jmp') or len(buffer) >= 2 * self.stream_chunk_size):
+                yield from self._run_on_chunk(optimization_pass, buffer)
+                buffer = []
+        if buffer:
+            yield from self._run_on_chunk(optimization_pass, buffer)
+    
+    def _run_on_chunk(self, optimization_pass, chunk):
+        """Run a whole-list pass on one chunk of a stream
+        
+        Other chunks may jump to any label in this one, so the chunk start
+        and every label are analysed as entries with unknown state.
+        """
+        state = self._analysis_state
+        self.invalidate_analyses()
+        state.open_labels = True
         try:
-            parts = line.split()
-            if len(parts) >= 2:
-                return parts[1].replace(',', '').strip()
-        except:
-            return None
-        return None
+            return optimization_pass(chunk)
+        finally:
+            state.open_labels = False
+            self.invalidate_analyses()
+    
+    def _peephole_block(self, entries):
+        """Table-driven peephole rewrites (redundant moves, push/pop pairs, identities) to a fixed point"""
+        optimized, rewrites = self.peephole.apply(entries)
+        return optimized if rewrites else None
+    
+    def _iter_peephole(self, code_lines):
+        """Streaming peephole rewrites (bounded stack of examined entries)"""
+        return self.peephole.iter_apply(code_lines, retain=self.peephole_retain)
+    
+    def _constant_propagation(self, code_lines):
+        """Sparse conditional constant propagation: fold constants, resolve branches, drop dead blocks"""
+        optimized = ConstantPropagation(self.get_analysis('liveness', code_lines)).run()
+        return optimized if optimized is not None else code_lines
     
-    def _are_independent(self, line1, line2):
-        """Check if two instructions are independent"""
-        # Simple heuristic: check if they use different registers
-        reg1 = self._extract_register(line1)
-        reg2 = self._extract_register(line2)
+    def _strength_reduction(self, code_lines):
+        """Replace multiplies and divisions by known constants with shifts, lea and magic multiplies"""
+        optimized = StrengthReduction(self.get_analysis('liveness', code_lines)).run()
+        return optimized if optimized is not None else code_lines
+    
+    def _value_numbering(self, code_lines):
+        """Dominator-based value numbering: reuse computed values, loads and comparisons"""
+        optimized = ValueNumbering(self.get_analysis('liveness', code_lines)).run()
+        return optimized if optimized is not None else code_lines
+    
+    def _dead_code_elimination(self, code_lines):
+        """Remove instructions whose register and flag results are never used"""
+        liveness = self.get_analysis('liveness', code_lines)
+        cfg = liveness.cfg
+        dead = set()
+        
+        for block in cfg.blocks:
+            entries = cfg.block_entries(block)
+            live = liveness.live_out[block.index]
+            for position in range(len(entries) - 1, -1, -1):
+                instruction = entries[position]
+                if instruction.opcode is None:
+                    continue
+                effects = instruction_effects(instruction)
+                if effects.pure and effects.defs and not effects.defs & live:
+                    # A dead instruction's operands are not uses either
+                    dead.add(block.start + position)
+                    continue
+                live = (live & ~effects.kills) | effects.uses
+        
+        if not dead:
+            return code_lines
+        return [comment(f"Removed dead: {instruction}") if i in dead else instruction
+                for i, instruction in enumerate(code_lines)]
+    
+    def _loop_optimization(self, code_lines):
+        """Hoist loop-invariant code into preheaders and unroll small counted loops"""
+        optimized = code_lines
         
-        if reg1 and reg2:
-            return reg1 != reg2
+        # Loop-invariant code motion, one loop at a time (analyses are rebuilt
+        # for every changed program)
+        for _ in range(len(self.get_analysis('cfg', optimized).loops)):
+            liveness = self.get_analysis('liveness', optimized)
+            for loop in liveness.cfg.loops:
+                hoisted = hoist_invariants(optimized, liveness.cfg, liveness, loop)
+                if hoisted is not None:
+                    optimized = hoisted
+                    break
+            else:
+                break
         
-        return False
+        # Unroll rcx-counted loops (loop / dec+jnz) with a remainder loop
+        liveness = self.get_analysis('liveness', optimized)
+        unrolled = unroll_counted_loops(optimized, liveness.cfg, liveness,
+                                        self.unroll_factor, self.unroll_max_body)
+        return unrolled if unrolled is not None else optimized
+    
+    def _register_allocation(self, code_lines):
+        """Keep stack slots and push/pop temporaries in the free extended registers r8-r15"""
+        allocated = allocate_registers(code_lines, self.get_analysis('cfg', code_lines))
+        return allocated if allocated is not None else code_lines
+    
+    def _schedule_block(self, entries):
+        """Schedule a basic block by critical path to hide load and multiply latency"""
+        return schedule_block(entries, self.schedule_window)
+
@@ -0,0 +1,188 @@
+import time
+
+
+class Pass:
+    """An optimization pass as seen by the pass manager
+
+    Program passes take and return a whole IR list, returning the input
+    list itself when nothing changes. Block passes take the entries of one
+    basic block and return replacement entries or None; the manager only
+    hands them blocks they have not already seen unchanged (or produced).
+    requires names analyses the pass reads, preserves those that stay valid
+    for its output because it rewrites entries one for one without touching
+    labels or branches.
+    """
+
+    __slots__ = ('name', 'function', 'scope', 'requires', 'preserves', 'repeat', 'expensive')
+
+    def __init__(self, name, function, scope='program', requires=(), preserves=(), repeat=True,
+                 expensive=False):
+        self.name = name
+        self.function = function
+        self.scope = scope
+        self.requires = tuple(requires)
+        self.preserves = frozenset(preserves)
+        # False for passes that must not run twice on their own output
+        # (unrolling, allocation): they only run in the first iteration
+        self.repeat = repeat
+        # Superlinear or whole-program passes, skipped first when time runs short
+        self.expensive = expensive
+
+    def __repr__(self):
+        return f"Pass({self.name})"
+
+
+class Pipeline:
+    """An ordered list of pass names, iterated until nothing changes (at most max_iterations times)"""
+
+    __slots__ = ('passes', 'max_iterations')
+
+    def __init__(self, passes, max_iterations=1):
+        self.passes = tuple(passes)
+        self.max_iterations = max_iterations
+
+    def __repr__(self):
+        return f"Pipeline({', '.join(self.passes)})"
+
+
+class CompileBudget:
+    """Wall-clock allowance for one compilation, starting when it is created"""
+
+    def __init__(self, seconds, clock=time.perf_counter):
+        self.seconds = seconds
+        self._clock = clock
+        self._started = clock()
+
+    def elapsed(self):
+        return self._clock() - self._started
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def exhausted(self):
+        return self.remaining() <= 0
+
+    def running_low(self, reserve):
+        """True when less than the given fraction of the budget is left"""
+        return self.remaining() < self.seconds * reserve
+
+
+class PassManager:
+    """Runs a pipeline over one program, tracking changes, dirty blocks and analysis validity"""
+
+    def __init__(self, engine, pipeline, recorder=None, budget=None):
+        self.engine = engine
+        self.pipeline = pipeline
+        self.recorder = recorder
+        self.budget = budget
+        self.skipped_passes = []  # {'pass', 'reason'} for passes left out to stay within limits
+        self.iterations = 0
+        self.runs = 0
+        self.skipped = 0
+        self._unchanged_on = {}  # pass name -> program it last left unchanged
+        self._clean_blocks = {}  # block pass name -> entry tuples it has nothing to do on
+
+    def run(self, code):
+        """Optimized program"""
+        passes = [self.engine.passes[name] for name in self.pipeline.passes]
+        for iteration in range(1, self.pipeline.max_iterations + 1):
+            self.iterations = iteration
+            changed = False
+            for optimization_pass in passes:
+                if iteration > 1 and not optimization_pass.repeat:
+                    continue
+                reason = self._skip_reason(optimization_pass, code)
+                if reason is not None:
+                    self._skip(optimization_pass, reason)
+                    continue
+                if self._unchanged_on.get(optimization_pass.name) is code:
+                    # Same input as a run that changed nothing: skip it
+                    self.skipped += 1
+                    continue
+                result = self._record(optimization_pass, code, iteration)
+                if result is code:
+                    self._unchanged_on[optimization_pass.name] = code
+                    continue
+                changed = True
+                self.engine.carry_analyses(code, result, optimization_pass.preserves)
+                code = result
+            if not changed or (self.budget is not None and self.budget.exhausted()):
+                break
+        return code
+
+    def summary(self):
+        """Iteration and pass-run counts for reports"""
+        return {
+            'passes': list(self.pipeline.passes),
+            'iterations': self.iterations,
+            'pass_runs': self.runs,
+            'passes_skipped_unchanged': self.skipped,
+            'skipped_passes': self.skipped_passes
+        }
+
+    def _skip_reason(self, optimization_pass, code):
+        """Why a pass must not run on this program now, or None"""
+        budget = self.budget
+        if budget is not None and budget.exhausted():
+            return 'time budget exhausted'
+        if not optimization_pass.expensive:
+            return None
+        if len(code) > self.engine.large_program_entries:
+            return 'program too large'
+        if budget is not None and budget.running_low(self.engine.expensive_pass_reserve):
+            return 'time budget running low'
+        return None
+
+    def _skip(self, optimization_pass, reason):
+        if all(skipped['pass'] != optimization_pass.name for skipped in self.skipped_passes):
+            self.skipped_passes.append({'pass': optimization_pass.name, 'reason': reason})
+
+    def _record(self, optimization_pass, code, iteration):
+        self.runs += 1
+        if self.recorder is None:
+            return self.run_pass(code, optimization_pass)
+        result = self.recorder.run(optimization_pass.name, self.run_pass, code, optimization_pass, kind='pass')
+        self.recorder.annotate(iteration=iteration, changed=result is not code)
+        return result
+
+    def run_pass(self, code, optimization_pass):
+        """Run one pass; returns the input list itself when nothing changed"""
+        for name in optimization_pass.requires:
+            self.engine.get_analysis(name, code)
+        if optimization_pass.scope == 'block':
+            return self._run_block_pass(optimization_pass, code)
+        result = optimization_pass.function(code)
+        # Passes that rebuild an identical list count as unchanged, so
+        # cached analyses stay valid
+        if result is not code and _same_program(result, code):
+            return code
+        return result
+
+    def _run_block_pass(self, optimization_pass, code):
+        cfg = self.engine.get_analysis('cfg', code)
+        clean = self._clean_blocks.setdefault(optimization_pass.name, set())
+        optimized = []
+        changed = False
+        budget = self.budget
+        for block in cfg.blocks:
+            entries = cfg.block_entries(block)
+            key = tuple(entries)
+            if key in clean or (budget is not None and budget.exhausted()):
+                # Out of time: the remaining blocks are left as they are
+                rewritten = None
+            else:
+                rewritten = optimization_pass.function(entries)
+            if rewritten is None:
+                if budget is None or not budget.exhausted():
+                    clean.add(key)
+                optimized.extend(entries)
+            else:
+                changed = True
+                clean.add(tuple(rewritten))
+                optimized.extend(rewritten)
+        return optimized if changed else code
+
+
+def _same_program(first, second):
+    """True when two IR lists hold the same entries in the same order"""
+    return len(first) == len(second) and all(a is b for a, b in zip(first, second))
@@ -0,0 +1,326 @@
+from collections import deque
+
+from .encoder import encoded_size
+from .ir import Immediate, Instruction, comment, parse_int, sized_register
+from .isa import (BLOCK_TERMINATORS, FLAGS, MOVES, RETURNS, UNKNOWN_EFFECTS, access_width, instruction_effects,
+                  memory_operands)
+
+# Instructions scanned after a match when a guard needs the flags to be dead
+FLAGS_LOOKAHEAD = 8
+
+
+def _parse_template(text):
+    """(opcodes or None for any, operand specs or None for any) of one pattern line"""
+    opcode, _, rest = text.strip().partition(' ')
+    if opcode == '*':
+        return None, None
+    specs = []
+    for token in (part.strip() for part in rest.split(',') if part.strip()):
+        if token.startswith('$'):
+            specs.append(('var', token[1:]))
+        else:
+            value = parse_int(token)
+            if value is None:
+                raise ValueError(f"Bad peephole operand: {token}")
+            specs.append(('imm', value))
+    return frozenset(opcode.split('|')), tuple(specs)
+
+
+class Rule:
+    """One declarative rewrite: a window of instruction patterns, a guard and a replacement
+
+    Patterns read like assembly ("push $a", "add $x, 0"): $name binds an
+    operand and must match the same operand wherever it repeats, integers
+    match immediates, "|" separates alternative opcodes and "*" matches any
+    instruction. A replacement is a list of templates over the bound names
+    and of indices of matched instructions to keep; an empty one deletes
+    the window. Guards may bind further names for the replacement to use.
+    """
+
+    def __init__(self, name, pattern, replacement, note, guard=None):
+        self.name = name
+        self.pattern = tuple(_parse_template(line) for line in pattern)
+        self.replacement = tuple(item if isinstance(item, int) else _parse_template(item) + (item.split()[0],)
+                                 for item in replacement)
+        self.note = note
+        self.guard = guard
+
+    @property
+    def last_opcodes(self):
+        """Opcodes the last instruction of a match can have (None for any)"""
+        return self.pattern[-1][0]
+
+    def match(self, window):
+        """Operand bindings when the window fits the pattern, else None"""
+        bindings = {}
+        for (opcodes, specs), instruction in zip(self.pattern, window):
+            if opcodes is None:
+                continue
+            if instruction.opcode not in opcodes or len(instruction.operands) != len(specs):
+                return None
+            for (kind, value), operand in zip(specs, instruction.operands):
+                if kind == 'imm':
+                    if operand.kind != 'imm' or operand.value != value:
+                        return None
+                elif value in bindings:
+                    if bindings[value] != operand:
+                        return None
+                else:
+                    bindings[value] = operand
+        return bindings
+
+    def rewrite(self, window, bindings):
+        """Entries replacing a matched window"""
+        built = [item for item in self.replacement if not isinstance(item, int)]
+        if not built:
+            kept = set(self.replacement)
+            return [instruction if position in kept else comment(f"{self.note}: {instruction}")
+                    for position, instruction in enumerate(window)]
+        result = []
+        noted = False
+        for item in self.replacement:
+            if isinstance(item, int):
+                result.append(window[item])
+                continue
+            _, specs, opcode = item
+            operands = tuple(bindings[value] if kind == 'var' else Immediate(value) for kind, value in specs)
+            result.append(Instruction(opcode, operands, comment=None if noted else self.note))
+            noted = True
+        return result
+
+
+class _Match:
+    """A candidate match handed to a rule guard"""
+
+    __slots__ = ('window', 'bindings', '_pending', '_source')
+
+    def __init__(self, window, bindings, pending, source):
+        self.window = window
+        self.bindings = bindings
+        self._pending = pending
+        self._source = source
+
+    def following(self):
+        """Entries after the window, read lazily from the input"""
+        position = 0
+        while True:
+            if position == len(self._pending):
+                entry = next(self._source, None)
+                if entry is None:
+                    return
+                self._pending.append(entry)
+            yield self._pending[position]
+            position += 1
+
+    def flags_dead(self):
+        """True when the flags are overwritten before anything reads them"""
+        live = FLAGS
+        scanned = 0
+        for entry in self.following():
+            if entry.opcode is None:
+                if entry.label is not None:
+                    return False
+                continue
+            effects = instruction_effects(entry)
+            if effects.uses & live:
+                return False
+            live &= ~effects.kills
+            if not live or entry.opcode in RETURNS:
+                return True
+            scanned += 1
+            if entry.opcode in BLOCK_TERMINATORS or scanned >= FLAGS_LOOKAHEAD:
+                return False
+        # Falling off the end of the program: the flags may be read there
+        return False
+
+
+class PeepholeMatcher:
+    """Peephole rules compiled into an index on the opcode of their last instruction
+
+    The program is read once. Examined entries sit on an output stack and
+    every rule whose last opcode matches the top is tried against it;
+    a rewrite pushes its replacement back onto the input, so the new code
+    is matched again against what precedes it. One pass therefore reaches
+    the fixed point, and rules for other opcodes cost nothing.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.window = max(len(rule.pattern) for rule in self.rules)
+        self._by_opcode = {}
+        self._wildcard = []
+        for rule in self.rules:
+            if rule.last_opcodes is None:
+                self._wildcard.append(rule)
+            else:
+                for opcode in rule.last_opcodes:
+                    self._by_opcode.setdefault(opcode, []).append(rule)
+        self._candidates = {}
+
+    def candidates(self, opcode):
+        """Rules that may match a window ending in this opcode, longest window first"""
+        rules = self._candidates.get(opcode)
+        if rules is None:
+            rules = self._by_opcode.get(opcode, []) + self._wildcard
+            rules.sort(key=lambda rule: -len(rule.pattern))
+            self._candidates[opcode] = rules
+        return rules
+
+    def apply(self, program):
+        """(rewritten program, number of rewrites)"""
+        rewrites = [0]
+        result = list(self.iter_apply(program, counter=rewrites))
+        return result, rewrites[0]
+
+    def iter_apply(self, code, retain=None, counter=None):
+        """Rewrite a stream of IR entries; entries deeper than retain on the stack are emitted early"""
+        source = iter(code)
+        pending = deque()
+        output = []
+        while True:
+            if pending:
+                entry = pending.popleft()
+            else:
+                entry = next(source, None)
+                if entry is None:
+                    break
+            output.append(entry)
+            if entry.opcode is not None and self._rewrite_top(output, pending, source):
+                if counter is not None:
+                    counter[0] += 1
+            if retain is not None and len(output) > 2 * retain:
+                yield from output[:-retain]
+                del output[:-retain]
+        yield from output
+
+    def _rewrite_top(self, output, pending, source):
+        """Apply the first rule matching a window that ends at the top of the stack"""
+        for rule in self.candidates(output[-1].opcode):
+            positions = _window_positions(output, len(rule.pattern))
+            if positions is None:
+                continue
+            window = [output[position] for position in positions]
+            bindings = rule.match(window)
+            if bindings is None:
+                continue
+            if rule.guard is not None and not rule.guard(_Match(window, bindings, pending, source)):
+                continue
+            start = positions[0]
+            skipped = [entry for entry in output[start:] if entry.opcode is None]
+            del output[start:]
+            output.extend(skipped)
+            pending.extendleft(reversed(rule.rewrite(window, bindings)))
+            return True
+        return False
+
+
+def _window_positions(output, size):
+    """Stack positions of the last size instructions, skipping comments and stopping at labels"""
+    positions = []
+    position = len(output) - 1
+    while position >= 0 and len(positions) < size:
+        entry = output[position]
+        if entry.opcode is not None:
+            positions.append(position)
+        elif entry.label is not None:
+            return None
+        position -= 1
+    if len(positions) < size:
+        return None
+    positions.reverse()
+    return positions
+
+
+# Guards
+
+def _flags_dead(match):
+    return match.flags_dead()
+
+
+def _not_zero_extending(match):
+    # mov r32, r32 clears the upper half of the register, so it is not a no-op
+    return all(operand.kind != 'reg' or operand.size != 32 for operand in match.bindings.values())
+
+
+def _identity(match):
+    """add/sub/or/xor 0 and multiply by 1 change nothing but the flags (and a 32-bit upper half)"""
+    return _not_zero_extending(match) and match.flags_dead()
+
+
+def _register_operand(match):
+    return match.bindings['a'].kind == 'reg'
+
+
+def _distinct_not_both_memory(match):
+    source, dest = match.bindings['a'], match.bindings['b']
+    return source != dest and not (source.kind == 'mem' and dest.kind == 'mem')
+
+
+def _mirrored_move(match):
+    first, second = match.bindings['a'], match.bindings['b']
+    if first.kind == 'mem' and second.kind == 'mem':
+        return False
+    # Reloading a register from a narrower or wider access than it was stored with changes it
+    for memory, register in ((first, second), (second, first)):
+        if memory.kind == 'mem' and register.kind == 'reg':
+            width = access_width(match.window[0], memory)
+            if width is None or width * 8 != register.size:
+                return False
+    return _not_zero_extending(match)
+
+
+def _idempotent_repeat(match):
+    """An exact repeat of an instruction that leaves nothing for a second run to change"""
+    first, second = match.window
+    if first.key != second.key or first.opcode in BLOCK_TERMINATORS:
+        return False
+    effects = instruction_effects(first)
+    if effects is UNKNOWN_EFFECTS or effects.defs & effects.uses:
+        return False
+    reads, writes = memory_operands(first)
+    if writes:
+        # Storing the same register or constant twice
+        return first.opcode in MOVES and not reads
+    return effects.pure
+
+
+def _smaller(match, replacement):
+    """True when the encoder puts a replacement below the matched instruction"""
+    before = encoded_size(match.window[0])
+    after = encoded_size(replacement)
+    return before is not None and after is not None and after < before
+
+
+def _zero_idiom(match):
+    """mov r, 0 becomes xor r32, r32 (which clears the whole register) when the flags are dead"""
+    register = match.bindings['a']
+    if register.kind != 'reg' or register.size not in (32, 64):
+        return False
+    match.bindings['b'] = sized_register(register.family, 32)
+    return _smaller(match, Instruction('xor', (match.bindings['b'], match.bindings['b']))) and match.flags_dead()
+
+
+def _narrow_immediate(match):
+    """mov r64, imm with an unsigned 32-bit value becomes the zero-extending mov r32, imm"""
+    register, value = match.bindings['a'], match.bindings['i']
+    if register.kind != 'reg' or register.size != 64 or value.kind != 'imm' or not 0 <= value.value < 1 << 32:
+        return False
+    match.bindings['b'] = sized_register(register.family, 32)
+    return _smaller(match, Instruction('mov', (match.bindings['b'], value)))
+
+
+# The default rule table; order only matters between rules with windows of equal length
+RULES = (
+    Rule('duplicate', ['*', '*'], [0], "Removed redundant", guard=_idempotent_repeat),
+    Rule('mirrored-mov', ['mov $a, $b', 'mov $b, $a'], [0], "Removed redundant", guard=_mirrored_move),
+    Rule('self-mov', ['mov $a, $a'], [], "Removed redundant", guard=_not_zero_extending),
+    Rule('push-pop-same', ['push $a', 'pop $a'], [], "Removed redundant", guard=_register_operand),
+    Rule('push-pop', ['push $a', 'pop $b'], ['mov $b, $a'], "Optimized push/pop pair",
+         guard=_distinct_not_both_memory),
+    Rule('add-zero', ['add|sub|or|xor $a, 0'], [], "Constant folded", guard=_identity),
+    Rule('multiply-one', ['mul|imul $a, 1'], [], "Constant folded", guard=_identity),
+    Rule('multiply-two', ['mul|imul $a, 2'], ['shl $a, 1'], "Optimized multiply by 2", guard=_flags_dead),
+    # Smaller encodings of the same operation (guards bind the 32-bit register as $b)
+    Rule('zero-idiom', ['mov $a, 0'], ['xor $b, $b'], "Optimized encoding", guard=_zero_idiom),
+    Rule('narrow-immediate', ['mov $a, $i'], ['mov $b, $i'], "Optimized encoding", guard=_narrow_immediate),
+)
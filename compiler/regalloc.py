@@ -0,0 +1,344 @@
+from .ir import Instruction, Memory, comment, get_register
+from .isa import CALLS, REGISTER_BITS, UNKNOWN_EFFECTS, access_width, instruction_effects, memory_operands
+
+# System V: calls may clobber r8-r11, while r12-r15 must be preserved for the caller
+CALLER_SAVED_EXTENDED = ('r8', 'r9', 'r10', 'r11')
+CALLEE_SAVED_EXTENDED = ('r12', 'r13', 'r14', 'r15')
+
+_RBP = get_register('rbp')
+_RSP = get_register('rsp')
+_RSP_BIT = REGISTER_BITS['rsp']
+_WIDTH_SUFFIXES = {8: '', 4: 'd', 2: 'w', 1: 'b'}
+_FRAME_RETURNS = frozenset({'ret', 'retn', 'retf'})
+
+
+class Interval:
+    """Program-order live range of a stack slot or push/pop temporary"""
+
+    __slots__ = ('key', 'start', 'end', 'width', 'crosses_call', 'register')
+
+    def __init__(self, key, start, end, width, crosses_call=False):
+        self.key = key      # ('slot', base, disp) or ('temp', push position, pop position)
+        self.start = start
+        self.end = end
+        self.width = width
+        self.crosses_call = crosses_call
+        self.register = None
+
+    def describe(self):
+        if self.key[0] == 'slot':
+            _, base, disp = self.key
+            return f"{Memory(base=base, disp=disp)} -> {self.register}"
+        return f"push/pop temporary -> {self.register}"
+
+
+def _sized(family, width):
+    return get_register(f"{family}{_WIDTH_SUFFIXES[width]}")
+
+
+def _frame_slot(operand):
+    """(base, disp) when an operand is a plain [rbp+disp] or [rsp+disp] access"""
+    if (operand.kind == 'mem' and operand.base in (_RBP, _RSP) and operand.index is None
+            and operand.symbol is None and operand.segment is None):
+        return operand.base, operand.disp
+    return None
+
+
+def _frame_setup(entry):
+    """True for the prologue/epilogue forms allowed to name rbp or rsp directly"""
+    opcode, operands = entry.opcode, entry.operands
+    if opcode in ('push', 'pop') and operands == (_RBP,):
+        return True
+    if opcode == 'mov' and operands in ((_RBP, _RSP), (_RSP, _RBP)):
+        return True
+    return (opcode in ('sub', 'add') and len(operands) == 2 and operands[0] is _RSP
+            and operands[1].kind == 'imm')
+
+
+def _frame_candidates(program, cfg):
+    """{(base, disp): width} of frame slots whose address never escapes, or None to give up"""
+    frames = {_RBP: any(entry.opcode == 'mov' and entry.operands == (_RBP, _RSP) for entry in program),
+              _RSP: True}
+    rsp_frame_size = None
+    accesses = {}
+    for position, entry in enumerate(program):
+        if entry.opcode is None:
+            continue
+        if instruction_effects(entry) is UNKNOWN_EFFECTS and entry.opcode != 'leave':
+            return None
+        if entry.opcode in CALLS:
+            # Outgoing stack arguments live at [rsp+N]
+            frames[_RSP] = False
+        if entry.opcode in ('push', 'pop', 'leave') or (entry.opcode == 'mov' and entry.operands[:1] == (_RSP,)):
+            frames[_RSP] = False
+        if entry.opcode == 'sub' and len(entry.operands) == 2 and entry.operands[0] is _RSP \
+                and entry.operands[1].kind == 'imm':
+            # One frame allocation in the entry block, before any rsp-relative access
+            if rsp_frame_size is not None or cfg.block_at(position).index != 0 or \
+                    any(base is _RSP for base, _ in accesses):
+                frames[_RSP] = False
+            rsp_frame_size = entry.operands[1].value
+
+        setup = _frame_setup(entry)
+        for operand in entry.operands:
+            if operand.kind == 'reg' and operand.family in ('rbp', 'rsp') and not setup:
+                # The frame address is copied somewhere we cannot follow
+                frames[get_register(operand.family)] = False
+            elif operand.kind == 'mem':
+                slot = _frame_slot(operand)
+                width = access_width(entry, operand)
+                if slot is None or entry.opcode == 'lea' or width not in _WIDTH_SUFFIXES:
+                    for register in operand.registers():
+                        if register.family in ('rbp', 'rsp'):
+                            frames[get_register(register.family)] = False
+                    continue
+                accesses.setdefault(slot, set()).add(width)
+
+    if rsp_frame_size is None or cfg.entries != [0] or cfg.blocks[0].predecessors:
+        frames[_RSP] = False
+
+    candidates = {}
+    for (base, disp), widths in accesses.items():
+        if not frames[base] or len(widths) != 1:
+            continue
+        width = next(iter(widths))
+        if base is _RBP and disp >= 0:
+            continue  # return address and incoming arguments
+        if base is _RSP and not (0 <= disp and disp + width <= rsp_frame_size):
+            continue
+        overlaps = any(other != (base, disp) and other[0] is base and
+                       any(other[1] < disp + width and disp < other[1] + other_width
+                           for other_width in other_widths)
+                       for other, other_widths in accesses.items())
+        if not overlaps:
+            candidates[(base, disp)] = width
+    return candidates
+
+
+def _slot_transfer(entry, bits):
+    """(uses, kills) slot masks of one IR entry"""
+    if entry.opcode is None:
+        return 0, 0
+    uses = 0
+    kills = 0
+    reads, writes = memory_operands(entry)
+    for operand in reads:
+        uses |= bits.get(_frame_slot(operand), 0)
+    for operand in writes:
+        kills |= bits.get(_frame_slot(operand), 0)
+    if entry.opcode == 'leave' or (entry.opcode, entry.operands) in (('mov', (_RSP, _RBP)), ('pop', (_RBP,))):
+        # Tearing down the frame: locals below rbp are dead
+        kills |= bits.get(_RBP, 0)
+    elif entry.opcode == 'add' and entry.operands[:1] == (_RSP,):
+        kills |= bits.get(_RSP, 0)
+    return uses, kills & ~uses
+
+
+def _slot_intervals(program, cfg, candidates):
+    """Live intervals of frame slots; slots live on entry or at an unknown exit are dropped"""
+    slots = sorted(candidates, key=lambda slot: (slot[0].name, slot[1]))
+    bits = {slot: 1 << position for position, slot in enumerate(slots)}
+    for base in (_RBP, _RSP):
+        bits[base] = sum(1 << position for position, slot in enumerate(slots) if slot[0] is base)
+    everything = (1 << len(slots)) - 1
+    transfer = [_slot_transfer(entry, bits) for entry in program]
+
+    # Backward dataflow over the CFG
+    block_uses = []
+    block_kills = []
+    for block in cfg.blocks:
+        uses = 0
+        kills = 0
+        for position in range(block.start, block.end):
+            entry_uses, entry_kills = transfer[position]
+            uses |= entry_uses & ~kills
+            kills |= entry_kills
+        block_uses.append(uses)
+        block_kills.append(kills)
+    live_in = [0] * len(cfg.blocks)
+    live_out = [0] * len(cfg.blocks)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(cfg.blocks):
+            out = everything if block.unknown_exit else 0
+            for successor in block.successors:
+                out |= live_in[successor]
+            into = block_uses[block.index] | (out & ~block_kills[block.index])
+            if out != live_out[block.index] or into != live_in[block.index]:
+                live_out[block.index] = out
+                live_in[block.index] = into
+                changed = True
+
+    rejected = 0
+    for index in cfg.entries:
+        rejected |= live_in[index]
+    for block in cfg.blocks:
+        if block.unknown_exit:
+            rejected |= live_out[block.index]
+
+    starts = {}
+    ends = {}
+    across_calls = 0
+    for block in cfg.blocks:
+        live = live_out[block.index]
+        for position in range(block.end - 1, block.start - 1, -1):
+            uses, kills = transfer[position]
+            touched = live | uses | kills
+            if program[position].opcode in CALLS:
+                across_calls |= live
+            while touched:
+                bit = touched & -touched
+                touched ^= bit
+                starts[bit] = min(starts.get(bit, position), position)
+                ends[bit] = max(ends.get(bit, position), position)
+            live = (live & ~kills) | uses
+
+    intervals = []
+    for slot in slots:
+        bit = bits[slot]
+        if bit & rejected or bit not in starts:
+            continue
+        intervals.append(Interval(('slot',) + slot, starts[bit], ends[bit], candidates[slot],
+                                  crosses_call=bool(across_calls & bit)))
+    return intervals
+
+
+def _temporary_intervals(program, cfg):
+    """push/pop pairs in one block with no stack traffic in between"""
+    intervals = []
+    for block in cfg.blocks:
+        pushed = None
+        for position in range(block.start, block.end):
+            entry = program[position]
+            if entry.opcode is None:
+                continue
+            if entry.opcode == 'push' and _temporary_operand(entry.operands):
+                pushed = position
+                continue
+            if entry.opcode == 'pop' and pushed is not None and _temporary_operand(entry.operands):
+                intervals.append(Interval(('temp', pushed, position), pushed, position, 8))
+                pushed = None
+                continue
+            effects = instruction_effects(entry)
+            if effects is UNKNOWN_EFFECTS or entry.opcode in CALLS or (effects.uses | effects.defs) & _RSP_BIT:
+                pushed = None
+    return intervals
+
+
+def _temporary_operand(operands):
+    if len(operands) != 1:
+        return False
+    operand = operands[0]
+    if operand.kind == 'reg':
+        return operand.size == 64 and operand.family != 'rsp'
+    if operand.kind == 'mem':
+        return operand.size in (None, 'qword') and all(register.family != 'rsp'
+                                                       for register in operand.registers())
+    return operand.kind == 'imm'
+
+
+def _stack_relative(operand):
+    """True for memory addressed off rsp, or off rbp outside the local area"""
+    if operand.kind != 'mem':
+        return False
+    families = {register.family for register in operand.registers()}
+    if 'rsp' in families:
+        return True
+    return 'rbp' in families and (_frame_slot(operand) is None or operand.disp >= 0)
+
+
+def linear_scan(intervals, caller_saved, callee_saved):
+    """Assign registers to intervals (Poletto-Sarkar); intervals left without one stay in memory"""
+    free = {'caller': list(caller_saved), 'callee': list(callee_saved)}
+    pools = {register: 'caller' for register in caller_saved}
+    pools.update({register: 'callee' for register in callee_saved})
+    active = []
+    for interval in sorted(intervals, key=lambda interval: (interval.start, interval.end)):
+        for expired in [other for other in active if other.end < interval.start]:
+            active.remove(expired)
+            free[pools[expired.register]].append(expired.register)
+        classes = ('callee',) if interval.crosses_call else ('caller', 'callee')
+        for pool in classes:
+            if free[pool]:
+                interval.register = free[pool].pop(0)
+                active.append(interval)
+                break
+        else:
+            # Spill whichever compatible interval ends last
+            victims = [other for other in active if pools[other.register] in classes and other.end > interval.end]
+            if victims:
+                victim = max(victims, key=lambda other: other.end)
+                interval.register = victim.register
+                victim.register = None
+                active.remove(victim)
+                active.append(interval)
+    return [interval for interval in intervals if interval.register is not None]
+
+
+def allocate_registers(program, cfg):
+    """Promote frame slots and push/pop temporaries into free r8-r15; None when nothing changes"""
+    referenced = {register.family for entry in program for register in entry.registers()}
+    caller_saved = [family for family in CALLER_SAVED_EXTENDED if family not in referenced]
+    callee_saved = [family for family in CALLEE_SAVED_EXTENDED if family not in referenced]
+    if not caller_saved and not callee_saved:
+        return None
+
+    candidates = _frame_candidates(program, cfg)
+    if candidates is None:
+        return None
+    intervals = _slot_intervals(program, cfg, candidates) + _temporary_intervals(program, cfg)
+    if not intervals:
+        return None
+
+    # Callee-saved registers are pushed on entry and popped before every
+    # return, which moves rsp-relative and incoming-argument addresses
+    frame_sensitive = any(_stack_relative(operand) for entry in program for operand in entry.operands)
+    if frame_sensitive or cfg.entries != [0] or cfg.blocks[0].predecessors or \
+            any(block.unknown_exit for block in cfg.blocks):
+        callee_saved = []
+    assigned = linear_scan(intervals, caller_saved, callee_saved)
+    if not assigned:
+        return None
+
+    slot_registers = {}
+    replacements = {}
+    for interval in assigned:
+        if interval.key[0] == 'slot':
+            slot_registers[interval.key[1:]] = _sized(interval.register, interval.width)
+        else:
+            _, push, pop = interval.key
+            register = get_register(interval.register)
+            replacements[push] = Instruction('mov', (register, program[push].operands[0]),
+                                             comment='Optimized: push kept in register')
+            replacements[pop] = Instruction('mov', (program[pop].operands[0], register),
+                                            comment='Optimized: pop kept in register')
+
+    saved = sorted({interval.register for interval in assigned if interval.register in CALLEE_SAVED_EXTENDED})
+    # Keep rsp 16-byte aligned at calls
+    pad = len(saved) % 2 == 1 and any(entry.opcode in CALLS for entry in program)
+
+    head = 0
+    while head < len(program) and program[head].label is not None:
+        head += 1
+    result = list(program[:head])
+    result.append(comment("Register allocation: " + ', '.join(interval.describe() for interval in assigned)))
+    for family in saved:
+        result.append(Instruction('push', (get_register(family),), comment='Save callee-saved register'))
+    if pad:
+        result.append(Instruction('lea', (_RSP, Memory(base=_RSP, disp=-8))))
+    for position in range(head, len(program)):
+        entry = program[position]
+        if entry.opcode in _FRAME_RETURNS and saved:
+            if pad:
+                result.append(Instruction('lea', (_RSP, Memory(base=_RSP, disp=8))))
+            for family in reversed(saved):
+                result.append(Instruction('pop', (get_register(family),), comment='Restore callee-saved register'))
+        entry = replacements.get(position, entry)
+        if slot_registers and entry.opcode is not None:
+            operands = tuple(slot_registers.get(_frame_slot(operand), operand) if operand.kind == 'mem' else operand
+                             for operand in entry.operands)
+            if operands != entry.operands:
+                entry = Instruction(entry.opcode, operands, comment=entry.comment)
+        result.append(entry)
+    return result
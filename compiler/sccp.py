@@ -0,0 +1,423 @@
+from .ir import Immediate, Instruction, Symbol, comment
+from .isa import (CALLER_SAVED, CALLS, CONDITIONAL_JUMPS, FLAGS, GPR_FAMILIES, REGISTER_BITS, UNKNOWN_EFFECTS,
+                  branch_target, instruction_effects)
+
+_MASKS = {8: 0xFF, 16: 0xFFFF, 32: 0xFFFFFFFF, 64: 0xFFFFFFFFFFFFFFFF}
+_HIGH_BYTES = frozenset({'ah', 'bh', 'ch', 'dh'})
+
+# Key of the flags in a constant state; registers are keyed by 64-bit family
+FLAGS_KEY = 'flags'
+
+# Instructions whose register source operand may be replaced by an immediate
+_IMMEDIATE_SOURCES = frozenset({'mov', 'add', 'sub', 'and', 'or', 'xor', 'adc', 'sbb', 'cmp', 'test'})
+_SHIFTS = frozenset({'shl', 'sal', 'shr', 'sar'})
+
+
+def to_signed(value, size):
+    """Two's complement reading of a size-bit value"""
+    value &= _MASKS[size]
+    return value - (1 << size) if value >> (size - 1) else value
+
+
+def evaluate_condition(condition, flags):
+    """Outcome of a condition code suffix for known (cf, zf, sf, of) flags, or None"""
+    cf, zf, sf, of = flags if flags is not None else (None, None, None, None)
+
+    def known(*values):
+        return all(value is not None for value in values)
+
+    if condition in ('e', 'z', 'ne', 'nz'):
+        result = zf if known(zf) else None
+        return result if result is None or condition in ('e', 'z') else not result
+    if condition in ('b', 'c', 'nae', 'ae', 'nb', 'nc'):
+        result = cf if known(cf) else None
+        return result if result is None or condition in ('b', 'c', 'nae') else not result
+    if condition in ('a', 'nbe', 'be', 'na'):
+        if not known(cf, zf):
+            return None
+        below_or_equal = cf or zf
+        return below_or_equal if condition in ('be', 'na') else not below_or_equal
+    if condition in ('l', 'nge', 'ge', 'nl'):
+        if not known(sf, of):
+            return None
+        less = sf != of
+        return less if condition in ('l', 'nge') else not less
+    if condition in ('le', 'ng', 'g', 'nle'):
+        if not known(zf, sf, of):
+            return None
+        less_or_equal = zf or sf != of
+        return less_or_equal if condition in ('le', 'ng') else not less_or_equal
+    if condition in ('s', 'ns'):
+        return None if not known(sf) else (sf if condition == 's' else not sf)
+    if condition in ('o', 'no'):
+        return None if not known(of) else (of if condition == 'o' else not of)
+    return None  # parity is not tracked
+
+
+def _read(state, operand, size=None):
+    """Known value of an operand (masked to its size), or None"""
+    if operand.kind == 'imm':
+        return operand.value & _MASKS[size or 64]
+    if operand.kind != 'reg' or operand.family not in REGISTER_BITS:
+        return None
+    value = state.get(operand.family)
+    if value is None:
+        return None
+    if operand.name in _HIGH_BYTES:
+        return (value >> 8) & 0xFF
+    return value & _MASKS[operand.size]
+
+
+def _write(state, operand, value):
+    """Store a register result (None = unknown), honouring partial-register semantics"""
+    family = operand.family
+    if family not in REGISTER_BITS:
+        return
+    if value is None:
+        state.pop(family, None)
+    elif operand.size == 64 or operand.size == 32:
+        state[family] = value & _MASKS[operand.size]
+    else:
+        old = state.get(family)
+        if old is None:
+            state.pop(family, None)
+        elif operand.name in _HIGH_BYTES:
+            state[family] = (old & ~0xFF00) | ((value & 0xFF) << 8)
+        else:
+            mask = _MASKS[operand.size]
+            state[family] = (old & ~mask) | (value & mask)
+
+
+def _arithmetic(opcode, a, b, size):
+    """(result, (cf, zf, sf, of)) of a two-operand ALU operation on known values"""
+    mask = _MASKS[size]
+    sign = 1 << (size - 1)
+    if opcode == 'add':
+        result = (a + b) & mask
+        return result, (a + b > mask, result == 0, bool(result & sign),
+                        bool(~(a ^ b) & (a ^ result) & sign))
+    if opcode in ('sub', 'cmp'):
+        result = (a - b) & mask
+        return result, (a < b, result == 0, bool(result & sign), bool((a ^ b) & (a ^ result) & sign))
+    if opcode in ('and', 'test'):
+        result = a & b
+    elif opcode == 'or':
+        result = a | b
+    elif opcode == 'xor':
+        result = a ^ b
+    else:
+        return None, None
+    return result, (False, result == 0, bool(result & sign), False)
+
+
+def _shift(opcode, a, count, size):
+    """(result, flags) of a shift by a known count; flags None when the count is zero"""
+    count &= 63 if size == 64 else 31
+    if not count:
+        return a, None
+    mask = _MASKS[size]
+    sign = 1 << (size - 1)
+    if opcode in ('shl', 'sal'):
+        result = (a << count) & mask
+        carry = bool((a >> (size - count)) & 1) if count <= size else False
+        overflow = bool(result & sign) != carry if count == 1 else None
+    elif opcode == 'shr':
+        result = a >> count
+        carry = bool((a >> (count - 1)) & 1)
+        overflow = bool(a & sign) if count == 1 else None
+    else:
+        result = (to_signed(a, size) >> count) & mask
+        carry = bool((to_signed(a, size) >> (count - 1)) & 1)
+        overflow = False if count == 1 else None
+    return result, (carry, result == 0, bool(result & sign), overflow)
+
+
+def execute(instruction, state):
+    """Apply one instruction to a constant state in place"""
+    effects = instruction_effects(instruction)
+    if effects is UNKNOWN_EFFECTS:
+        state.clear()
+        return
+    opcode = instruction.opcode
+    operands = instruction.operands
+    if opcode in CALLS:
+        for family in [key for key in state if key == FLAGS_KEY or CALLER_SAVED & REGISTER_BITS[key]]:
+            del state[family]
+        return
+
+    dest = operands[0] if operands else None
+    size = dest.size if dest is not None and dest.kind == 'reg' else None
+    result = None
+    flags = None
+    handled = dest is not None and dest.kind == 'reg'
+
+    if opcode in ('xor', 'sub') and len(operands) == 2 and dest.kind == 'reg' and dest is operands[1]:
+        result, flags = 0, (False, True, False, False)
+    elif opcode == 'mov' and len(operands) == 2:
+        result = _read(state, operands[1], size)
+    elif opcode == 'movzx' and len(operands) == 2:
+        result = _read(state, operands[1])
+    elif opcode in ('movsx', 'movsxd') and len(operands) == 2 and operands[1].kind == 'reg':
+        value = _read(state, operands[1])
+        result = None if value is None or size is None else to_signed(value, operands[1].size) & _MASKS[size]
+    elif opcode == 'lea' and len(operands) == 2 and size is not None:
+        address = operands[1]
+        if address.kind == 'mem' and address.symbol is None and address.segment is None:
+            base = _read(state, address.base) if address.base is not None else 0
+            index = _read(state, address.index) if address.index is not None else 0
+            if base is not None and index is not None:
+                result = (base + index * address.scale + address.disp) & _MASKS[size]
+    elif opcode in ('add', 'sub', 'and', 'or', 'xor', 'cmp', 'test') and len(operands) == 2:
+        operand_size = size or (operands[1].size if operands[1].kind == 'reg' else None)
+        if operand_size is not None:
+            a = _read(state, dest, operand_size)
+            b = _read(state, operands[1], operand_size)
+            if a is not None and b is not None:
+                result, flags = _arithmetic(opcode, a, b, operand_size)
+        if opcode in ('cmp', 'test'):
+            handled = False
+            result = None
+    elif opcode in ('inc', 'dec', 'neg', 'not') and len(operands) == 1 and size is not None:
+        a = _read(state, dest)
+        if a is not None:
+            mask = _MASKS[size]
+            sign = 1 << (size - 1)
+            previous_cf = (state.get(FLAGS_KEY) or (None,))[0]
+            if opcode == 'inc':
+                result = (a + 1) & mask
+                flags = (previous_cf, result == 0, bool(result & sign), result == sign)
+            elif opcode == 'dec':
+                result = (a - 1) & mask
+                flags = (previous_cf, result == 0, bool(result & sign), a == sign)
+            elif opcode == 'neg':
+                result = (-a) & mask
+                flags = (a != 0, result == 0, bool(result & sign), a == sign)
+            else:
+                result = ~a & mask
+                flags = state.get(FLAGS_KEY)
+    elif opcode in _SHIFTS and len(operands) in (1, 2) and size is not None:
+        a = _read(state, dest)
+        count = 1 if len(operands) == 1 else _read(state, operands[1], 8)
+        if a is not None and count is not None:
+            result, flags = _shift(opcode, a, count, size)
+            if flags is None:
+                flags = state.get(FLAGS_KEY)
+    elif opcode == 'imul' and len(operands) in (2, 3) and size is not None:
+        a = _read(state, operands[-2], size)
+        b = _read(state, operands[-1], size)
+        if a is not None and b is not None:
+            product = to_signed(a, size) * to_signed(b, size)
+            result = product & _MASKS[size]
+            overflow = to_signed(result, size) != product
+            flags = (overflow, None, None, overflow)
+    elif opcode.startswith('set') and len(operands) == 1:
+        outcome = evaluate_condition(opcode[3:], state.get(FLAGS_KEY))
+        result = None if outcome is None else int(outcome)
+    elif opcode == 'xchg' and len(operands) == 2 and all(operand.kind == 'reg' for operand in operands):
+        first, second = _read(state, operands[0]), _read(state, operands[1])
+        _write(state, operands[0], second)
+        _write(state, operands[1], first)
+        return
+    else:
+        handled = False
+
+    if handled:
+        _write(state, dest, result)
+        defs = effects.defs & ~REGISTER_BITS[dest.family] if dest.family in REGISTER_BITS else effects.defs
+    else:
+        defs = effects.defs
+    for family in GPR_FAMILIES:
+        if defs & REGISTER_BITS[family]:
+            state.pop(family, None)
+    if effects.defs & FLAGS:
+        if flags is not None and any(flag is not None for flag in flags):
+            state[FLAGS_KEY] = flags
+        else:
+            state.pop(FLAGS_KEY, None)
+
+
+def _meet(first, second):
+    """Facts holding on both incoming paths"""
+    met = {}
+    for key, value in first.items():
+        other = second.get(key)
+        if other is None:
+            continue
+        if key == FLAGS_KEY:
+            flags = tuple(a if a == b else None for a, b in zip(value, other))
+            if any(flag is not None for flag in flags):
+                met[key] = flags
+        elif value == other:
+            met[key] = value
+    return met
+
+
+class ConstantPropagation:
+    """Sparse conditional constant propagation over the CFG (Wegman-Zadeck, on registers)
+
+    Only edges proven executable carry facts, so constants survive merges
+    with paths that can never run. Afterwards instructions with constant
+    results are folded, conditional branches with a known outcome are
+    resolved and blocks that never execute are deleted.
+    """
+
+    def __init__(self, liveness):
+        self.liveness = liveness
+        self.cfg = liveness.cfg
+        self.in_states = [None] * len(self.cfg.blocks)
+
+    def run(self):
+        """New program after folding, or None when nothing changes"""
+        self.solve()
+        return self._rewrite()
+
+    def _entry_blocks(self):
+        """Blocks control may enter from outside: the start, unreferenced and address-taken labels
+
+        In a program fragment (open_labels) every label is such an entry.
+        """
+        cfg = self.cfg
+        program = cfg.program
+        entries = {0} if cfg.blocks else set()
+        indirect = False
+        for entry in program:
+            if entry.opcode is None:
+                continue
+            if entry.opcode in CONDITIONAL_JUMPS or entry.opcode == 'jmp' or entry.opcode.startswith('loop'):
+                if entry.operands and entry.operands[0].kind != 'sym':
+                    indirect = True
+                continue
+            for operand in entry.operands:
+                if operand.kind == 'sym' and operand.text in cfg.block_of_label:
+                    entries.add(cfg.block_of_label[operand.text])
+        for block in cfg.blocks:
+            if block.labels and (indirect or not block.predecessors or cfg.open_labels):
+                entries.add(block.index)
+        return entries
+
+    def solve(self):
+        """Known constants on entry to every block (None for blocks that never execute)"""
+        worklist = []
+        for index in sorted(self._entry_blocks()):
+            self.in_states[index] = {}
+            worklist.append(index)
+        while worklist:
+            index = worklist.pop()
+            block = self.cfg.blocks[index]
+            state = dict(self.in_states[index])
+            for entry in self.cfg.block_entries(block):
+                if entry.opcode is not None:
+                    execute(entry, state)
+            for successor in self._executable_successors(block, self.in_states[index]):
+                current = self.in_states[successor]
+                merged = dict(state) if current is None else _meet(current, state)
+                if current is None or merged != current:
+                    self.in_states[successor] = merged
+                    if successor not in worklist:
+                        worklist.append(successor)
+        return self.in_states
+
+    def _branch_outcome(self, block, state):
+        """(last instruction, True/False/None for a conditional branch known taken/not taken)"""
+        entries = self.cfg.block_entries(block)
+        state = dict(state)
+        last = None
+        for entry in entries:
+            if entry.opcode is not None:
+                if last is not None:
+                    execute(last, state)
+                last = entry
+        if last is None or last.opcode not in CONDITIONAL_JUMPS or branch_target(last) not in self.cfg.block_of_label:
+            return last, None
+        if last.opcode in ('jcxz', 'jecxz', 'jrcxz'):
+            size = {'jcxz': 16, 'jecxz': 32, 'jrcxz': 64}[last.opcode]
+            rcx = state.get('rcx')
+            return last, None if rcx is None else (rcx & _MASKS[size]) == 0
+        return last, evaluate_condition(last.opcode[1:], state.get(FLAGS_KEY))
+
+    def _executable_successors(self, block, state):
+        last, taken = self._branch_outcome(block, state)
+        if taken is None:
+            return block.successors
+        target = self.cfg.block_of_label[branch_target(last)]
+        fallthrough = block.index + 1 if block.index + 1 < len(self.cfg.blocks) else None
+        if taken:
+            return [target]
+        return [fallthrough] if fallthrough is not None else []
+
+    def _rewrite(self):
+        cfg = self.cfg
+        result = []
+        changed = False
+        for block in cfg.blocks:
+            entries = cfg.block_entries(block)
+            state = self.in_states[block.index]
+            if state is None:
+                changed = True
+                if block.labels:
+                    result.append(comment(f"Removed unreachable block: {block.labels[0]}"))
+                else:
+                    result.extend(comment(f"Removed unreachable: {entry}") for entry in entries
+                                  if entry.opcode is not None)
+                continue
+            state = dict(state)
+            _, taken = self._branch_outcome(block, state)
+            live_after = self.liveness.live_after(block)
+            last = max((offset for offset, entry in enumerate(entries) if entry.opcode is not None), default=None)
+            for offset, entry in enumerate(entries):
+                if entry.opcode is None:
+                    result.append(entry)
+                    continue
+                if offset == last and taken is not None:
+                    changed = True
+                    if taken:
+                        result.append(Instruction('jmp', (Symbol(branch_target(entry)),),
+                                                  comment=f"Folded branch: {entry}"))
+                    else:
+                        result.append(comment(f"Removed never-taken branch: {entry}"))
+                    continue
+                rewritten = self._fold(entry, state, live_after[offset])
+                if rewritten is not entry:
+                    changed = True
+                result.append(rewritten)
+                execute(entry, state)
+        return result if changed else None
+
+    def _fold(self, instruction, state, live_after):
+        """Constant-folded or constant-propagated form of an instruction (itself when neither applies)"""
+        effects = instruction_effects(instruction)
+        operands = instruction.operands
+        if effects is UNKNOWN_EFFECTS or not operands:
+            return instruction
+        opcode = instruction.opcode
+        dest = operands[0]
+
+        # Whole result known: a single mov of the constant
+        if dest.kind == 'reg' and dest.size in (32, 64) and dest.family in REGISTER_BITS and effects.pure \
+                and not (effects.defs & FLAGS & live_after) \
+                and effects.defs & ~FLAGS == REGISTER_BITS[dest.family] \
+                and not (opcode in ('xor', 'sub') and len(operands) == 2 and dest is operands[1]) \
+                and not (opcode == 'mov' and operands[1].kind == 'imm'):
+            after = dict(state)
+            execute(instruction, after)
+            value = after.get(dest.family)
+            if value is not None:
+                return Instruction('mov', (dest, Immediate(to_signed(value, dest.size))),
+                                   comment=f"Constant folded: {instruction}")
+
+        # Known register source: use it as an immediate
+        if len(operands) == 2 and operands[1].kind == 'reg' and operands[1] is not dest:
+            source = operands[1]
+            if opcode in _IMMEDIATE_SOURCES and (dest.kind == 'reg' or (dest.kind == 'mem' and dest.size is not None)):
+                value = _read(state, source)
+                if value is not None:
+                    signed = to_signed(value, source.size)
+                    if source.size < 64 or -2 ** 31 <= signed < 2 ** 31:
+                        return Instruction(opcode, (dest, Immediate(signed)),
+                                           comment=instruction.comment or "Propagated constant")
+            elif opcode in _SHIFTS and source.family == 'rcx' and dest.kind == 'reg':
+                count = _read(state, source)
+                if count is not None:
+                    return Instruction(opcode, (dest, Immediate(count & (63 if dest.size == 64 else 31))),
+                                       comment=instruction.comment or "Propagated constant")
+        return instruction
@@ -0,0 +1,205 @@
+from .costmodel import REFERENCE_MODEL
+from .ir import comment
+from .isa import (BLOCK_TERMINATORS, REGISTER_BITS, UNKNOWN_EFFECTS, access_width, instruction_effects,
+                  memory_operands)
+
+
+def instruction_latency(instruction):
+    """Cycles until the result of an instruction is available to a dependent one"""
+    return REFERENCE_MODEL.instruction_cost(instruction).latency
+
+
+class _Node:
+    """One instruction of a scheduling region plus the comments leading up to it"""
+
+    __slots__ = ('index', 'entries', 'instruction', 'uses', 'defs', 'reads', 'writes',
+                 'barrier', 'traps', 'latency', 'successors', 'predecessors', 'priority')
+
+    def __init__(self, index, entries, instruction):
+        self.index = index
+        self.entries = entries
+        self.instruction = instruction
+        self.reads = []
+        self.writes = []
+        self.successors = []    # (node index, edge latency)
+        self.predecessors = []  # (node index, edge latency)
+        self.priority = 0
+
+        effects = instruction_effects(instruction)
+        self.uses = effects.uses
+        self.defs = effects.defs
+        self.barrier = effects is UNKNOWN_EFFECTS or instruction.opcode in BLOCK_TERMINATORS
+        self.traps = instruction.opcode in ('div', 'idiv')
+        self.latency = instruction_latency(instruction)
+
+
+def _memory_accesses(node, versions):
+    """Fill node.reads/node.writes with (address, start, width) triples; address None = unknown"""
+    instruction = node.instruction
+    opcode = instruction.opcode
+    if opcode in ('push', 'pop'):
+        # Stack slot relative to a moving rsp: treated as aliasing everything
+        (node.writes if opcode == 'push' else node.reads).append((None, 0, None))
+    reads, writes = memory_operands(instruction)
+    for operands, accesses in ((reads, node.reads), (writes, node.writes)):
+        for operand in operands:
+            # Address registers are versioned so that [rax+8] before and after
+            # "add rax, 8" are never mistaken for disjoint slots
+            base, index = operand.base, operand.index
+            address = (operand.segment, operand.symbol, operand.scale,
+                       base, versions.get(base.family) if base is not None else None,
+                       index, versions.get(index.family) if index is not None else None)
+            accesses.append((address, operand.disp, access_width(instruction, operand)))
+
+
+def _may_alias(first, second):
+    address, start, width = first
+    other_address, other_start, other_width = second
+    if address is None or other_address is None or address != other_address:
+        return True
+    if width is None or other_width is None:
+        return True
+    return start < other_start + other_width and other_start < start + width
+
+
+def _conflicts(accesses, others):
+    return any(_may_alias(access, other) for access in accesses for other in others)
+
+
+def _edge_latency(first, second):
+    """Latency of the dependence of second on first, or None when they are independent"""
+    flow = bool(first.defs & second.uses) or _conflicts(first.writes, second.reads)
+    if flow:
+        return first.latency
+    if first.barrier or second.barrier:
+        return 0
+    if first.uses & second.defs or first.defs & second.defs:
+        return 0
+    if _conflicts(first.reads, second.writes) or _conflicts(first.writes, second.writes):
+        return 0
+    if (first.traps and (second.writes or second.traps)) or (second.traps and first.writes):
+        return 0
+    return None
+
+
+def build_dependence_graph(nodes):
+    """Add dependence edges (true, anti, output, memory and barrier) between region nodes"""
+    versions = {}
+    for node in nodes:
+        _memory_accesses(node, versions)
+        defs = node.defs
+        for family, bit in REGISTER_BITS.items():
+            if defs & bit:
+                versions[family] = versions.get(family, 0) + 1
+
+    for later in range(1, len(nodes)):
+        second = nodes[later]
+        for earlier in range(later):
+            first = nodes[earlier]
+            latency = _edge_latency(first, second)
+            if latency is not None:
+                first.successors.append((later, latency))
+                second.predecessors.append((earlier, latency))
+
+    # Critical-path priority: longest latency-weighted path to the end of the region
+    for node in reversed(nodes):
+        node.priority = max([node.latency] + [latency + nodes[successor].priority
+                                              for successor, latency in node.successors])
+
+
+def estimate_cycles(nodes, order):
+    """Cycles for a single-issue in-order core to finish a region in the given order"""
+    issued = {}
+    cycle = 0
+    finish = 0
+    for index in order:
+        node = nodes[index]
+        start = cycle
+        for predecessor, latency in node.predecessors:
+            start = max(start, issued[predecessor] + latency)
+        issued[index] = start
+        cycle = start + 1
+        finish = max(finish, start + node.latency)
+    return finish
+
+
+def list_schedule(nodes):
+    """Order region nodes by critical-path priority, respecting dependences"""
+    remaining = [len(node.predecessors) for node in nodes]
+    earliest = [0] * len(nodes)
+    ready = [node.index for node in nodes if not node.predecessors]
+    order = []
+    cycle = 0
+    while ready:
+        available = [index for index in ready if earliest[index] <= cycle]
+        if not available:
+            cycle = min(earliest[index] for index in ready)
+            continue
+        chosen = max(available, key=lambda index: (nodes[index].priority, -index))
+        ready.remove(chosen)
+        order.append(chosen)
+        for successor, latency in nodes[chosen].successors:
+            earliest[successor] = max(earliest[successor], cycle + latency)
+            remaining[successor] -= 1
+            if not remaining[successor]:
+                ready.append(successor)
+        cycle += 1
+    return order
+
+
+def schedule_block(entries, window):
+    """Scheduled copy of a basic block's entries, or None when no order is faster
+
+    Leading labels and comments stay first, a block terminator stays last,
+    and later comments travel with the instruction that follows them. A
+    label anywhere else is never moved: such blocks are left alone. Blocks
+    longer than window instructions are scheduled in consecutive regions
+    of that size.
+    """
+    head = 0
+    while head < len(entries) and entries[head].opcode is None:
+        head += 1
+    nodes = []
+    pending = []
+    for entry in entries[head:]:
+        if entry.label is not None:
+            return None
+        pending.append(entry)
+        if entry.opcode is not None:
+            nodes.append(_Node(len(nodes), pending, entry))
+            pending = []
+    tail = pending
+
+    terminator = []
+    if nodes and nodes[-1].instruction.opcode in BLOCK_TERMINATORS:
+        terminator = [nodes.pop()]
+    if len(nodes) < 2:
+        return None
+
+    body = []
+    before_total = 0
+    after_total = 0
+    for start in range(0, len(nodes), window):
+        region = [_Node(index, node.entries, node.instruction)
+                  for index, node in enumerate(nodes[start:start + window])]
+        build_dependence_graph(region)
+        original = list(range(len(region)))
+        order = list_schedule(region)
+        before = estimate_cycles(region, original)
+        after = estimate_cycles(region, order)
+        if after >= before:
+            order, after = original, before
+        before_total += before
+        after_total += after
+        for index in order:
+            body.extend(region[index].entries)
+
+    if after_total >= before_total:
+        return None
+    scheduled = list(entries[:head])
+    scheduled.append(comment(f"Scheduled: {before_total} -> {after_total} estimated cycles"))
+    scheduled.extend(body)
+    for node in terminator:
+        scheduled.extend(node.entries)
+    scheduled.extend(tail)
+    return scheduled
@@ -0,0 +1,135 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class SessionError(Exception):
+    """An edit that cannot be applied to a session's source"""
+
+
+def apply_edits(lines, edits):
+    """Apply line edits in order, each to the source as left by the previous one
+
+    An edit is {'start': int, 'end': int, 'lines': [str, ...]} and replaces
+    lines[start:end]. Returns a new list; raises SessionError on bad edits.
+    """
+    if not isinstance(edits, list):
+        raise SessionError('edits must be a list')
+    lines = list(lines)
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise SessionError('Each edit must be an object with start, end and lines')
+        start = edit.get('start')
+        end = edit.get('end')
+        replacement = edit.get('lines', [])
+        if (not isinstance(start, int) or not isinstance(end, int) or isinstance(start, bool)
+                or isinstance(end, bool) or not 0 <= start <= end <= len(lines)):
+            raise SessionError(f"Edit range {start}..{end} is outside the source ({len(lines)} lines)")
+        if not isinstance(replacement, list) or not all(isinstance(line, str) for line in replacement):
+            raise SessionError('Edit lines must be a list of strings')
+        lines[start:end] = replacement
+    return lines
+
+
+class EditSession:
+    """Source text an editor is working on, as last compiled"""
+
+    __slots__ = ('id', 'lines', 'version', 'last_used')
+
+    def __init__(self, lines, now):
+        self.id = uuid.uuid4().hex
+        self.lines = lines
+        self.version = 1
+        self.last_used = now
+
+
+class SessionStore:
+    """Editor sessions, so clients can send line edits instead of the whole source
+
+    Each edit names the version it applies to; an edit against any other
+    version is refused and the client starts over with the full text. At
+    most max_sessions are kept (least recently used are dropped first) and
+    sessions idle for idle_ttl seconds are forgotten.
+    """
+
+    def __init__(self, max_sessions=1000, idle_ttl=1800, max_bytes=None, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._sessions = OrderedDict()  # session id -> EditSession, least recently used first
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.edits = 0
+        self.stale_edits = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def open(self, source):
+        """Start a session on a full source text"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            session = EditSession(source.split('\n'), now)
+            self._sessions[session.id] = session
+            self.opened += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            return session
+
+    def edit(self, session_id, base_version, edits):
+        """Apply edits made against base_version; None if the session is unknown or expired
+
+        Returns the new source and version. Raises SessionError for stale
+        versions, malformed edits and sources over max_bytes.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if base_version != session.version:
+                self.stale_edits += 1
+                raise SessionError(f"Edits are against version {base_version}, the session is at "
+                                   f"{session.version}; send the full source again")
+            lines = apply_edits(session.lines, edits)
+            source = '\n'.join(lines)
+            if self.max_bytes is not None and len(source) > self.max_bytes:
+                raise SessionError(f"Input too large: {len(source)} bytes (limit {self.max_bytes})")
+            session.lines = lines
+            session.version += 1
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self.edits += 1
+            return source, session.version
+
+    def close(self, session_id):
+        """Forget a session; False if it was unknown or expired"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        """Open sessions and edit counters"""
+        with self._lock:
+            self._expire(self._clock())
+            return {
+                'sessions': len(self._sessions),
+                'opened': self.opened,
+                'edits': self.edits,
+                'stale_edits': self.stale_edits,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
+
+    def _expire(self, now):
+        """Forget sessions idle for longer than the TTL"""
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_ttl:
+                break
+            del self._sessions[session.id]
+            self.expired += 1
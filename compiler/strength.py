@@ -0,0 +1,321 @@
+from .costmodel import REFERENCE_MODEL
+from .ir import Immediate, Instruction, Memory, comment, sized_register
+from .isa import FLAGS, GPR_FAMILIES, REGISTER_BITS
+from .sccp import ConstantPropagation, execute, to_signed
+
+# Registers never used as scratch: the stack and frame pointers, and the
+# implicit operands of mul/div
+_RESERVED = frozenset({'rsp', 'rbp', 'rax', 'rdx'})
+
+# Multipliers a single lea can apply: [x + x*(factor-1)]
+_LEA_FACTORS = (3, 5, 9)
+
+
+def unsigned_magic(divisor, bits):
+    """(multiplier, shift, needs_add) for unsigned division by a constant (Granlund-Montgomery)
+
+    n // divisor == mulhi(n, multiplier) >> shift for every bits-wide n, or
+    with needs_add, t = mulhi(n, multiplier); (t + ((n - t) >> 1)) >> (shift - 1).
+    """
+    ceiling = (divisor - 1).bit_length()
+    for shift in range(ceiling + 1):
+        multiplier = -(-(1 << (bits + shift)) // divisor)
+        if multiplier < 1 << bits and multiplier * divisor - (1 << (bits + shift)) <= 1 << shift:
+            return multiplier, shift, False
+    return ((1 << bits) * ((1 << ceiling) - divisor)) // divisor + 1, ceiling, True
+
+
+def signed_magic(divisor, bits):
+    """(signed multiplier, shift) for signed division by a constant with |divisor| >= 2 (Hacker's Delight 10-1)"""
+    mask = (1 << bits) - 1
+    half = 1 << (bits - 1)
+    magnitude = abs(divisor)
+    t = half + (1 if divisor < 0 else 0)
+    anc = t - 1 - t % magnitude
+    power = bits - 1
+    q1, r1 = divmod(half, anc)
+    q2, r2 = divmod(half, magnitude)
+    while True:
+        power += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= magnitude:
+            q2, r2 = q2 + 1, r2 - magnitude
+        delta = magnitude - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)):
+            break
+    multiplier = (q2 + 1) & mask
+    if divisor < 0:
+        multiplier = -multiplier & mask
+    return to_signed(multiplier, bits), power - bits
+
+
+def _imm(value, bits):
+    """Immediate for a bits-wide constant; large values are shown in hex"""
+    value &= (1 << bits) - 1
+    if value < 1 << 31:
+        return Immediate(value)
+    return Immediate(to_signed(value, bits), text=hex(value))
+
+
+def _fits_imm32(value, bits):
+    signed = to_signed(value, bits)
+    return -2 ** 31 <= signed < 2 ** 31
+
+
+def _cheaper(sequence, instruction):
+    """True when the cost model puts a replacement sequence below the instruction it replaces"""
+    return REFERENCE_MODEL.sequence_cycles(sequence) < REFERENCE_MODEL.sequence_cycles([instruction])
+
+
+class StrengthReduction:
+    """Replace multiplies and divisions by known constants with shifts, lea and magic multiplies
+
+    Constants come from immediates and from the constant propagation
+    lattice, so "mov ecx, 10 ... div ecx" qualifies. Replacements that
+    clobber the flags need them dead afterwards (div/idiv leave them
+    undefined, so those never do); scratch registers must be dead after
+    the instruction being replaced.
+    """
+
+    def __init__(self, liveness):
+        self.liveness = liveness
+        self.cfg = liveness.cfg
+
+    def run(self):
+        """New program with reduced operations, or None when nothing changes"""
+        cfg = self.cfg
+        in_states = ConstantPropagation(self.liveness).solve()
+        result = []
+        changed = False
+        for block in cfg.blocks:
+            entries = cfg.block_entries(block)
+            state = dict(in_states[block.index]) if in_states[block.index] is not None else None
+            live_after = self.liveness.live_after(block)
+            previous = None
+            for offset, entry in enumerate(entries):
+                if entry.opcode is None:
+                    result.append(entry)
+                    continue
+                sequence = None
+                if state is not None:
+                    sequence = self._reduce(entry, state, live_after[offset], previous)
+                    execute(entry, state)
+                if sequence is None:
+                    result.append(entry)
+                else:
+                    changed = True
+                    if sequence:
+                        first = sequence[0]
+                        sequence[0] = Instruction(first.opcode, first.operands, comment=f"Strength reduced: {entry}")
+                        result.extend(sequence)
+                    else:
+                        result.append(comment(f"Strength reduced: {entry}"))
+                previous = entry
+        return result if changed else None
+
+    def _reduce(self, instruction, state, live, previous):
+        opcode = instruction.opcode
+        operands = instruction.operands
+        if opcode in ('imul', 'mul') and len(operands) in (2, 3):
+            return self._reduce_multiply(instruction, state, live)
+        if opcode in ('mul', 'div', 'idiv') and len(operands) == 1 and operands[0].kind == 'reg' \
+                and operands[0].size in (32, 64):
+            divisor = state.get(operands[0].family)
+            if divisor is None or operands[0].family not in REGISTER_BITS:
+                return None
+            divisor &= (1 << operands[0].size) - 1
+            if opcode == 'mul':
+                return self._reduce_widening_multiply(instruction, divisor, live)
+            if opcode == 'div':
+                return self._reduce_unsigned_division(operands[0], divisor, state, live)
+            return self._reduce_signed_division(operands[0], divisor, live, previous)
+        return None
+
+    def _scratch(self, live, count, exclude=()):
+        """Families dead after the current instruction, or None if there are not enough"""
+        free = [family for family in reversed(GPR_FAMILIES)
+                if family not in _RESERVED and family not in exclude and not live & REGISTER_BITS[family]]
+        return free[:count] if len(free) >= count else None
+
+    # Multiplication
+
+    def _reduce_multiply(self, instruction, state, live):
+        """dst = src * constant (2- and 3-operand imul, and this compiler's 2-operand mul)"""
+        operands = instruction.operands
+        dest = operands[0]
+        if dest.kind != 'reg' or dest.size not in (32, 64) or live & FLAGS:
+            return None
+        if len(operands) == 3:
+            source, factor = operands[1], operands[2]
+        else:
+            source, factor = dest, operands[1]
+        if source.kind != 'reg' or source.size != dest.size:
+            return None
+        if factor.kind == 'imm':
+            constant = factor.value & ((1 << dest.size) - 1)
+        elif factor.kind == 'reg' and factor.family in REGISTER_BITS and state.get(factor.family) is not None:
+            constant = state[factor.family] & ((1 << factor.size) - 1)
+        else:
+            return None
+        sequence = multiply_sequence(dest, source, constant)
+        if sequence is None or not _cheaper(sequence, instruction):
+            return None
+        return sequence
+
+    def _reduce_widening_multiply(self, instruction, constant, live):
+        """One-operand mul whose high half (rdx) is dead: only rax = rax * constant matters"""
+        size = instruction.operands[0].size
+        if live & (REGISTER_BITS['rdx'] | FLAGS):
+            return None
+        rax = sized_register('rax', size)
+        sequence = multiply_sequence(rax, rax, constant)
+        if sequence is None or not _cheaper(sequence, instruction):
+            return None
+        return sequence
+
+    # Division
+
+    def _reduce_unsigned_division(self, divisor_register, divisor, state, live):
+        """div by a constant with a zero high half (rdx) of the dividend"""
+        bits = divisor_register.size
+        mask = (1 << bits) - 1
+        if divisor < 2 or state.get('rdx') is None or state['rdx'] & mask:
+            return None
+        quotient_live = bool(live & REGISTER_BITS['rax'])
+        remainder_live = bool(live & REGISTER_BITS['rdx'])
+        rax = sized_register('rax', bits)
+        rdx = sized_register('rdx', bits)
+        if not quotient_live and not remainder_live:
+            return []
+
+        if divisor & (divisor - 1) == 0:
+            shift = divisor.bit_length() - 1
+            sequence = []
+            if remainder_live:
+                if divisor - 1 >= 1 << 31:
+                    return None
+                sequence += [Instruction('mov', (rdx, rax)), Instruction('and', (rdx, _imm(divisor - 1, bits)))]
+            if quotient_live:
+                sequence.append(Instruction('shr', (rax, Immediate(shift))))
+            return sequence
+
+        multiplier, shift, needs_add = unsigned_magic(divisor, bits)
+        scratch = self._scratch(live, 2 if (needs_add or remainder_live) else 1)
+        if scratch is None:
+            return None
+        magic = sized_register(scratch[0], bits)
+        sequence = []
+        dividend = None
+        if needs_add or remainder_live:
+            dividend = sized_register(scratch[1], bits)
+            sequence.append(Instruction('mov', (dividend, rax)))
+        sequence += [Instruction('mov', (magic, _imm(multiplier, bits))), Instruction('mul', (magic,))]
+        if needs_add:
+            sequence += [Instruction('mov', (rax, dividend)), Instruction('sub', (rax, rdx)),
+                         Instruction('shr', (rax, Immediate(1))), Instruction('add', (rax, rdx))]
+            if shift > 1:
+                sequence.append(Instruction('shr', (rax, Immediate(shift - 1))))
+        else:
+            if shift:
+                sequence.append(Instruction('shr', (rdx, Immediate(shift))))
+            sequence.append(Instruction('mov', (rax, rdx)))
+        if remainder_live:
+            sequence += self._remainder(rax, rdx, dividend, magic, divisor, bits)
+        return sequence
+
+    def _reduce_signed_division(self, divisor_register, divisor, live, previous):
+        """idiv by a constant right after the matching cdq/cqo sign extension"""
+        bits = divisor_register.size
+        extension = 'cqo' if bits == 64 else 'cdq'
+        if previous is None or previous.opcode != extension:
+            return None
+        divisor = to_signed(divisor, bits)
+        if abs(divisor) < 2:
+            return None
+        quotient_live = bool(live & REGISTER_BITS['rax'])
+        remainder_live = bool(live & REGISTER_BITS['rdx'])
+        rax = sized_register('rax', bits)
+        rdx = sized_register('rdx', bits)
+        if not quotient_live and not remainder_live:
+            return []
+
+        scratch = self._scratch(live, 2)
+        if scratch is None:
+            return None
+        first = sized_register(scratch[0], bits)
+        second = sized_register(scratch[1], bits)
+
+        if divisor > 0 and divisor & (divisor - 1) == 0:
+            # Round toward zero: add divisor-1 to negative dividends before shifting
+            shift = divisor.bit_length() - 1
+            sequence = [Instruction('mov', (first, rax)), Instruction('sar', (first, Immediate(bits - 1))),
+                        Instruction('shr', (first, Immediate(bits - shift))), Instruction('add', (first, rax))]
+            if remainder_live:
+                if shift >= 31:
+                    return None
+                sequence += [Instruction('mov', (second, first)), Instruction('and', (second, Immediate(-divisor))),
+                             Instruction('mov', (rdx, rax)), Instruction('sub', (rdx, second))]
+            if quotient_live:
+                sequence += [Instruction('sar', (first, Immediate(shift))), Instruction('mov', (rax, first))]
+            return sequence
+
+        multiplier, shift = signed_magic(divisor, bits)
+        sequence = [Instruction('mov', (second, rax)), Instruction('mov', (first, _imm(multiplier, bits))),
+                    Instruction('imul', (first,))]
+        if divisor > 0 and multiplier < 0:
+            sequence.append(Instruction('add', (rdx, second)))
+        elif divisor < 0 and multiplier > 0:
+            sequence.append(Instruction('sub', (rdx, second)))
+        if shift:
+            sequence.append(Instruction('sar', (rdx, Immediate(shift))))
+        sequence += [Instruction('mov', (rax, rdx)), Instruction('shr', (rax, Immediate(bits - 1))),
+                     Instruction('add', (rax, rdx))]
+        if remainder_live:
+            sequence += self._remainder(rax, rdx, second, first, divisor, bits)
+        return sequence
+
+    def _remainder(self, rax, rdx, dividend, scratch, divisor, bits):
+        """rdx = dividend - quotient * divisor, with the quotient in rax"""
+        if _fits_imm32(divisor, bits):
+            sequence = [Instruction('imul', (rdx, rax, _imm(divisor, bits)))]
+        else:
+            sequence = [Instruction('mov', (scratch, _imm(divisor, bits))), Instruction('mov', (rdx, rax)),
+                        Instruction('imul', (rdx, scratch))]
+        return sequence + [Instruction('sub', (dividend, rdx)), Instruction('mov', (rdx, dividend))]
+
+
+def multiply_sequence(dest, source, constant):
+    """Shift/lea instructions computing dest = source * constant, or None when there is no short form"""
+    bits = dest.size
+    if constant >= 1 << (bits - 1):
+        return None
+    same = dest.family == source.family
+    base = sized_register(source.family, 64)
+    if constant == 0:
+        return [Instruction('mov', (dest, Immediate(0)))]
+    if constant == 1:
+        return [] if same else [Instruction('mov', (dest, source))]
+    power = constant.bit_length() - 1
+    if constant == 1 << power:
+        if same:
+            return [Instruction('shl', (dest, Immediate(power)))]
+        if power <= 3:
+            return [Instruction('lea', (dest, Memory(index=base, scale=constant)))]
+        return [Instruction('mov', (dest, source)), Instruction('shl', (dest, Immediate(power)))]
+
+    accumulator = sized_register(dest.family, 64)
+    for factor in _LEA_FACTORS:
+        if constant % factor:
+            continue
+        rest = constant // factor
+        first = Instruction('lea', (dest, Memory(base=base, index=base, scale=factor - 1)))
+        if rest == 1:
+            return [first]
+        if rest & (rest - 1) == 0:
+            return [first, Instruction('shl', (dest, Immediate(rest.bit_length() - 1)))]
+        if rest in _LEA_FACTORS:
+            return [first, Instruction('lea', (dest, Memory(base=accumulator, index=accumulator, scale=rest - 1)))]
+    return None
@@ -0,0 +1,275 @@
+from .ir import Immediate, Instruction, comment, get_register
+from .isa import (CALLS, CALLER_SAVED, FLAGS, GPR_FAMILIES, REGISTER_BITS, UNKNOWN_EFFECTS,
+                  access_width, instruction_effects, memory_operands)
+
+# Two-operand ALU instructions numbered as dst = op(dst, src)
+BINARY = frozenset({'add', 'sub', 'and', 'or', 'xor', 'imul', 'shl', 'sal', 'shr', 'sar'})
+COMMUTATIVE = frozenset({'add', 'and', 'or', 'xor', 'imul'})
+UNARY = frozenset({'inc', 'dec', 'neg', 'not'})
+EXTENDS = frozenset({'movzx', 'movsx', 'movsxd'})
+
+# Blocks walked back from a merge point when looking for clobbers between
+# it and its immediate dominator; beyond this the merge starts from scratch
+MERGE_WALK_LIMIT = 64
+
+
+class _State:
+    """Values available at one program point: registers, memory version and flags"""
+
+    __slots__ = ('registers', 'memory', 'flags')
+
+    def __init__(self, registers=None, memory=0, flags=None):
+        self.registers = registers if registers is not None else {}  # family -> value number
+        self.memory = memory    # bumped by every store; loads are keyed on it
+        self.flags = flags      # key of the comparison the flags currently hold
+
+    def copy(self):
+        return _State(dict(self.registers), self.memory, self.flags)
+
+    def holder(self, value, preferred=None):
+        """A 64-bit register family currently holding a value number"""
+        if preferred is not None and self.registers.get(preferred) == value:
+            return preferred
+        for family, held in self.registers.items():
+            if held == value:
+                return family
+        return None
+
+
+class ValueNumbering:
+    """Dominator-based value numbering over a control-flow graph
+
+    Value numbers are global: an expression key maps to the same number
+    wherever it is computed, because the operands are value numbers too.
+    Only availability (which register holds a value, which memory version
+    and flags are current) is per program point. It flows down the
+    dominator tree; at merge points, whatever the paths from the immediate
+    dominator may clobber is dropped.
+    """
+
+    def __init__(self, liveness):
+        self.liveness = liveness
+        self.cfg = liveness.cfg
+        self._entries = frozenset(self.cfg.entries)
+        self.table = {}
+        self.constants = {}  # value number -> integer for constant values
+        self._next = 0
+        self._memory_versions = 0
+
+    def run(self):
+        """New program with redundant computations removed or turned into copies; None if unchanged"""
+        cfg = self.cfg
+        program = cfg.program
+        replacements = {}
+        end_states = [None] * len(cfg.blocks)
+        summaries = [self._block_clobbers(block) for block in cfg.blocks]
+
+        order = list(cfg.reverse_postorder)
+        seen = set(order)
+        order.extend(block.index for block in cfg.blocks if block.index not in seen)
+        for index in order:
+            block = cfg.blocks[index]
+            state = self._entry_state(block, end_states, summaries)
+            live_after = self.liveness.live_after(block)
+            for offset, entry in enumerate(cfg.block_entries(block)):
+                if entry.opcode is None:
+                    continue
+                replacement = self._visit(entry, state, live_after[offset])
+                if replacement is not None:
+                    replacements[block.start + offset] = replacement
+            end_states[index] = state
+
+        if not replacements:
+            return None
+        return [replacements.get(position, entry) for position, entry in enumerate(program)]
+
+    def _new_value(self):
+        self._next += 1
+        return self._next
+
+    def _number(self, key):
+        value = self.table.get(key)
+        if value is None:
+            value = self.table[key] = self._new_value()
+            if key[0] == 'const':
+                self.constants[value] = key[1]
+        return value
+
+    def _new_memory(self, state):
+        self._memory_versions += 1
+        state.memory = self._memory_versions
+
+    def _entry_state(self, block, end_states, summaries):
+        # Nothing is known on entry, including at the labels of a program
+        # fragment, which code outside it may jump to
+        if block.index in self._entries:
+            return _State()
+        idom = self.cfg.idom[block.index]
+        if idom is None or idom == block.index or end_states[idom] is None:
+            return _State()
+        state = end_states[idom].copy()
+        if block.predecessors == [idom]:
+            return state
+
+        # Drop whatever a path from the dominator to this block may change
+        clobbered = 0
+        stores = False
+        visited = set()
+        worklist = [pred for pred in block.predecessors if pred != idom]
+        while worklist:
+            node = worklist.pop()
+            if node in visited or node == idom or self.cfg.idom[node] is None:
+                continue
+            visited.add(node)
+            if len(visited) > MERGE_WALK_LIMIT:
+                return _State()
+            node_clobbers, node_stores = summaries[node]
+            clobbered |= node_clobbers
+            stores = stores or node_stores
+            worklist.extend(self.cfg.blocks[node].predecessors)
+
+        for family in [family for family in state.registers if clobbered & REGISTER_BITS[family]]:
+            del state.registers[family]
+        if stores:
+            self._new_memory(state)
+        if clobbered & FLAGS:
+            state.flags = None
+        return state
+
+    def _block_clobbers(self, block):
+        """(registers and flags written, whether memory may be written) by a block"""
+        clobbered = 0
+        stores = False
+        for entry in self.cfg.block_entries(block):
+            if entry.opcode is None:
+                continue
+            effects = instruction_effects(entry)
+            if effects is UNKNOWN_EFFECTS or entry.opcode in CALLS:
+                return (CALLER_SAVED if effects is not UNKNOWN_EFFECTS else -1) | clobbered, True
+            clobbered |= effects.defs
+            if entry.opcode == 'push' or memory_operands(entry)[1]:
+                stores = True
+        return clobbered, stores
+
+    def _value(self, operand, state, instruction):
+        """Value number of an operand read"""
+        if operand.kind == 'imm':
+            return self._number(('const', operand.value))
+        if operand.kind == 'sym':
+            return self._number(('sym', operand.text))
+        if operand.kind == 'reg':
+            if operand.family not in REGISTER_BITS:
+                return self._new_value()
+            value = state.registers.get(operand.family)
+            if value is None:
+                value = state.registers[operand.family] = self._new_value()
+            if operand.size == 64:
+                return value
+            return self._number(('part', operand.name, value))
+        return self._number(('load', self._address(operand, state), access_width(instruction, operand),
+                             state.memory))
+
+    def _address(self, operand, state):
+        base = self._value(operand.base, state, None) if operand.base is not None else None
+        index = self._value(operand.index, state, None) if operand.index is not None else None
+        return (operand.segment, operand.symbol, base, index, operand.scale, operand.disp)
+
+    def _expression(self, instruction, state):
+        """Expression key of an instruction computing a 64-bit register, or None"""
+        opcode = instruction.opcode
+        operands = instruction.operands
+        if not operands or operands[0].kind != 'reg' or operands[0].size != 64 \
+                or operands[0].family not in REGISTER_BITS:
+            return None
+        if len(operands) == 2 and opcode in ('xor', 'sub') and operands[0] is operands[1]:
+            return ('const', 0)
+        if opcode == 'mov' and len(operands) == 2:
+            if operands[1].kind == 'mem' and access_width(instruction, operands[1]) != 8:
+                return None
+            return ('copy', self._value(operands[1], state, instruction))
+        if opcode == 'lea' and len(operands) == 2 and operands[1].kind == 'mem':
+            return ('lea', self._address(operands[1], state))
+        if opcode in EXTENDS and len(operands) == 2:
+            return (opcode, self._value(operands[1], state, instruction))
+        if opcode in BINARY and len(operands) == 2:
+            if opcode in ('shl', 'sal', 'shr', 'sar') and operands[1].kind != 'imm':
+                return None
+            values = (self._value(operands[0], state, instruction), self._value(operands[1], state, instruction))
+            if opcode in COMMUTATIVE:
+                values = tuple(sorted(values))
+            return (opcode,) + values
+        if opcode == 'imul' and len(operands) == 3:
+            return ('imul',) + tuple(sorted((self._value(operands[1], state, instruction),
+                                             self._value(operands[2], state, instruction))))
+        if opcode in UNARY and len(operands) == 1:
+            return (opcode, self._value(operands[0], state, instruction))
+        return None
+
+    def _visit(self, instruction, state, live_after):
+        """Update the state for one instruction; returns its replacement, if any"""
+        effects = instruction_effects(instruction)
+        if effects is UNKNOWN_EFFECTS:
+            state.registers.clear()
+            self._new_memory(state)
+            state.flags = None
+            return None
+        if instruction.opcode in CALLS:
+            for family in [family for family in state.registers if CALLER_SAVED & REGISTER_BITS[family]]:
+                del state.registers[family]
+            self._new_memory(state)
+            state.flags = None
+            return None
+
+        opcode = instruction.opcode
+        flags_dead = not effects.defs & FLAGS & live_after
+
+        # Comparisons whose result the flags already hold
+        if opcode in ('cmp', 'test') and len(instruction.operands) == 2:
+            values = tuple(self._value(operand, state, instruction) for operand in instruction.operands)
+            if opcode == 'test':
+                values = tuple(sorted(values))
+            key = (opcode,) + values
+            if state.flags == key:
+                return comment(f"Removed redundant: {instruction}")
+            state.flags = key
+            return None
+
+        key = self._expression(instruction, state)
+        if key is not None:
+            dest = instruction.operands[0]
+            value = key[1] if key[0] == 'copy' else self._number(key)
+            if state.registers.get(dest.family) == value and (flags_dead or not effects.defs & FLAGS):
+                return comment(f"Removed redundant: {instruction}")
+            replacement = None
+            holder = state.holder(value)
+            if holder is not None and (flags_dead or not effects.defs & FLAGS) and opcode != 'mov' \
+                    and key[0] != 'const':
+                replacement = Instruction('mov', (dest, get_register(holder)), comment="Reused register value")
+            elif holder is not None and opcode == 'mov' and instruction.operands[1].kind == 'mem':
+                replacement = Instruction('mov', (dest, get_register(holder)), comment="Reused loaded value")
+            elif opcode == 'mov' and instruction.operands[1].kind == 'mem' and value in self.constants:
+                replacement = Instruction('mov', (dest, Immediate(self.constants[value])),
+                                          comment="Forwarded stored constant")
+            state.registers[dest.family] = value
+            if replacement is None and effects.defs & FLAGS:
+                state.flags = None
+            return replacement
+
+        # Anything else: forget what it writes
+        reads, writes = memory_operands(instruction)
+        stored = None
+        if opcode == 'mov' and writes and instruction.operands[1].kind in ('reg', 'imm') \
+                and access_width(instruction, writes[0]) == 8:
+            address = self._address(writes[0], state)
+            stored = self._value(instruction.operands[1], state, instruction)
+        for family in GPR_FAMILIES:
+            if effects.defs & REGISTER_BITS[family]:
+                state.registers.pop(family, None)
+        if writes or opcode == 'push':
+            self._new_memory(state)
+            if stored is not None:
+                # Store-to-load forwarding for the slot just written
+                self.table[('load', address, 8, state.memory)] = stored
+        if effects.defs & FLAGS:
+            state.flags = None
+        return None
@@ -1,65 +1,139 @@
 import re
 import logging
+from .cfg import ControlFlowGraph
+from .encoder import Assembly
+from .instrumentation import StageRecorder
+from .ir import comment, parse_line, render
+from .isa import BLOCK_TERMINATORS
 from .optimizer import OptimizationEngine
+from .passes import CompileBudget
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever generated code changes, so cached results are not reused
+COMPILER_VERSION = '1.3.0'
+
+EXTENDED_REGISTERS = frozenset(f"r{number}" for number in range(8, 16))
+
+class ReportPart:
+    """Report figures of one piece of a program: its source lines, translated IR and optimized IR
+    
+    Parts of consecutive pieces add up to the report of the joined program
+    (X86Compiler.combine_reports), so a compile split into functions only
+    reports again the functions an edit changed.
+    """
+    
+    __slots__ = ('lines', 'entries', 'compiled', 'annotated', 'opcodes', 'names', 'families', 'original_size',
+                 'original_errors', 'size', 'errors', 'machine_code', 'labels', 'original_labels',
+                 'external_targets', 'falls_through', 'open_block')
+    
+    def __init__(self, lines, translated_code, optimized_code, assembly=None):
+        original_assembly = Assembly(translated_code)
+        if assembly is None:
+            assembly = Assembly(optimized_code)
+        self.lines = len(lines)
+        self.entries = len(optimized_code)
+        self.annotated = 0
+        self.compiled = 0
+        opcodes = set()
+        names = set()
+        families = set()
+        for instruction in optimized_code:
+            if instruction.comment and instruction.comment.startswith(('Optimized', 'Removed')):
+                self.annotated += 1
+            if instruction.is_comment:
+                continue
+            self.compiled += 1
+            if instruction.opcode is not None:
+                opcodes.add(instruction.opcode)
+            for operand in instruction.operands:
+                if operand.kind == 'sym':
+                    # Registers the IR does not model (xmm0, ...) parse as symbols
+                    names.add(operand.text.lower())
+            for register in instruction.registers():
+                names.add(register.name)
+                families.add(register.family)
+        self.opcodes = frozenset(opcodes)
+        self.names = frozenset(names)
+        self.families = frozenset(families)
+        
+        self.original_size = original_assembly.size
+        self.original_errors = len(original_assembly.errors)
+        self.size = assembly.size
+        self.errors = len(assembly.errors)
+        cfg = ControlFlowGraph(optimized_code)
+        self.machine_code = assembly.report(cfg)
+        
+        # What decides whether the piece can be assembled apart from its neighbours
+        self.labels = frozenset(assembly.labels)
+        self.original_labels = frozenset(original_assembly.labels)
+        self.external_targets = assembly.external_targets | original_assembly.external_targets
+        last = next((instruction for instruction in reversed(optimized_code) if instruction.opcode is not None), None)
+        self.falls_through = last is not None and last.opcode not in BLOCK_TERMINATORS
+        # A last block without instructions is joined by the next piece's first block
+        self.open_block = bool(cfg.blocks) and all(
+            entry.opcode is None for entry in optimized_code[cfg.blocks[-1].start:cfg.blocks[-1].end])
+
 class X86Compiler:
     """Custom x86 to x86_64 assembly compiler with optimization support"""
     
     def __init__(self):
         self.optimizer = OptimizationEngine()
         
-        # x86 to x86_64 register mapping
+        # x86 to x86_64 register mapping (full 32-bit register set; 16/8-bit
+        # and segment registers keep their names)
         self.register_map = {
             'eax': 'rax', 'ebx': 'rbx', 'ecx': 'rcx', 'edx': 'rdx',
             'esi': 'rsi', 'edi': 'rdi', 'esp': 'rsp', 'ebp': 'rbp',
             'ax': 'ax', 'bx': 'bx', 'cx': 'cx', 'dx': 'dx',
+            'si': 'si', 'di': 'di', 'sp': 'sp', 'bp': 'bp',
             'al': 'al', 'bl': 'bl', 'cl': 'cl', 'dl': 'dl',
-            'ah': 'ah', 'bh': 'bh', 'ch': 'ch', 'dh': 'dh'
+            'ah': 'ah', 'bh': 'bh', 'ch': 'ch', 'dh': 'dh',
+            'cs': 'cs', 'ds': 'ds', 'es': 'es', 'fs': 'fs', 'gs': 'gs', 'ss': 'ss'
         }
         
-        # x86_64 specific improvements
+        # One precompiled alternation for all registers, longest names first
+        names = sorted(self.register_map, key=len, reverse=True)
+        self._register_pattern = re.compile(r'\b(?:' + '|'.join(names) + r')\b', re.IGNORECASE)
+        
+        # x86_64 specific improvements that are safe one instruction at a time;
+        # rewrites that need context (flags, neighbours) are peephole rules
         self.x64_enhancements = {
             'mov': self._optimize_mov,
-            'add': self._optimize_arithmetic,
-            'sub': self._optimize_arithmetic,
-            'mul': self._optimize_multiply,
             'push': self._optimize_stack,
             'pop': self._optimize_stack
         }
     
-    def compile(self, assembly_code, optimization_level='none'):
-        """Main compilation method"""
+    def compile(self, assembly_code, optimization_level='none', trace_memory=False, time_budget=None):
+        """Main compilation method (time_budget: seconds before expensive passes are dropped)"""
+        recorder = StageRecorder(trace_memory)
+        budget = CompileBudget(time_budget) if time_budget else None
+        recorder.start()
         try:
             logger.info(f"Starting compilation with optimization level: {optimization_level}")
             
             # Clean and parse input
-            lines = self._clean_input(assembly_code)
+            lines = recorder.run('clean_input', self._clean_input, assembly_code)
             if not lines:
                 return {
                     'success': False,
                     'error': 'No valid assembly instructions found'
                 }
             
-            # Translate x86 to x86_64
-            translated_code = self._translate_to_x64(lines)
+            # Translate x86 to x86_64 (parsed into IR once, here)
+            translated_code = recorder.run('translate', self._translate_to_x64, lines)
             
             # Apply optimizations based on level
-            optimized_code = self.optimizer.optimize(translated_code, optimization_level)
+            optimized_code = self.optimizer.optimize(translated_code, optimization_level, recorder, budget)
             
-            # Generate output
-            result = {
-                'success': True,
-                'original_code': assembly_code,
-                'compiled_code': '\n'.join(optimized_code),
-                'optimization_level': optimization_level,
-                'instruction_count': {
-                    'original': len(lines),
-                    'optimized': len(optimized_code)
-                },
-                'improvements': self._calculate_improvements(lines, optimized_code)
-            }
+            # Generate output, and machine code for exact sizes
+            compiled_code = recorder.run('emit', render, optimized_code)
+            assembly = recorder.run('encode', Assembly, optimized_code)
+            recorder.stop()
+            result = self.report(assembly_code, lines, translated_code, optimized_code, compiled_code,
+                                 optimization_level, assembly)
+            result['skipped_passes'] = recorder.details['pipeline']['skipped_passes']
+            result['stats'] = recorder.as_dict()
             
             logger.info("Compilation successful")
             return result
@@ -70,112 +144,209 @@ class X86Compiler:
                 'success': False,
                 'error': str(e)
             }
+        finally:
+            recorder.stop()
+    
+    def compile_stream(self, lines, optimization_level='none'):
+        """Compile an iterable of source lines, yielding output lines as they are produced"""
+        logger.info(f"Starting streaming compilation with optimization level: {optimization_level}")
+        
+        instructions = self._iter_translate(self._iter_clean(lines))
+        for instruction in self.optimizer.optimize_stream(instructions, optimization_level):
+            yield str(instruction)
+    
+    def report(self, assembly_code, lines, translated_code, optimized_code, compiled_code, optimization_level,
+               assembly):
+        """Result of a successful compilation, less its skipped passes and statistics"""
+        part = ReportPart(lines, translated_code, optimized_code, assembly)
+        return self.combine_reports(assembly_code, compiled_code, optimization_level, [part])
+    
+    def combine_reports(self, assembly_code, compiled_code, optimization_level, parts):
+        """Report of a program from the parts of its consecutive pieces, as report() gives for the whole
+        
+        Each piece is assembled on its own, so a label it defines is the
+        one its branches go to. None when that does not add up to the joined
+        program (a branch between pieces that could be short, or a piece
+        falling through into the next); the program is then reported whole.
+        """
+        if len(parts) > 1:
+            if any(part.falls_through for part in parts[:-1]):
+                return None
+            labels = set().union(*(part.labels | part.original_labels for part in parts))
+            if any(not part.external_targets.isdisjoint(labels) for part in parts):
+                return None
+        
+        total = _total(parts)
+        return {
+            'success': True,
+            'original_code': assembly_code,
+            'compiled_code': compiled_code,
+            'optimization_level': optimization_level,
+            'instruction_count': {
+                'original': total.lines,
+                'optimized': total.entries
+            },
+            'improvements': self._calculate_improvements(total),
+            'summary': self._summarize(total),
+            'machine_code': parts[0].machine_code if len(parts) == 1 else _join_machine_code(parts)
+        }
+    
+    def machine_code(self, program, with_hex=False, assembly=None):
+        """Encoded sizes of an IR program per instruction, per block and in total (hex on request)"""
+        if assembly is None:
+            assembly = Assembly(program)
+        return assembly.report(ControlFlowGraph(program), with_hex)
+    
+    def clean(self, assembly_code):
+        """Source lines the compiler works on: stripped, without blank lines and comments"""
+        return self._clean_input(assembly_code)
+    
+    def translate(self, assembly_code):
+        """Unoptimized x86_64 IR of a source program (the baseline benchmarks execute)"""
+        return self._translate_to_x64(self._clean_input(assembly_code))
     
     def _clean_input(self, code):
         """Clean and validate input assembly code"""
-        lines = []
-        for line in code.split('\n'):
+        return list(self._iter_clean(code.split('\n')))
+    
+    def _iter_clean(self, lines):
+        """Strip lines and skip empty lines and comments"""
+        for line in lines:
             line = line.strip()
             if line and not line.startswith(';'):  # Skip empty lines and comments
-                lines.append(line)
-        return lines
+                yield line
     
     def _translate_to_x64(self, lines):
-        """Translate x86 instructions to x86_64"""
-        translated = []
-        
+        """Translate x86 instructions to x86_64 IR"""
+        return list(self._iter_translate(lines))
+    
+    def _iter_translate(self, lines):
+        """Translate x86 instructions to x86_64 IR one line at a time"""
         for line in lines:
-            # Parse instruction
-            parts = line.split()
-            if not parts:
-                continue
-                
-            instruction = parts[0].lower()
-            operands = ' '.join(parts[1:]) if len(parts) > 1 else ''
-            
-            # Translate registers
-            translated_operands = self._translate_registers(operands)
-            
-            # Apply x86_64 specific enhancements
-            if instruction in self.x64_enhancements:
-                enhanced_line = self.x64_enhancements[instruction](instruction, translated_operands)
-                translated.append(enhanced_line)
-            else:
-                translated.append(f"{instruction} {translated_operands}".strip())
-        
-        return translated
+            # Translate registers, then parse the line once into IR
+            for instruction in parse_line(self._translate_registers(line)):
+                # Apply x86_64 specific enhancements
+                handler = self.x64_enhancements.get(instruction.opcode)
+                if handler:
+                    instruction = handler(instruction)
+                yield instruction
     
     def _translate_registers(self, operands):
         """Translate x86 registers to x86_64 equivalents"""
         if not operands:
             return operands
-            
-        # Replace registers using mapping
-        result = operands
-        for x86_reg, x64_reg in self.register_map.items():
-            # Use word boundaries to avoid partial matches
-            pattern = r'\b' + re.escape(x86_reg) + r'\b'
-            result = re.sub(pattern, x64_reg, result, flags=re.IGNORECASE)
         
-        return result
+        # Single scan of the line with a dict lookup per matched register
+        return self._register_pattern.sub(self._lookup_register, operands)
+    
+    def _lookup_register(self, match):
+        """Map one matched x86 register name to its x86_64 name"""
+        return self.register_map[match.group(0).lower()]
     
-    def _optimize_mov(self, instruction, operands):
+    def _optimize_mov(self, instruction):
         """Optimize MOV instructions for x86_64"""
-        if 'rax' in operands and 'rax' in operands.split(',')[0]:
-            # Optimize self-assignment
-            parts = operands.split(',')
-            if len(parts) == 2 and parts[0].strip() == parts[1].strip():
-                return f"; Optimized out redundant mov {operands}"
-        return f"{instruction} {operands}"
-    
-    def _optimize_arithmetic(self, instruction, operands):
-        """Optimize arithmetic instructions"""
-        # Add x86_64 specific optimizations
-        if '0' in operands:
-            if instruction == 'add' and ', 0' in operands:
-                return f"; Optimized out add with zero: {operands}"
-            elif instruction == 'sub' and ', 0' in operands:
-                return f"; Optimized out sub with zero: {operands}"
-        return f"{instruction} {operands}"
-    
-    def _optimize_multiply(self, instruction, operands):
-        """Optimize multiplication instructions"""
-        if ', 1' in operands:
-            return f"; Optimized out multiply by one: {operands}"
-        elif ', 2' in operands:
-            # Replace multiply by 2 with left shift
-            reg = operands.split(',')[0].strip()
-            return f"shl {reg}, 1  ; Optimized multiply by 2"
-        return f"{instruction} {operands}"
-    
-    def _optimize_stack(self, instruction, operands):
+        operands = instruction.operands
+        if len(operands) == 2 and operands[0].kind == 'reg' and operands[0] is operands[1] \
+                and operands[0].size != 32:
+            # Optimize self-assignment (mov r32, r32 zero-extends, so it stays)
+            return comment(f"Optimized out redundant mov {operands[0]}, {operands[1]}")
+        return instruction
+    
+    def _optimize_stack(self, instruction):
         """Optimize stack operations"""
         # x86_64 has more efficient stack operations
-        return f"{instruction} {operands}"
+        return instruction
     
-    def _calculate_improvements(self, original, optimized):
-        """Calculate performance improvements"""
-        original_size = len(original)
-        optimized_size = len([line for line in optimized if not line.strip().startswith(';')])
+    def _calculate_improvements(self, total):
+        """Calculate performance improvements (size in encoded bytes when both versions assemble)"""
+        encoded = not total.original_errors and not total.errors
+        if encoded:
+            original_size = total.original_size
+            optimized_size = total.size
+            basis = 'bytes'
+        else:
+            original_size = total.lines
+            optimized_size = total.compiled
+            basis = 'instructions'
         
         size_reduction = ((original_size - optimized_size) / original_size * 100) if original_size > 0 else 0
         
         return {
             'size_reduction_percent': round(size_reduction, 2),
+            'size_basis': basis,
+            # Byte counts only when they are the basis, so partial sizes are never compared
+            'original_bytes': total.original_size if encoded else None,
+            'compiled_bytes': total.size if encoded else None,
             'estimated_performance_gain': min(size_reduction * 0.8, 50),  # Estimate based on size reduction
-            'x64_features_utilized': self._count_x64_features(optimized)
+            'x64_features_utilized': self._count_x64_features(total)
+        }
+    
+    def _summarize(self, total):
+        """Counts benchmarks are computed from, taken from the IR rather than the output text"""
+        return {
+            'original_instructions': total.lines,
+            'compiled_instructions': total.compiled,
+            'optimizations_applied': total.annotated,
+            # Encoded sizes, None when either version has instructions the encoder does not cover
+            'original_bytes': total.original_size if not total.original_errors else None,
+            'compiled_bytes': total.size if not total.errors else None,
+            'opcodes': sorted(total.opcodes),
+            'operand_names': sorted(total.names)
         }
     
-    def _count_x64_features(self, code):
+    def _count_x64_features(self, total):
         """Count x86_64 specific features utilized"""
         features = []
-        code_str = '\n'.join(code).lower()
-        
-        if 'r8' in code_str or 'r9' in code_str or 'r10' in code_str:
+        if total.families & EXTENDED_REGISTERS:
             features.append('Extended registers')
-        if 'shl' in code_str:
+        if 'shl' in total.opcodes:
             features.append('Bit shifting optimization')
-        if 'rax' in code_str or 'rbx' in code_str:
+        if 'rax' in total.names or 'rbx' in total.names:
             features.append('64-bit registers')
             
         return features
+
+def _total(parts):
+    """One part with the figures of consecutive parts added up (machine code aside)"""
+    if len(parts) == 1:
+        return parts[0]
+    total = ReportPart.__new__(ReportPart)
+    for field in ('lines', 'entries', 'compiled', 'annotated', 'original_size', 'original_errors', 'size', 'errors'):
+        setattr(total, field, sum(getattr(part, field) for part in parts))
+    for field in ('opcodes', 'names', 'families'):
+        setattr(total, field, frozenset().union(*(getattr(part, field) for part in parts)))
+    return total
+
+def _join_machine_code(parts):
+    """Machine code report of consecutive parts, with offsets and block numbers continuing across them"""
+    instructions = []
+    blocks = []
+    unencodable = []
+    offset = 0
+    near_branches = 0
+    # Whether the last block so far has no instructions, so the next block joins it (as in ControlFlowGraph)
+    open_block = False
+    for part in parts:
+        report = part.machine_code
+        if offset:
+            instructions.extend(dict(item, offset=item['offset'] + offset) for item in report['instructions'])
+        else:
+            instructions.extend(report['instructions'])
+        for position, block in enumerate(report['blocks']):
+            if position == 0 and open_block:
+                blocks[-1] = dict(blocks[-1], labels=blocks[-1]['labels'] + block['labels'],
+                                  bytes=blocks[-1]['bytes'] + block['bytes'])
+                continue
+            blocks.append(dict(block, block=len(blocks), offset=block['offset'] + offset))
+        if report['blocks']:
+            open_block = part.open_block
+        unencodable.extend(report['unencodable'])
+        near_branches += report['near_branches']
+        offset += report['total_bytes']
+    return {
+        'total_bytes': offset,
+        'instructions': instructions,
+        'near_branches': near_branches,
+        'unencodable': unencodable,
+        'blocks': blocks
+    }
@@ -1,11 +1,103 @@
-from flask import render_template, request, jsonify, flash
+from flask import render_template, request, jsonify, flash, Response, stream_with_context
 from app import app
-from compiler.x86_compiler import X86Compiler
+from compiler.x86_compiler import X86Compiler, COMPILER_VERSION
 from compiler.benchmarks import BenchmarkRunner
+from compiler.cache import CompilationCache
+from compiler.batch import BatchCompiler
+from compiler.functions import FunctionCompiler
+from compiler.ir import parse_lines
+from compiler.jobs import JobQueue
+from compiler.sessions import SessionError, SessionStore
+from compiler.metrics import MetricsRegistry, SIZE_BUCKETS
 import logging
+import shutil
+import tempfile
+import time
 
 logger = logging.getLogger(__name__)
 
+# Bytes of output collected before each chunk is flushed by /compile/stream
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Long-lived instances shared by all requests
+x86_compiler = X86Compiler()
+benchmark_runner = BenchmarkRunner()
+compilation_cache = CompilationCache(
+    max_entries=app.config['COMPILE_CACHE_ENTRIES'],
+    max_bytes=app.config['COMPILE_CACHE_MAX_BYTES'],
+    directory=app.config['COMPILE_CACHE_DIR'],
+    version=COMPILER_VERSION
+)
+batch_compiler = BatchCompiler(
+    max_workers=app.config['BATCH_WORKERS'],
+    time_budget=app.config['COMPILE_TIME_BUDGET'],
+    max_input_bytes=app.config['COMPILE_MAX_INPUT_BYTES']
+)
+function_compiler = FunctionCompiler(
+    x86_compiler, batch_compiler,
+    cache_entries=app.config['FUNCTION_CACHE_ENTRIES'],
+    min_functions=app.config['FUNCTION_SPLIT_MIN'],
+    time_budget=app.config['COMPILE_TIME_BUDGET']
+)
+session_store = SessionStore(
+    max_sessions=app.config['SESSION_MAX'],
+    idle_ttl=app.config['SESSION_IDLE_TTL'],
+    max_bytes=app.config['COMPILE_MAX_INPUT_BYTES']
+)
+job_queue = JobQueue(
+    lambda **payload: _compile_source(**payload),  # defined below, looked up when a job runs
+    max_workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_MAX_PENDING'],
+    result_ttl=app.config['JOB_RESULT_TTL']
+)
+
+# Service metrics; everything is preallocated and only formatted on scrape
+OPTIMIZATION_LEVELS = tuple(x86_compiler.optimizer.pipelines)
+ENDPOINTS = ('compile', 'stream', 'batch', 'jobs', 'sessions')
+metrics = MetricsRegistry()
+requests_total = metrics.counter(
+    'compiler_requests_total', 'Compilation requests by endpoint and optimization level',
+    ('endpoint', 'optimization_level'),
+    preset=[(endpoint, level) for endpoint in ENDPOINTS for level in OPTIMIZATION_LEVELS + ('other',)]
+)
+errors_total = metrics.counter(
+    'compiler_errors_total', 'Failed compilations by endpoint',
+    ('endpoint',), preset=[(endpoint,) for endpoint in ENDPOINTS]
+)
+request_seconds = metrics.histogram(
+    'compiler_request_duration_seconds', 'Whole-request latency',
+    labelnames=('endpoint',), preset=[(endpoint,) for endpoint in ENDPOINTS]
+)
+stage_seconds = metrics.histogram(
+    'compiler_stage_duration_seconds', 'Latency of each compiler stage and optimization pass',
+    labelnames=('stage',)
+)
+input_bytes = metrics.histogram(
+    'compiler_input_bytes', 'Size of submitted assembly source',
+    buckets=SIZE_BUCKETS, labelnames=('endpoint',), preset=[(endpoint,) for endpoint in ENDPOINTS]
+)
+metrics.gauge_callback('compiler_cache', 'Compilation result cache', compilation_cache.stats,
+                       kinds={'hits': 'counter', 'misses': 'counter', 'disk_hits': 'counter', 'evictions': 'counter'})
+metrics.gauge_callback('compiler_batch', 'Batch compilation pool', batch_compiler.stats,
+                       kinds={'batches': 'counter', 'units': 'counter', 'failures': 'counter'})
+metrics.gauge_callback('compiler_functions', 'Per-function compilation of large sources', function_compiler.stats,
+                       kinds={key: 'counter' for key in ('compilations', 'functions', 'recompiled',
+                                                         'cache_hits', 'cache_misses')})
+metrics.gauge_callback('compiler_sessions', 'Editor sessions', session_store.stats,
+                       kinds={key: 'counter' for key in ('opened', 'edits', 'stale_edits', 'expired', 'evicted')})
+metrics.gauge_callback('compiler_jobs', 'Asynchronous compile job queue', job_queue.stats,
+                       kinds={key: 'counter' for key in ('submitted', 'completed', 'failed', 'cancelled',
+                                                         'expired', 'rejected')})
+
+def _level_label(optimization_level):
+    """Bound label cardinality to the known optimization levels"""
+    return optimization_level if optimization_level in OPTIMIZATION_LEVELS else 'other'
+
+def _observe_stages(stats):
+    """Feed per-stage timings recorded by the compiler into the stage histogram"""
+    for stage in (stats or {}).get('stages', ()):
+        stage_seconds.observe(stage['time_ns'] / 1e9, (stage['name'],))
+
 @app.route('/')
 def home():
     """Home page with animated introduction"""
@@ -24,41 +116,394 @@ def compiler():
 @app.route('/compile', methods=['POST'])
 def compile_code():
     """Handle assembly compilation requests"""
+    started = time.perf_counter()
     try:
         # Get form data
         assembly_code = request.form.get('assembly_code', '').strip()
         optimization_level = request.form.get('optimization_level', 'none')
+        trace_memory = request.form.get('trace_memory', '').lower() in ('1', 'true', 'yes')
+        with_benchmarks = request.form.get('benchmarks', '').lower() in ('1', 'true', 'yes')
+        with_hex = request.form.get('hex', '').lower() in ('1', 'true', 'yes')
+        requests_total.inc(('compile', _level_label(optimization_level)))
+        input_bytes.observe(len(assembly_code), ('compile',))
         
         if not assembly_code:
+            errors_total.inc(('compile',))
             return jsonify({
                 'success': False,
                 'error': 'Please provide assembly code to compile'
             })
         
-        # Initialize compiler
-        compiler = X86Compiler()
-        
-        # Compile the code
-        result = compiler.compile(assembly_code, optimization_level)
-        
-        if result['success']:
-            # Run benchmarks if compilation successful
-            benchmark_runner = BenchmarkRunner()
-            benchmarks = benchmark_runner.run_benchmarks(
-                result['original_code'],
-                result['compiled_code'],
-                optimization_level
-            )
-            result['benchmarks'] = benchmarks
+        if len(assembly_code) > app.config['COMPILE_MAX_INPUT_BYTES']:
+            errors_total.inc(('compile',))
+            return jsonify({
+                'success': False,
+                'error': f"Input too large: {len(assembly_code)} bytes (limit "
+                         f"{app.config['COMPILE_MAX_INPUT_BYTES']}); use /compile/stream for large sources"
+            })
+        
+        result = _compile_source(assembly_code, optimization_level, trace_memory, with_benchmarks, with_hex)
+        if not result['success']:
+            errors_total.inc(('compile',))
             
         return jsonify(result)
         
     except Exception as e:
         logger.error(f"Compilation error: {str(e)}")
+        errors_total.inc(('compile',))
         return jsonify({
             'success': False,
             'error': f'Compilation failed: {str(e)}'
         })
+    finally:
+        request_seconds.observe(time.perf_counter() - started, ('compile',))
+
+def _compile_source(assembly_code, optimization_level, trace_memory=False, with_benchmarks=False, with_hex=False,
+                    incremental=False):
+    """Compile one source through the result cache (used by /compile, /jobs and /sessions)
+
+    Benchmarks are only computed when asked for; otherwise cached results
+    point at /benchmarks/<key>, which computes them from the cached IR summary.
+    Machine code hex is not cached either: it is re-encoded from the
+    compiled code when asked for. Incremental compiles always go function
+    by function, so only the functions an edit touched are optimized again.
+    """
+    # Serve repeated submissions from the cache (memory tracing always recompiles)
+    cache_key = compilation_cache.make_key(assembly_code, optimization_level)
+    cached = None if trace_memory else compilation_cache.get(cache_key)
+    if cached is not None:
+        result = dict(cached, original_code=assembly_code, cached=True,
+                      benchmarks_url=f"/benchmarks/{cache_key}")
+    else:
+        # Compile the code; large listings are split into functions that are
+        # compiled in parallel, each through its own cache
+        if trace_memory:
+            result = x86_compiler.compile(assembly_code, optimization_level, trace_memory,
+                                          app.config['COMPILE_TIME_BUDGET'])
+        else:
+            result = function_compiler.compile(assembly_code, optimization_level,
+                                               min_functions=1 if incremental else None)
+        if not result['success']:
+            return result
+        _observe_stages(result.get('stats'))
+        
+        # Passes dropped for time depend on load, so those results are not reused
+        timed_out = any(skipped['reason'] != 'program too large' for skipped in result['skipped_passes'])
+        if not trace_memory and not timed_out:
+            compilation_cache.put(cache_key, result)
+            result = dict(result, benchmarks_url=f"/benchmarks/{cache_key}")
+        result = dict(result, cached=False)
+    
+    if with_benchmarks:
+        result['benchmarks'] = _run_benchmarks(result)
+    if with_hex:
+        result['machine_code'] = x86_compiler.machine_code(parse_lines(result['compiled_code'].split('\n')),
+                                                           with_hex=True)
+    return result
+
+def _run_benchmarks(result):
+    """Benchmarks of a successful compile result, from its IR summary and stage statistics
+    
+    The translated source and the compiled output are both executed in the
+    emulator, so the reported speedup is measured rather than estimated.
+    """
+    programs = (x86_compiler.translate(result['original_code']),
+                parse_lines(result['compiled_code'].split('\n')))
+    return benchmark_runner.run_benchmarks(result['summary'], result['optimization_level'], result.get('stats'),
+                                           programs)
+
+@app.route('/compile/stream', methods=['POST'])
+def compile_stream():
+    """Compile large inputs, sending output as a chunked response while it is produced"""
+    started = time.perf_counter()
+    optimization_level = request.args.get('optimization_level', 'none')
+    if request.content_length is not None:
+        input_bytes.observe(request.content_length, ('stream',))
+    
+    # Raw bodies are read straight off the socket. Uploads are copied in
+    # blocks to a spooled file first, because Flask closes request.files
+    # when the view returns. Either way the source is consumed line by line.
+    upload = request.files.get('file')
+    if upload is not None:
+        optimization_level = request.form.get('optimization_level', optimization_level)
+        source = tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK_BYTES * 16)
+        shutil.copyfileobj(upload.stream, source, STREAM_CHUNK_BYTES)
+        source.seek(0)
+    else:
+        source = request.stream
+    requests_total.inc(('stream', _level_label(optimization_level)))
+    
+    def generate():
+        produced = False
+        chunk = []
+        chunk_size = 0
+        try:
+            for line in x86_compiler.compile_stream(_iter_text_lines(source), optimization_level):
+                produced = True
+                chunk.append(line)
+                chunk_size += len(line) + 1
+                if chunk_size >= STREAM_CHUNK_BYTES:
+                    yield '\n'.join(chunk) + '\n'
+                    chunk = []
+                    chunk_size = 0
+            if chunk:
+                yield '\n'.join(chunk) + '\n'
+            if not produced:
+                yield '; No valid assembly instructions found\n'
+        except Exception as e:
+            logger.error(f"Streaming compilation error: {str(e)}")
+            errors_total.inc(('stream',))
+            yield f"; Compilation failed: {str(e)}\n"
+        finally:
+            if upload is not None:
+                source.close()
+            request_seconds.observe(time.perf_counter() - started, ('stream',))
+    
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+def _iter_text_lines(stream):
+    """Decode a binary stream one line at a time"""
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8', errors='replace')
+
+@app.route('/compile/batch', methods=['POST'])
+def compile_batch():
+    """Compile a JSON array of {id, assembly_code, optimization_level} units in parallel"""
+    started = time.perf_counter()
+    try:
+        units = request.get_json(silent=True)
+        if not isinstance(units, list):
+            errors_total.inc(('batch',))
+            return jsonify({
+                'success': False,
+                'error': 'Expected a JSON array of {id, assembly_code, optimization_level} objects'
+            })
+        
+        if len(units) > app.config['BATCH_MAX_UNITS']:
+            errors_total.inc(('batch',))
+            return jsonify({
+                'success': False,
+                'error': f"Batch too large: {len(units)} units (limit {app.config['BATCH_MAX_UNITS']})"
+            })
+        
+        # Results come back in input order; failures are reported per unit
+        results = batch_compiler.compile_batch(units)
+        for unit, result in zip(units, results):
+            level = unit.get('optimization_level', 'none') if isinstance(unit, dict) else 'none'
+            requests_total.inc(('batch', _level_label(level)))
+            if not result.get('success'):
+                errors_total.inc(('batch',))
+            else:
+                _observe_stages(result.get('stats'))
+        if request.content_length is not None:
+            input_bytes.observe(request.content_length, ('batch',))
+        
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'results': results
+        })
+        
+    except Exception as e:
+        logger.error(f"Batch compilation error: {str(e)}")
+        errors_total.inc(('batch',))
+        return jsonify({
+            'success': False,
+            'error': f'Batch compilation failed: {str(e)}'
+        })
+    finally:
+        request_seconds.observe(time.perf_counter() - started, ('batch',))
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a compilation (form fields or JSON as for /compile) and return its job ID at once"""
+    started = time.perf_counter()
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.form
+        assembly_code = str(data.get('assembly_code', '')).strip()
+        optimization_level = str(data.get('optimization_level', 'none'))
+        trace_memory = str(data.get('trace_memory', '')).lower() in ('1', 'true', 'yes')
+        requests_total.inc(('jobs', _level_label(optimization_level)))
+        input_bytes.observe(len(assembly_code), ('jobs',))
+        
+        if not assembly_code:
+            errors_total.inc(('jobs',))
+            return jsonify({
+                'success': False,
+                'error': 'Please provide assembly code to compile'
+            }), 400
+        
+        if len(assembly_code) > app.config['COMPILE_MAX_INPUT_BYTES']:
+            errors_total.inc(('jobs',))
+            return jsonify({
+                'success': False,
+                'error': f"Input too large: {len(assembly_code)} bytes (limit "
+                         f"{app.config['COMPILE_MAX_INPUT_BYTES']})"
+            }), 413
+        
+        with_benchmarks = str(data.get('benchmarks', '')).lower() in ('1', 'true', 'yes')
+        with_hex = str(data.get('hex', '')).lower() in ('1', 'true', 'yes')
+        job = job_queue.submit(assembly_code=assembly_code, optimization_level=optimization_level,
+                               trace_memory=trace_memory, with_benchmarks=with_benchmarks, with_hex=with_hex)
+        if job is None:
+            errors_total.inc(('jobs',))
+            return jsonify({
+                'success': False,
+                'error': 'Job queue is full, try again later'
+            }), 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/jobs/{job.id}"
+        }), 202
+    finally:
+        request_seconds.observe(time.perf_counter() - started, ('jobs',))
+
+@app.route('/jobs/stats')
+def job_stats():
+    """Job queue depth, wait times and counters"""
+    return jsonify(job_queue.stats())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a compile job, with its result once done"""
+    report = job_queue.get(job_id)
+    if report is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify(dict(report, success=True))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running compile job"""
+    report = job_queue.cancel(job_id)
+    if report is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify(dict(report, success=True))
+
+@app.route('/sessions', methods=['POST'])
+def open_session():
+    """Start an editor session on a full source (form fields or JSON as for /compile) and compile it"""
+    started = time.perf_counter()
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.form
+        assembly_code = str(data.get('assembly_code', ''))
+        input_bytes.observe(len(assembly_code), ('sessions',))
+        
+        if not assembly_code.strip():
+            errors_total.inc(('sessions',))
+            return jsonify({
+                'success': False,
+                'error': 'Please provide assembly code to compile'
+            }), 400
+        
+        if len(assembly_code) > app.config['COMPILE_MAX_INPUT_BYTES']:
+            errors_total.inc(('sessions',))
+            return jsonify({
+                'success': False,
+                'error': f"Input too large: {len(assembly_code)} bytes (limit "
+                         f"{app.config['COMPILE_MAX_INPUT_BYTES']})"
+            }), 413
+        
+        session = session_store.open(assembly_code)
+        return _compile_session(session.id, session.version, assembly_code, data)
+    finally:
+        request_seconds.observe(time.perf_counter() - started, ('sessions',))
+
+@app.route('/sessions/<session_id>', methods=['POST'])
+def edit_session(session_id):
+    """Apply line edits to a session's source and compile the result
+    
+    The JSON body holds base_version (the version the edits were made
+    against), edits ([{"start": n, "end": n, "lines": [...]}], replacing
+    lines start..end) and the /compile options. An unknown session answers
+    404 and edits that cannot be applied 409; either way the client opens
+    a new session with the full source.
+    """
+    started = time.perf_counter()
+    try:
+        data = request.get_json(silent=True)
+        if request.content_length is not None:
+            input_bytes.observe(request.content_length, ('sessions',))
+        if not isinstance(data, dict):
+            errors_total.inc(('sessions',))
+            return jsonify({
+                'success': False,
+                'error': 'Expected a JSON object with base_version and edits'
+            }), 400
+        
+        try:
+            applied = session_store.edit(session_id, data.get('base_version'), data.get('edits', []))
+        except SessionError as e:
+            errors_total.inc(('sessions',))
+            return jsonify({'success': False, 'error': str(e)}), 409
+        if applied is None:
+            errors_total.inc(('sessions',))
+            return jsonify({'success': False, 'error': 'Unknown or expired session'}), 404
+        
+        source, version = applied
+        return _compile_session(session_id, version, source, data)
+    finally:
+        request_seconds.observe(time.perf_counter() - started, ('sessions',))
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    """End an editor session"""
+    if not session_store.close(session_id):
+        return jsonify({'success': False, 'error': 'Unknown or expired session'}), 404
+    return jsonify({'success': True})
+
+def _compile_session(session_id, version, source, data):
+    """Compile a session's current source; the response carries the version to send edits against"""
+    optimization_level = str(data.get('optimization_level', 'none'))
+    with_benchmarks = str(data.get('benchmarks', '')).lower() in ('1', 'true', 'yes')
+    with_hex = str(data.get('hex', '')).lower() in ('1', 'true', 'yes')
+    requests_total.inc(('sessions', _level_label(optimization_level)))
+    
+    try:
+        result = _compile_source(source.strip(), optimization_level, with_benchmarks=with_benchmarks,
+                                 with_hex=with_hex, incremental=True)
+    except Exception as e:
+        logger.error(f"Session compilation error: {str(e)}")
+        result = {
+            'success': False,
+            'error': f'Compilation failed: {str(e)}'
+        }
+    if not result['success']:
+        errors_total.inc(('sessions',))
+    
+    # The client already has the source, so it is not sent back
+    result = {key: value for key, value in result.items() if key != 'original_code'}
+    return jsonify(dict(result, session_id=session_id, version=version))
+
+@app.route('/benchmarks/<cache_key>')
+def benchmarks(cache_key):
+    """Benchmarks for a cached compile result (the benchmarks_url of a /compile response)"""
+    cached = compilation_cache.get(cache_key)
+    if cached is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown or expired compile result; compile again with benchmarks=1'
+        }), 404
+    return jsonify({
+        'success': True,
+        'benchmarks': _run_benchmarks(cached)
+    })
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Compilation cache hit/miss counters"""
+    return jsonify(compilation_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/contact')
 def contact():
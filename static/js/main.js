@@ -1089,6 +1089,30 @@ function generateId(prefix = 'id') {
     return prefix + '_' + Math.random().toString(36).substr(2, 9);
 }
 
+/**
+ * Utility function: Line edit turning one text into another
+ * Returns {start, end, lines}, replacing lines start..end of previous, or null if nothing changed
+ */
+function lineEdit(previous, current) {
+    if (previous === current) return null;
+    const before = previous.split('\n');
+    const after = current.split('\n');
+    let start = 0;
+    while (start < before.length && start < after.length && before[start] === after[start]) {
+        start++;
+    }
+    let suffix = 0;
+    while (suffix < before.length - start && suffix < after.length - start &&
+           before[before.length - 1 - suffix] === after[after.length - 1 - suffix]) {
+        suffix++;
+    }
+    return {
+        start: start,
+        end: before.length - suffix,
+        lines: after.slice(start, after.length - suffix)
+    };
+}
+
 /**
  * Utility function: Format file size
  */
@@ -1151,6 +1175,7 @@ window.OptimizingCompiler = {
         throttle,
         debounce,
         generateId,
+        lineEdit,
         formatFileSize,
         copyToClipboard,
         downloadTextAsFile
@@ -0,0 +1,72 @@
+import unittest
+
+from compiler.benchmarks import BenchmarkRunner
+from compiler.emulator import EmulatedProgram, EmulationError, Machine, _add, _sub
+from compiler.ir import parse_lines
+
+MASK = (1 << 64) - 1
+SIGN = 1 << 63
+
+# (a, b) pairs covering equal, mixed-sign and overflowing comparisons
+PAIRS = [(2, 9), (9, 2), (5, 5), (-1, 1), (1, -1), (-7, -3), (-(1 << 63), 1), ((1 << 63) - 1, -1), (0, -(1 << 63))]
+
+
+def signed(value):
+    return value - (1 << 64) if value & SIGN else value
+
+
+def condition(name, a, b):
+    """Expected outcome of `cmp a, b; j<name>`"""
+    sa, sb, ua, ub = signed(a & MASK), signed(b & MASK), a & MASK, b & MASK
+    return {'l': sa < sb, 'le': sa <= sb, 'g': sa > sb, 'ge': sa >= sb,
+            'b': ua < ub, 'be': ua <= ub, 'a': ua > ub, 'ae': ua >= ub, 'e': ua == ub, 'ne': ua != ub}[name]
+
+
+class FlagTest(unittest.TestCase):
+
+    def test_add_overflow(self):
+        cases = [((0x7f, 1), True), ((0x80, 0xff), True), ((0x7f, 0x80), False), ((1, 1), False),
+                 ((0xff, 1), False)]
+        for (a, b), overflow in cases:
+            machine = Machine(4096)
+            _add(machine, a, b, 8)
+            self.assertEqual(machine.of, overflow, (a, b))
+
+    def test_sub_overflow(self):
+        cases = [((0x80, 1), True), ((0x7f, 0xff), True), ((2, 9), False), ((0xff, 0x7f), False),
+                 ((0, 0x80), True)]
+        for (a, b), overflow in cases:
+            machine = Machine(4096)
+            _sub(machine, a, b, 8)
+            self.assertEqual(machine.of, overflow, (a, b))
+
+    def test_setcc_after_cmp(self):
+        for a, b in PAIRS:
+            for name in ('l', 'le', 'g', 'ge', 'b', 'be', 'a', 'ae', 'e', 'ne'):
+                program = parse_lines([f'mov rsi, {a & MASK}', f'mov rdi, {b & MASK}', 'mov rax, 0',
+                                       'cmp rsi, rdi', f'set{name} al', 'ret'])
+                result = EmulatedProgram(program).run()
+                self.assertEqual(result['registers']['rax'], int(condition(name, a, b)), (a, b, name))
+
+    def test_signed_loop_bound(self):
+        program = parse_lines(['mov rcx, -3', 'mov rax, 0', 'top:', 'add rax, 1', 'add rcx, 1',
+                               'cmp rcx, 2', 'jl top', 'ret'])
+        self.assertEqual(EmulatedProgram(program).run()['registers']['rax'], 5)
+
+
+class UnsupportedFormTest(unittest.TestCase):
+
+    def test_symbol_operands_raise_emulation_error(self):
+        for line in ('lea eax, var', 'lea eax, array[ebx*4]', 'movzx eax, xmm0', 'div xmm0', 'ret eax'):
+            with self.subTest(line=line):
+                with self.assertRaises(EmulationError):
+                    EmulatedProgram(parse_lines([line, 'ret']))
+
+    def test_benchmark_reports_symbol_operand_as_not_measured(self):
+        program = parse_lines(['lea eax, var', 'ret'])
+        runtime = BenchmarkRunner()._measure_runtime((program, program))
+        self.assertFalse(runtime['measured'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from compiler.encoder import Assembly, EncodingError, encode
+from compiler.ir import parse_line, parse_lines
+from compiler.x86_compiler import X86Compiler
+
+
+class AssemblyTest(unittest.TestCase):
+
+    def test_short_only_branch_to_outside_label_is_an_error(self):
+        assembly = Assembly(parse_lines(['loop elsewhere', 'ret']))
+        self.assertEqual([position for position, _ in assembly.errors], [0])
+        self.assertEqual(assembly.sizes(), [None, 1])
+        self.assertEqual(assembly.size, 1)
+
+    def test_short_only_branch_in_range_is_encoded(self):
+        assembly = Assembly(parse_lines(['top:', 'dec rax', 'jrcxz top', 'loop top', 'ret']))
+        self.assertEqual(assembly.errors, [])
+        self.assertEqual(assembly.sizes(), [0, 3, 2, 2, 1])
+
+    def test_compile_reports_unencodable_loop(self):
+        result = X86Compiler().compile('loop elsewhere\nret', 'standard')
+        self.assertTrue(result['success'])
+        self.assertEqual(len(result['machine_code']['unencodable']), 1)
+
+    def test_compile_reports_encoded_sizes_only_when_both_sides_assemble(self):
+        improvements = X86Compiler().compile('push var\nret', 'standard')['improvements']
+        self.assertEqual(improvements['size_basis'], 'instructions')
+        self.assertIsNone(improvements['original_bytes'])
+        self.assertIsNone(improvements['compiled_bytes'])
+
+
+class UnsupportedFormTest(unittest.TestCase):
+
+    FORMS = ['push var', 'push xmm0', 'push offset var', 'pop var', 'pop', 'push',
+             'movzx eax, var', 'movsx eax, 5', 'ret CONST', 'ret eax', 'ret 70000', 'sete']
+
+    def test_unsupported_forms_raise_encoding_error(self):
+        for line in self.FORMS:
+            with self.subTest(line=line):
+                with self.assertRaises(EncodingError):
+                    encode(parse_line(line)[0])
+
+    def test_compile_reports_unsupported_forms_at_every_level(self):
+        compiler = X86Compiler()
+        for line in self.FORMS:
+            for level in ('none', 'standard', 'aggressive'):
+                with self.subTest(line=line, level=level):
+                    result = compiler.compile(f'{line}\nret', level)
+                    self.assertTrue(result['success'])
+                    self.assertEqual(len(result['machine_code']['unencodable']), 1)
+
+    def test_ret_immediate_is_encoded(self):
+        self.assertEqual(encode(parse_line('ret 8')[0]).data, b'\xc2\x08\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
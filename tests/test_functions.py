@@ -0,0 +1,68 @@
+import unittest
+
+from compiler.batch import BatchCompiler
+from compiler.encoder import Assembly
+from compiler.functions import FunctionCompiler
+from compiler.ir import parse_lines
+from compiler.x86_compiler import X86Compiler
+
+REPORT_FIELDS = ('compiled_code', 'instruction_count', 'improvements', 'summary', 'machine_code')
+
+
+def function(index, body='add eax, edi', tail='ret'):
+    return (f'f{index}:\nmov ecx, esi\n.top{index}:\nlea edi, [esi+{index}]\n{body}\ndec ecx\n'
+            f'jnz .top{index}\ncall f0\n{tail}')
+
+
+class FunctionCompilerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.batch_compiler = BatchCompiler(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.batch_compiler.shutdown()
+
+    def setUp(self):
+        self.compiler = X86Compiler()
+        self.function_compiler = FunctionCompiler(self.compiler, self.batch_compiler)
+
+    def whole_report(self, source, result):
+        """What report() gives for the merged output assembled as one program"""
+        program = parse_lines(result['compiled_code'].split('\n'))
+        return self.compiler.report(source, self.compiler.clean(source), self.compiler.translate(source), program,
+                                    result['compiled_code'], 'aggressive', Assembly(program))
+
+    def assertReportsWhole(self, source, result):
+        self.assertTrue(result['success'], result.get('error'))
+        expected = self.whole_report(source, result)
+        for field in REPORT_FIELDS:
+            self.assertEqual(result[field], expected[field], field)
+
+    def test_joined_report_matches_whole_program(self):
+        # Trailing comments and labels after ret join the next function's first block
+        source = '\n'.join([function(0), function(1, tail='ret\n; end of f1'), function(2, tail='ret\n.done2:'),
+                            function(3, body='shl eax, 2\nmov r9, rax')])
+        self.assertReportsWhole(source, self.function_compiler.compile(source, 'aggressive', min_functions=1))
+
+    def test_short_branch_between_functions_is_reported_whole(self):
+        source = '\n'.join([function(0), function(1, tail='jmp f0'), function(2, tail='jmp f1')])
+        self.assertReportsWhole(source, self.function_compiler.compile(source, 'aggressive', min_functions=1))
+
+    def test_edit_reuses_unchanged_functions(self):
+        functions = [function(index) for index in range(6)]
+        self.function_compiler.compile('\n'.join(functions), 'aggressive', min_functions=1)
+        functions[3] = function(3, body='imul eax, edi, 5')
+        source = '\n'.join(functions)
+        result = self.function_compiler.compile(source, 'aggressive', min_functions=1)
+        self.assertEqual([entry['name'] for entry in result['functions'] if not entry['cached']], ['f3'])
+        self.assertReportsWhole(source, result)
+
+        fresh = FunctionCompiler(self.compiler, self.batch_compiler).compile(source, 'aggressive', min_functions=1)
+        for field in REPORT_FIELDS:
+            self.assertEqual(result[field], fresh[field], field)
+
+
+if __name__ == '__main__':
+    unittest.main()
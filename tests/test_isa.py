@@ -0,0 +1,41 @@
+import unittest
+
+from compiler.ir import parse_line
+from compiler.isa import REGISTER_BITS, instruction_effects
+from compiler.x86_compiler import X86Compiler
+
+RAX = REGISTER_BITS['rax']
+RDX = REGISTER_BITS['rdx']
+
+
+def effects(line):
+    return instruction_effects(parse_line(line)[0])
+
+
+class WideningMultiplyEffectsTest(unittest.TestCase):
+
+    def test_byte_multiply_writes_only_ax(self):
+        result = effects('mul bl')
+        self.assertFalse(result.defs & RDX)
+        self.assertFalse(result.kills & (RAX | RDX))
+
+    def test_word_multiply_merges_dx_and_ax(self):
+        result = effects('mul bx')
+        self.assertEqual(result.defs & (RAX | RDX), RAX | RDX)
+        self.assertTrue(result.uses & RDX)
+        self.assertFalse(result.kills & (RAX | RDX))
+
+    def test_dword_and_qword_forms_replace_both(self):
+        for line in ('mul ebx', 'imul rbx', 'div dword [rbp-8]'):
+            self.assertEqual(effects(line).kills & (RAX | RDX), RAX | RDX, line)
+
+    def test_unsized_memory_operand_is_partial(self):
+        self.assertFalse(effects('mul [rbp-8]').kills & RDX)
+
+    def test_rdx_store_before_byte_multiply_is_kept(self):
+        result = X86Compiler().compile('mov edx, 1000\nmul bl\nret', 'standard')
+        self.assertNotIn('Removed dead', result['compiled_code'])
+
+
+if __name__ == '__main__':
+    unittest.main()
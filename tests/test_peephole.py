@@ -0,0 +1,27 @@
+import unittest
+
+from compiler.x86_compiler import X86Compiler
+
+
+class MirroredMoveTest(unittest.TestCase):
+
+    def compiled(self, source):
+        return X86Compiler().compile(source, 'standard')['compiled_code'].split('\n')
+
+    def test_reload_of_narrower_store_is_kept(self):
+        lines = self.compiled('mov dword [rbp-8], edi\nmov rdi, qword [rbp-8]\nret')
+        self.assertIn('mov rdi, qword [rbp-8]', lines)
+
+    def test_reload_with_store_size_is_kept(self):
+        # The store only wrote four bytes of what the reload reads
+        lines = self.compiled('mov dword [rbp-8], edi\nmov rdi, dword [rbp-8]\nret')
+        self.assertIn('mov rdi, dword [rbp-8]', lines)
+
+    def test_reload_of_same_width_is_removed(self):
+        lines = self.compiled('mov qword [rbp-8], rdi\nmov rdi, [rbp-8]\nret')
+        self.assertNotIn('mov rdi, [rbp-8]', lines)
+        self.assertIn('; Removed redundant: mov rdi, [rbp-8]', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from compiler.ir import parse_line
+from compiler.sccp import execute
+from compiler.x86_compiler import X86Compiler
+
+
+class SymbolOperandTest(unittest.TestCase):
+    """Named memory is a symbol operand with no size or address parts"""
+
+    PROGRAMS = [
+        'mov eax, 5\nmov var, eax\nret',
+        'mov eax, 5\nmov ebx, 1\nmov array[ebx*4], eax\nret',
+        'mov eax, 5\nadd var, eax\nret',
+        'mov eax, 5\ncmp var, eax\nje done\ninc eax\ndone:\nret',
+        'mov eax, 5\ntest var, eax\nret',
+        'lea eax, var\nret',
+        'mov ebx, 1\nlea eax, array[ebx*4]\nret',
+        'mov eax, offset var\nmov ebx, eax\nret',
+        'mov eax, 5\nmovdqa xmm0, xmm1\nmov ebx, eax\nret 8',
+    ]
+
+    def test_compile_at_every_level(self):
+        compiler = X86Compiler()
+        for source in self.PROGRAMS:
+            for level in ('none', 'standard', 'aggressive'):
+                with self.subTest(source=source, level=level):
+                    self.assertTrue(compiler.compile(source, level)['success'])
+
+    def test_symbol_destination_keeps_register_source(self):
+        result = X86Compiler().compile('mov eax, 5\nadd var, eax\nret', 'standard')
+        self.assertNotIn('add var, 5', result['compiled_code'])
+
+    def test_sized_memory_destination_takes_constant(self):
+        result = X86Compiler().compile('mov eax, 5\nadd dword [rbx], eax\nret', 'standard')
+        self.assertIn('add dword [rbx], 5', result['compiled_code'])
+
+    def test_lea_of_symbol_is_unknown(self):
+        state = {'rax': 7, 'rbx': 1}
+        for line in ('lea eax, var', 'lea eax, array[ebx*4]'):
+            with self.subTest(line=line):
+                after = dict(state)
+                execute(parse_line(line)[0], after)
+                self.assertNotIn('rax', after)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from compiler.ir import parse_lines
+from compiler.scheduler import schedule_block
+from compiler.x86_compiler import X86Compiler
+
+
+class ScheduleBlockTest(unittest.TestCase):
+
+    def test_label_after_comment_stays_first(self):
+        block = parse_lines(['; entry', 'L1:', 'imul rax, rsi', 'mov rcx, [rbp-8]', 'ret'])
+        scheduled = schedule_block(block, 16)
+        self.assertIsNotNone(scheduled)
+        self.assertEqual(scheduled[1].label, 'L1')
+        self.assertTrue(all(entry.opcode is None for entry in scheduled[:2]))
+
+    def test_label_inside_block_is_not_moved(self):
+        block = parse_lines(['imul rax, rsi', 'L1:', 'mov rcx, [rbp-8]', 'ret'])
+        self.assertIsNone(schedule_block(block, 16))
+
+    def test_load_is_not_hoisted_above_jump_target(self):
+        source = 'jmp L1\nmov rbx, rbx\nL1:\nimul rax, rsi\nmov rcx, [rbp-8]\nret'
+        result = X86Compiler().compile(source, 'aggressive')
+        lines = result['compiled_code'].split('\n')
+        self.assertIn('mov rcx, [rbp-8]', lines)
+        self.assertGreater(lines.index('mov rcx, [rbp-8]'), lines.index('L1:'))
+
+
+if __name__ == '__main__':
+    unittest.main()
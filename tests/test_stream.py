@@ -0,0 +1,50 @@
+import unittest
+
+from compiler.emulator import EmulatedProgram
+from compiler.ir import parse_lines
+from compiler.x86_compiler import X86Compiler
+
+INPUTS = [{'rax': 0, 'rbx': 1, 'rcx': 8, 'rdx': 3}, {'rax': 1, 'rbx': 7, 'rcx': 5, 'rdx': 0},
+          {'rax': -2, 'rbx': 0, 'rcx': 1, 'rdx': 9}]
+
+# Labels reached from an earlier chunk than their own
+BRANCH_ACROSS_CHUNKS = ('cmp eax, 0\nje skip\nmov ebx, 7\njmp L\nskip:\nmov ebx, 1\nL:\ncmp ebx, 1\nje done\n'
+                        'mov ecx, 99\ndone:\nret')
+# esi is only set on the fall-through path into L, which the first chunk jumps over
+VALUE_ACROSS_CHUNKS = ('cmp eax, 0\nje L\nmov ecx, 1\njmp M\nM:\nlea esi, [edx+4]\nmov ebx, [esi]\nL:\n'
+                       'lea edi, [edx+4]\nmov eax, edi\nadd eax, esi\nret')
+COUNTED_LOOP = 'mov eax, 0\njmp top\ntop:\nadd eax, edx\nlea esi, [edx+2]\ndec ecx\njnz top\nadd eax, esi\nret'
+
+
+class StreamEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compiler = X86Compiler()
+        self.compiler.optimizer.stream_chunk_size = 4
+
+    def assertSameBehaviour(self, source, level):
+        baseline = self.compiler.translate(source)
+        whole = parse_lines(self.compiler.compile(source, level)['compiled_code'].split('\n'))
+        streamed = parse_lines(list(self.compiler.compile_stream(source.split('\n'), level)))
+        for inputs in INPUTS:
+            expected = EmulatedProgram(baseline).run(inputs)['registers']
+            for program in (whole, streamed):
+                self.assertEqual(EmulatedProgram(program).run(inputs)['registers'], expected, (level, inputs))
+
+    def test_branch_across_chunks_is_not_folded(self):
+        streamed = list(self.compiler.compile_stream(BRANCH_ACROSS_CHUNKS.split('\n'), 'standard'))
+        self.assertIn('je done', streamed)
+        self.assertFalse(any(line.startswith('; Removed unreachable') for line in streamed))
+
+    def test_value_from_another_chunk_is_not_reused(self):
+        streamed = list(self.compiler.compile_stream(VALUE_ACROSS_CHUNKS.split('\n'), 'standard'))
+        self.assertFalse(any('Reused register value' in line for line in streamed))
+
+    def test_stream_matches_compile(self):
+        for source in (BRANCH_ACROSS_CHUNKS, VALUE_ACROSS_CHUNKS, COUNTED_LOOP):
+            for level in ('standard', 'aggressive'):
+                self.assertSameBehaviour(source, level)
+
+
+if __name__ == '__main__':
+    unittest.main()